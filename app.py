@@ -4,14 +4,17 @@ Chess Puzzle Web Application
 Flask-based web server for the chess puzzle game.
 """
 
-from flask import Flask, render_template, request, jsonify, session, make_response
+from flask import Flask, render_template, request, jsonify, session, make_response, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sys
 import os
 import re
 import secrets
-import random
-from datetime import datetime
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
 
 # Optional imports for rate limiting
 try:
@@ -26,21 +29,45 @@ except ImportError:
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 try:
-    from src.board import ChessBoard
     from src.puzzle import ChessPuzzle
+    from src.puzzle_store import get_puzzle_store, is_puzzle_store_loaded, DIFFICULTY_RATING_RANGES
 except ImportError:
     # Fallback for direct imports
-    from src.board import ChessBoard
     from src.puzzle import ChessPuzzle
+    from src.puzzle_store import get_puzzle_store, is_puzzle_store_loaded, DIFFICULTY_RATING_RANGES
+
+from config import Config
 
 # Import leaderboard
 from leaderboard import Leaderboard
+from sessions import create_game_state_store, DEFAULT_RATING, SQLiteGameStateStore, SessionConflict
+from game_tokens import GameTokenStore, InvalidGameToken
+import metrics
+import tracing
+import profiling
+from src.board import parse_position
+from src.puzzle import build_ply_table
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON handling, with request parsing and response encoding traced."""
+    
+    def dumps(self, obj, **kwargs):
+        with tracing.span('json.dumps'):
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        with tracing.span('json.loads'):
+            return super().loads(s, **kwargs)
 
 app = Flask(__name__)
+app.json = TracedJSONProvider(app)
 
 # Use environment variable for secret key, fallback to random generation
 app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 
+# Set RATELIMIT_ENABLED=false to switch rate limits off, e.g. for load tests
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+
 # Configure CORS more securely
 CORS(app, origins=['https://yourdomain.com', 'http://localhost:5000'], 
      supports_credentials=True)
@@ -59,18 +86,69 @@ else:
             def decorator(f):
                 return f
             return decorator
+        def exempt(self, f):
+            return f
     limiter = DummyLimiter()
 
-# Global game state (in production, use a proper database)
-game_state = {
-    'current_puzzle': None,
-    'current_puzzle_id': None,
-    'consecutive_wins': 0,
-    'total_puzzles_solved': 0
-}
+# Metrics served at /metrics (see metrics.py); workers share them through METRICS_DIRECTORY
+metrics.configure(Config.METRICS_DIRECTORY)
+tracing.configure(Config.TRACE_FILE, Config.TRACE_THRESHOLD_MS, Config.TRACE_SAMPLE_RATE)
+# Before the puzzle store and leaderboard load, so tracemalloc can see their allocations
+profiling.configure(Config.PROFILING_TOKEN, Config.PROFILE_DIRECTORY, Config.PROFILING_TRACEMALLOC)
+REQUESTS_TOTAL = metrics.Counter('chess_puzzle_http_requests_total', 'HTTP requests handled',
+                                 ('route', 'method', 'status'))
+REQUEST_SECONDS = metrics.Histogram('chess_puzzle_http_request_duration_seconds', 'Time to handle an HTTP request',
+                                    ('route',))
+OPERATION_SECONDS = metrics.Histogram('chess_puzzle_operation_seconds', 'Time spent in puzzle and chess operations',
+                                      ('operation',))
+
+@app.before_request
+def start_request_timer():
+    """Start timing the request and open its root trace span."""
+    g.request_started = time.perf_counter()
+    if tracing.is_enabled():
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.trace_span = tracing.span(f'{request.method} {route}', root=True, kind=tracing.KIND_SERVER,
+                                    **{'http.method': request.method, 'http.route': route}).start()
+    if profiling.is_enabled():
+        g.profiled = profiling.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and its latency under its route pattern (not the raw path)."""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route)
+        REQUESTS_TOTAL.inc(route, request.method, str(response.status_code))
+    
+    trace_span = g.get('trace_span')
+    if trace_span is not None:
+        trace_span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            trace_span.set_error(f'HTTP {response.status_code}')
+    return response
+
+@app.teardown_request
+def finish_request_trace(error):
+    """Close the request's root span; this decides whether the trace is kept."""
+    trace_span = g.pop('trace_span', None)
+    if trace_span is not None:
+        trace_span.finish(error)
+    profiled = g.pop('profiled', None)
+    if profiled is not None:
+        profiling.finish_request(*profiled)
+
+def get_session_id():
+    """Get the current player's session ID, assigning one on first visit."""
+    session_id = session.get('sid')
+    if not session_id:
+        session_id = secrets.token_urlsafe(16)
+        session['sid'] = session_id
+    return session_id
 
 # Cache busting version - change this to force cache refresh
-APP_VERSION = '1.37.0'  # Force version for fixed celebration display timing
+APP_VERSION = '1.38.0'  # Force version for conditional leaderboard requests
 
 # Initialize leaderboard with environment-specific filename
 # Use different leaderboard files for local development vs production
@@ -83,7 +161,31 @@ else:
     leaderboard_filename = 'leaderboard.json'
     print(f"Using production leaderboard: {leaderboard_filename}")
 
-leaderboard = Leaderboard(leaderboard_filename)
+leaderboard = Leaderboard(leaderboard_filename, max_entries=Config.LEADERBOARD_SIZE)
+
+def warm_up_puzzle_store():
+    """Load (and validate) the puzzle database off the import path."""
+    try:
+        with OPERATION_SECONDS.time('puzzle_load'):
+            get_puzzle_store(Config.PUZZLE_DATABASE)
+    except Exception as e:
+        print(f"Warning: Puzzle store warm-up failed: {e}")
+
+# Start loading puzzles now so the first request rarely waits; requests that
+# arrive earlier block on the store's load lock instead of failing. Puzzle
+# validation's worker processes re-import this module as __mp_main__ when the
+# app is run directly, and must not load the store again.
+if __name__ != '__mp_main__':
+    threading.Thread(target=warm_up_puzzle_store, name='puzzle-store-warm-up', daemon=True).start()
+
+# Puzzle selection mode that follows the player's rating estimate
+ADAPTIVE_MODE = 'adaptive'
+
+# Largest batch served by /api/prefetch-puzzles
+MAX_PREFETCH_COUNT = 20
+
+# Serialized /api/leaderboard body as (version, etag, body), rebuilt only when the version changes
+leaderboard_body_cache = None
 
 # Input validation functions
 def validate_uci_move(move):
@@ -98,6 +200,24 @@ def validate_difficulty(difficulty):
     """Validate difficulty parameter."""
     return difficulty in ['easy', 'hard', 'hikaru']
 
+def validate_puzzle_mode(mode):
+    """Validate the puzzle selection mode: a difficulty or the adaptive mode."""
+    return validate_difficulty(mode) or mode == ADAPTIVE_MODE
+
+def validate_rating(rating):
+    """Validate an optional puzzle rating bound."""
+    if rating is None:
+        return True
+    return isinstance(rating, int) and not isinstance(rating, bool) and 0 <= rating <= 4000
+
+def validate_themes(themes):
+    """Validate an optional list of puzzle theme names."""
+    if themes is None:
+        return True
+    if not isinstance(themes, list) or len(themes) > 10:
+        return False
+    return all(isinstance(theme, str) and re.match(r'^[A-Za-z0-9]{1,40}$', theme) for theme in themes)
+
 def sanitize_player_name(name):
     """Sanitize player name input."""
     if not name:
@@ -106,64 +226,9 @@ def sanitize_player_name(name):
     sanitized = re.sub(r'[^a-zA-Z0-9\s\-]', '', str(name))
     return sanitized.strip()[:20]  # Limit to 20 characters
 
-def generate_puzzle_description(original_description, player_color, puzzle_data):
-    """Generate a better puzzle description based on player color and puzzle data."""
-    # Convert player color to proper case
-    color_name = player_color.capitalize()
-    
-    # Check if the original description has specific tactical themes
-    original_lower = original_description.lower()
-    
-    # Define common tactical themes and their descriptions
-    tactical_themes = {
-        'fork': f"{color_name} to move and fork",
-        'pin': f"{color_name} to move and pin",
-        'skewer': f"{color_name} to move and skewer",
-        'discovered attack': f"{color_name} to move with discovered attack",
-        'double attack': f"{color_name} to move with double attack",
-        'back rank': f"{color_name} to move and checkmate on back rank",
-        'checkmate': f"{color_name} to move and checkmate",
-        'mate': f"{color_name} to move and checkmate",
-        'win material': f"{color_name} to move and win material",
-        'capture': f"{color_name} to move and capture",
-        'check': f"{color_name} to move and check",
-        'promote': f"{color_name} to move and promote",
-        'defend': f"{color_name} to move and defend",
-        'block': f"{color_name} to move and block",
-        'escape': f"{color_name} to move and escape",
-        'sacrifice': f"{color_name} to move and sacrifice",
-        'zugzwang': f"{color_name} to move and create zugzwang",
-        'gain advantage': f"{color_name} to gain advantage",
-        'advantage': f"{color_name} to gain advantage",
-        'tactical advantage': f"{color_name} to gain tactical advantage",
-        'positional advantage': f"{color_name} to gain positional advantage"
-    }
-    
-    # Check for specific themes in the original description
-    for theme, description in tactical_themes.items():
-        if theme in original_lower:
-            return description
-    
-    # Check for themes in puzzle data if available
-    if 'themes' in puzzle_data and puzzle_data['themes']:
-        themes = puzzle_data['themes']
-        if isinstance(themes, list):
-            themes = ' '.join(themes).lower()
-        else:
-            themes = str(themes).lower()
-        
-        # Check themes for specific tactical patterns
-        for theme, description in tactical_themes.items():
-            if theme in themes:
-                return description
-    
-    # If no specific theme found, use a generic description
-    return f"{color_name} to move"
-
 @app.route('/')
 def index():
     """Main game page."""
-    print(f"DEBUG: APP_VERSION = {APP_VERSION}")  # Debug print
     response = make_response(render_template('index.html', version=APP_VERSION))
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
@@ -185,199 +250,312 @@ def shared_puzzle(puzzle_id):
     """Serve a shared puzzle page."""
     return render_template('index.html', version=APP_VERSION, shared_puzzle_id=puzzle_id)
 
+@tracing.traced('puzzle_store.lookup')
+def find_puzzle(store, puzzle_id):
+    """Find the store position of a shared-link puzzle ID, or None."""
+    return store.index_of(puzzle_id)
+
+@tracing.traced('puzzle.build')
+def build_chess_puzzle(store, index, puzzle=None):
+    """Create a playable ChessPuzzle from the puzzle at a store position."""
+    if puzzle is None:
+        puzzle = store.get(index)
+    
+    # Keep coordinates consistent - no conversion needed
+    # The frontend will handle the visual flip while maintaining coordinate consistency
+    return ChessPuzzle(puzzle['fen'], puzzle['solution'], store.get_description(index))
+
+def load_session_puzzle(puzzle_index, puzzle_id, move_index):
+    """Rebuild a saved session's puzzle at its move index."""
+    store = get_puzzle_store(Config.PUZZLE_DATABASE)
+    if puzzle_index >= len(store) or store.get_id(puzzle_index) != puzzle_id:
+        # The puzzle database changed since the session was saved
+        puzzle_index = find_puzzle(store, puzzle_id)
+        if puzzle_index is None:
+            return None, None
+    
+    chess_puzzle = build_chess_puzzle(store, puzzle_index)
+    chess_puzzle.restore_progress(move_index)
+    return chess_puzzle, puzzle_index
+
+# Per-player game state: either kept on the server, keyed by a random ID in the
+# Flask session cookie, or carried by the client in signed tokens (token mode)
+GAME_TOKEN_HEADER = 'X-Game-Token'
+GAME_TOKEN_ENDPOINTS = {'get_specific_puzzle', 'new_puzzle', 'prefetch_puzzles', 'make_move',
+                        'game_stats', 'reset_game', 'get_hint', 'add_score'}
+
+if Config.SESSION_BACKEND == 'token':
+    game_tokens = GameTokenStore(app.secret_key, load_session_puzzle,
+                                 ttl_seconds=Config.SESSION_TTL_SECONDS,
+                                 nonce_window=Config.GAME_TOKEN_NONCE_WINDOW,
+                                 nonce_database=Config.GAME_TOKEN_DATABASE)
+    game_sessions = None
+else:
+    game_tokens = None
+    game_sessions = create_game_state_store(Config.SESSION_BACKEND, load_session_puzzle,
+                                            path=Config.SESSION_DATABASE,
+                                            max_sessions=Config.SESSION_MAX_COUNT,
+                                            ttl_seconds=Config.SESSION_TTL_SECONDS)
+
+def cache_statistics():
+    """(hits, misses) of this worker's caches."""
+    stats = {}
+    for name, cached in (('position', parse_position), ('ply_table', build_ply_table)):
+        info = cached.cache_info()
+        stats[name] = (info.hits, info.misses)
+    if isinstance(game_sessions, SQLiteGameStateStore):
+        stats['session'] = (game_sessions.cache_hits, game_sessions.cache_misses)
+    return stats
+
+def cache_hit_ratios(totals):
+    """Hit ratio of each cache from the hit and miss counters summed over all workers."""
+    ratios = {}
+    for (name, labels), hits in totals.items():
+        if name == 'chess_puzzle_cache_hits_total':
+            lookups = hits + totals.get(('chess_puzzle_cache_misses_total', labels), 0)
+            if lookups:
+                ratios[labels] = hits / lookups
+    return ratios
+
+CACHE_HITS = metrics.Counter('chess_puzzle_cache_hits_total', 'Cache lookups that found an entry', ('cache',))
+CACHE_HITS.set_function(lambda: {(name,): hits for name, (hits, _) in cache_statistics().items()})
+CACHE_MISSES = metrics.Counter('chess_puzzle_cache_misses_total', 'Cache lookups that missed', ('cache',))
+CACHE_MISSES.set_function(lambda: {(name,): misses for name, (_, misses) in cache_statistics().items()})
+CACHE_HIT_RATIO = metrics.Gauge('chess_puzzle_cache_hit_ratio', 'Fraction of cache lookups that hit', ('cache',))
+CACHE_HIT_RATIO.set_derived(cache_hit_ratios)
+
+# Every worker counts the same SQLite table, so take one worker's count rather than the sum
+SESSIONS = metrics.Gauge('chess_puzzle_sessions', 'Live player sessions kept on the server',
+                         aggregate='max' if isinstance(game_sessions, SQLiteGameStateStore) else 'sum')
+if game_sessions is not None:
+    SESSIONS.set_function(lambda: {(): len(game_sessions)})
+
+@app.before_request
+def redeem_game_token():
+    """In token mode, verify the request's game token and rebuild its state."""
+    if game_tokens is None or request.endpoint not in GAME_TOKEN_ENDPOINTS:
+        return None
+    
+    # Reading stats does not use up the token
+    consume = request.endpoint != 'game_stats'
+    try:
+        g.game_state = game_tokens.redeem(request.headers.get(GAME_TOKEN_HEADER), consume=consume)
+    except InvalidGameToken as e:
+        return jsonify({'success': False, 'error': str(e)}), 401
+    g.game_token_consumed = consume
+    return None
+
+@app.after_request
+def issue_game_token(response):
+    """In token mode, return a fresh token for every token that was used up."""
+    if g.get('game_token_consumed'):
+        response.headers[GAME_TOKEN_HEADER] = game_tokens.issue(g.game_state)
+    return response
+
+@contextmanager
+def checkout_game_state():
+    """Hold the current player's game state for the duration of a request."""
+    if game_tokens is not None:
+        yield g.game_state
+    else:
+        with game_sessions.checkout(get_session_id()) as state:
+            yield state
+
+def peek_game_state():
+    """Get the current player's game state without creating it, or None."""
+    if game_tokens is not None:
+        return g.game_state
+    return game_sessions.peek(session.get('sid', ''))
+
+@tracing.traced('puzzle.describe')
+def describe_for_client(store, puzzle_index, puzzle=None):
+    """Build the client-facing fields of the puzzle at a store position."""
+    if puzzle is None:
+        puzzle = store.get(puzzle_index)
+    
+    # Count moves for the player's color (every other move starting from index 0)
+    player_moves_count = (len(puzzle['solution']) + 1) // 2
+    
+    return {
+        'fen': puzzle['fen'],
+        'description': store.get_description(puzzle_index),
+        'moves_required': player_moves_count,
+        'player_color': puzzle['player_color'],
+        'puzzle_id': store.get_id(puzzle_index)
+    }
+
+def activate_puzzle(state, store, puzzle_index, puzzle=None):
+    """Make the puzzle at a store position the player's active one."""
+    if puzzle is None:
+        puzzle = store.get(puzzle_index)
+    state.current_puzzle = build_chess_puzzle(store, puzzle_index, puzzle)
+    state.current_puzzle_id = store.get_id(puzzle_index)
+    state.current_puzzle_index = puzzle_index
+    state.player_color = puzzle['player_color']
+    state.puzzle_rated = False
+
+def record_puzzle_result(state, solved):
+    """Update the player's rating estimate with a result on the active puzzle."""
+    store = get_puzzle_store(Config.PUZZLE_DATABASE)
+    index = state.current_puzzle_index
+    if index is not None and index < len(store) and store.get_id(index) == state.current_puzzle_id:
+        state.record_result(store.get_rating(index), solved)
+
+def start_puzzle(state, store, puzzle_index):
+    """Make the puzzle at a store position the player's active one and build its API response."""
+    puzzle = store.get(puzzle_index)
+    activate_puzzle(state, store, puzzle_index, puzzle)
+    
+    response = {'success': True}
+    response.update(describe_for_client(store, puzzle_index, puzzle))
+    return jsonify(response)
+
+def switch_to_puzzle(state, puzzle_id):
+    """
+    Make a prefetched puzzle the active one when the client starts playing it.
+    
+    Returns False if there is no puzzle with that ID.
+    """
+    if not puzzle_id or (state.current_puzzle is not None and puzzle_id == state.current_puzzle_id):
+        return True
+    
+    store = get_puzzle_store(Config.PUZZLE_DATABASE)
+    index = find_puzzle(store, puzzle_id) if isinstance(puzzle_id, str) else None
+    if index is None:
+        return False
+    activate_puzzle(state, store, index)
+    return True
+
 @app.route('/api/get-puzzle/<puzzle_id>')
 def get_specific_puzzle(puzzle_id):
     """Get a specific puzzle by ID."""
     try:
-        # Load puzzles from JSON file
-        import json
-        import hashlib
+        store = get_puzzle_store(Config.PUZZLE_DATABASE)
+        index = find_puzzle(store, puzzle_id)
         
-        try:
-            with open('puzzles_combined.json', 'r') as f:
-                puzzle_data = json.load(f)
-            
-            # Find puzzle by ID
-            target_puzzle = None
-            for puzzle in puzzle_data['puzzles']:
-                puzzle_content = f"{puzzle['fen']}{puzzle['solution']}{puzzle.get('rating', 0)}"
-                current_puzzle_id = hashlib.md5(puzzle_content.encode()).hexdigest()[:8]
-                if current_puzzle_id == puzzle_id:
-                    target_puzzle = puzzle
-                    break
-            
-            if not target_puzzle:
-                return jsonify({'success': False, 'error': 'Puzzle not found'}), 404
-            
-            initial_fen = target_puzzle['fen']
-            solution_moves = target_puzzle['solution']
-            original_description = target_puzzle['description']
-            player_color = target_puzzle['player_color']
-            
-            # Generate better description
-            description = generate_puzzle_description(original_description, player_color, target_puzzle)
-            
-            # Add puzzle rating to description if available
-            if 'rating' in target_puzzle:
-                rating = target_puzzle['rating']
-                rounded_rating = round(rating / 50) * 50
-                description = f"{description} (Rated {rounded_rating})"
-            
-            chess_puzzle = ChessPuzzle(initial_fen, solution_moves, description)
-            game_state['current_puzzle'] = chess_puzzle
-            game_state['current_puzzle_id'] = puzzle_id
-            game_state['player_color'] = player_color
-            
-            # Count moves for the player's color
-            if player_color == "white":
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            else:
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            
-            return jsonify({
-                'success': True,
-                'fen': initial_fen,
-                'description': description,
-                'moves_required': player_moves_count,
-                'player_color': player_color,
-                'puzzle_id': puzzle_id
-            })
-            
-        except Exception as e:
+        if index is None:
             return jsonify({'success': False, 'error': 'Puzzle not found'}), 404
+        
+        with checkout_game_state() as state:
+            return start_puzzle(state, store, index)
             
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def parse_puzzle_filters(data):
+    """
+    Parse the puzzle selection parameters of a request.
+    
+    Returns:
+        ((difficulty, min_rating, max_rating, themes, exclude_themes), None), or (None, error message)
+    """
+    # Get difficulty mode from request
+    difficulty = data.get('difficulty', 'easy')  # Default to easy mode
+    
+    # Validate difficulty parameter
+    if not validate_puzzle_mode(difficulty):
+        return None, 'Invalid difficulty parameter'
+    
+    # Optional rating window; each missing bound defaults to the difficulty's
+    # (in adaptive mode, to a rating band centred on the player's rating)
+    min_rating = data.get('min_rating')
+    max_rating = data.get('max_rating')
+    if not validate_rating(min_rating) or not validate_rating(max_rating):
+        return None, 'Invalid rating parameter'
+    
+    if difficulty != ADAPTIVE_MODE:
+        default_min, default_max = DIFFICULTY_RATING_RANGES[difficulty]
+        min_rating = default_min if min_rating is None else min_rating
+        max_rating = default_max if max_rating is None else max_rating
+    if min_rating is not None and max_rating is not None and min_rating > max_rating:
+        return None, 'Invalid rating parameter'
+    
+    # Optional theme filters: every theme in 'themes', none in 'exclude_themes'
+    themes = data.get('themes')
+    exclude_themes = data.get('exclude_themes')
+    if not validate_themes(themes) or not validate_themes(exclude_themes):
+        return None, 'Invalid themes parameter'
+    
+    return (difficulty, min_rating, max_rating, tuple(themes or ()), tuple(exclude_themes or ())), None
 
+@OPERATION_SECONDS.time('puzzle_select')
+@tracing.traced('puzzle_store.select')
+def select_puzzles(state, store, filters, count):
+    """
+    Select up to count distinct puzzles for a player.
+    
+    Plain rating windows continue the player's shuffled walk through the
+    window, so no puzzle repeats until the whole window has been served.
+    Theme-filtered selections are drawn at random from the matching puzzles.
+    In adaptive mode the window is a rating band centred on the player's rating.
+    """
+    difficulty, min_rating, max_rating, themes, exclude_themes = filters
+    if difficulty == ADAPTIVE_MODE:
+        window_min, window_max = store.rating_window(state.rating)
+        min_rating = window_min if min_rating is None else min_rating
+        max_rating = window_max if max_rating is None else max_rating
+    
+    if themes or exclude_themes:
+        return store.sample_indexes(count, min_rating, max_rating, themes, exclude_themes)
+    
+    indexes, state.sample_counter = store.sample_sequence(state.sample_seed, state.sample_counter,
+                                                          count, min_rating, max_rating)
+    return indexes
 
 @app.route('/api/new-puzzle', methods=['POST'])
 @limiter.limit("30 per minute")
 def new_puzzle():
     """Generate a new puzzle for the player."""
     try:
-        # Get difficulty mode from request
         data = request.get_json() or {}
-        difficulty = data.get('difficulty', 'easy')  # Default to easy mode
+        filters, error = parse_puzzle_filters(data)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        # Validate difficulty parameter
-        if not validate_difficulty(difficulty):
-            return jsonify({'success': False, 'error': 'Invalid difficulty parameter'}), 400
+        store = get_puzzle_store(Config.PUZZLE_DATABASE)
+        with checkout_game_state() as state:
+            indexes = select_puzzles(state, store, filters, 1)
+            if not indexes:
+                return jsonify({'success': False, 'error': 'No puzzles match the filters'}), 404
+            return start_puzzle(state, store, indexes[0])
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/prefetch-puzzles', methods=['POST'])
+@limiter.limit("10 per minute")
+def prefetch_puzzles():
+    """
+    Get a batch of distinct puzzles for the client to queue.
+    
+    The puzzles are not started; the client sends a queued puzzle's ID with
+    its first move or hint request to make it the active one.
+    """
+    try:
+        data = request.get_json() or {}
+        filters, error = parse_puzzle_filters(data)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        # Load puzzles from JSON file
-        import json
+        count = data.get('count', 10)
+        if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_PREFETCH_COUNT:
+            return jsonify({'success': False, 'error': 'Invalid count parameter'}), 400
         
-        try:
-            with open('puzzles_combined.json', 'r') as f:
-                puzzle_data = json.load(f)
-            
-            # Filter puzzles by difficulty
-            if difficulty == 'easy':
-                # Easy mode: puzzles rated 400-1500
-                filtered_puzzles = [p for p in puzzle_data['puzzles'] 
-                                 if 'rating' in p and 400 <= p['rating'] <= 1500]
-            elif difficulty == 'hard':
-                # Hard mode: puzzles rated 1500-2000
-                filtered_puzzles = [p for p in puzzle_data['puzzles'] 
-                                 if 'rating' in p and 1500 <= p['rating'] <= 2000]
-            elif difficulty == 'hikaru':
-                # Hikaru mode: puzzles rated 1800-3050
-                filtered_puzzles = [p for p in puzzle_data['puzzles'] 
-                                 if 'rating' in p and 1800 <= p['rating'] <= 3050]
-            else:
-                # Default to all puzzles if difficulty not specified
-                filtered_puzzles = puzzle_data['puzzles']
-            
-            # If no puzzles found for the difficulty, fall back to all puzzles
-            if not filtered_puzzles:
-                filtered_puzzles = puzzle_data['puzzles']
-            
-            # Randomly select a puzzle from filtered list
-            puzzle = random.choice(filtered_puzzles)
-            
-            # Generate a unique puzzle ID based on content hash
-            import hashlib
-            puzzle_content = f"{puzzle['fen']}{puzzle['solution']}{puzzle.get('rating', 0)}"
-            puzzle_id = hashlib.md5(puzzle_content.encode()).hexdigest()[:8]
-            
-            initial_fen = puzzle['fen']
-            solution_moves = puzzle['solution']
-            original_description = puzzle['description']
-            player_color = puzzle['player_color']
-            
-            # Generate better description based on player color and puzzle data
-            description = generate_puzzle_description(original_description, player_color, puzzle)
-            
-            # Add puzzle rating to description if available
-            if 'rating' in puzzle:
-                rating = puzzle['rating']
-                # Round to nearest 50
-                rounded_rating = round(rating / 50) * 50
-                description = f"{description} (Rated {rounded_rating})"
-            
-            # Keep coordinates consistent - no conversion needed
-            # The frontend will handle the visual flip while maintaining coordinate consistency
-            
-            chess_puzzle = ChessPuzzle(initial_fen, solution_moves, description)
-            game_state['current_puzzle'] = chess_puzzle
-            game_state['current_puzzle_id'] = puzzle_id
-            game_state['player_color'] = player_color
-            
-            # Count moves for the player's color
-            if player_color == "white":
-                # Count white moves (every other move starting from index 0)
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            else:
-                # Count black moves (every other move starting from index 0)
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            
-            return jsonify({
-                'success': True,
-                'fen': initial_fen,
-                'description': description,
-                'moves_required': player_moves_count,
-                'player_color': player_color,
-                'puzzle_id': puzzle_id
-            })
-            
-        except Exception as e:
-            # Fallback to original hardcoded puzzles if JSON fails
-            user_plays_white = random.choice([True, False])
-            
-            if user_plays_white:
-                initial_fen = "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 0 1"
-                solution_moves = ["d2d4", "e5d4", "c4f7"]
-                description = "White to move and win material"
-                player_color = "white"
-            else:
-                initial_fen = "rnbqkb1r/pppp1ppp/5n2/4p3/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
-                solution_moves = ["f6e4", "d2d4", "e4c3"]
-                description = "Black to move and fork"
-                player_color = "black"
-            
-            # Generate fallback puzzle ID
-            fallback_puzzle_content = f"{initial_fen}{solution_moves}"
-            fallback_puzzle_id = hashlib.md5(fallback_puzzle_content.encode()).hexdigest()[:8]
-            
-            chess_puzzle = ChessPuzzle(initial_fen, solution_moves, description)
-            game_state['current_puzzle'] = chess_puzzle
-            game_state['current_puzzle_id'] = fallback_puzzle_id
-            game_state['player_color'] = player_color
-            
-            # Count moves for the player's color
-            if player_color == "white":
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            else:
-                player_moves_count = len([move for i, move in enumerate(solution_moves) if i % 2 == 0])
-            
-            return jsonify({
-                'success': True,
-                'fen': initial_fen,
-                'description': description,
-                'moves_required': player_moves_count,
-                'player_color': player_color,
-                'puzzle_id': fallback_puzzle_id
-            })
+        store = get_puzzle_store(Config.PUZZLE_DATABASE)
+        with checkout_game_state() as state:
+            indexes = select_puzzles(state, store, filters, count)
+        if not indexes:
+            return jsonify({'success': False, 'error': 'No puzzles match the filters'}), 404
+        
+        return jsonify({
+            'success': True,
+            'puzzles': [describe_for_client(store, index) for index in indexes]
+        })
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -396,138 +574,137 @@ def make_move():
         if not validate_uci_move(move_uci):
             return jsonify({'success': False, 'error': 'Invalid move format'}), 400
         
-        if not game_state['current_puzzle']:
-            return jsonify({'success': False, 'error': 'No active puzzle'}), 400
-        
-        puzzle = game_state['current_puzzle']
-        player_color = game_state.get('player_color', 'white')
-        
-        # Check if move is valid
-        is_valid = puzzle.board.is_valid_move(move_uci)
-        
-        if not is_valid:
-            return jsonify({
-                'success': False
-            })
+        with checkout_game_state() as state:
+            # A queued puzzle becomes the active one with its first move
+            if not switch_to_puzzle(state, data.get('puzzle_id')):
+                return jsonify({'success': False, 'error': 'Puzzle not found'}), 404
+            return process_move(state, move_uci)
+            
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@OPERATION_SECONDS.time('move_validation')
+@tracing.traced('chess.is_valid_move')
+def is_legal_move(puzzle, move_uci):
+    """Full legality check of a move that is not the expected one."""
+    return puzzle.board.is_valid_move(move_uci)
+
+def process_move(state, move_uci):
+    """Apply a validated UCI move to the player's active puzzle."""
+    if not state.current_puzzle:
+        return jsonify({'success': False, 'error': 'No active puzzle'}), 400
+    
+    puzzle = state.current_puzzle
+    if puzzle.is_complete():
+        return jsonify({
+            'success': False
+        })
+    
+    # The expected move is a string comparison against the solution line;
+    # anything else needs a full legality check to tell illegal from wrong
+    if puzzle.is_expected_move(move_uci):
+        puzzle.advance()
         
-        # Make the move
-        success = puzzle.board.make_move(move_uci)
-        if not success:
+        # Check if puzzle is complete
+        if puzzle.is_complete():
+            state.consecutive_wins += 1
+            state.total_puzzles_solved += 1
+            record_puzzle_result(state, True)
             return jsonify({
-                'success': False
+                'success': True,
+                'puzzle_complete': True,
+                'moves_required': 0,
+                'consecutive_wins': state.consecutive_wins
             })
-        
-        # Check if this was the correct move
-        expected_move = puzzle.solution_moves[puzzle.current_move_index]
-        
-        if move_uci == expected_move:
-            puzzle.current_move_index += 1
-            
-            # Check if puzzle is complete
-            if puzzle.is_complete():
-                game_state['consecutive_wins'] += 1
-                game_state['total_puzzles_solved'] += 1
+        else:
+            # Make the automatic black response, taking the position from the ply table
+            black_move = puzzle.solution_moves[puzzle.current_move_index]
+            current_fen = puzzle.advance()
+            
+            if current_fen is not None:
+                # Calculate remaining moves for the player's color
+                player_color = state.player_color
+                if player_color == "white":
+                    # Count remaining white moves (every other move starting from current index)
+                    remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 0])
+                else:
+                    # Count remaining black moves (every other move starting from current index + 1)
+                    remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 1]) + 1
+                
                 return jsonify({
                     'success': True,
-                    'puzzle_complete': True,
-                    'moves_required': 0,
-                    'consecutive_wins': game_state['consecutive_wins']
+                    'puzzle_complete': False,
+                    'moves_required': remaining_player_moves,
+                    'black_move': black_move,
+                    'current_fen': current_fen
                 })
             else:
-                # Make the automatic black response
-                if puzzle.current_move_index < len(puzzle.solution_moves):
-                    black_move = puzzle.solution_moves[puzzle.current_move_index]
-                    success = puzzle.board.make_move(black_move)
-                    puzzle.current_move_index += 1
-                    
-                    if success:
-                        # Calculate remaining moves for the player's color
-                        player_color = game_state.get('player_color', 'white')
-                        if player_color == "white":
-                            # Count remaining white moves (every other move starting from current index)
-                            remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 0])
-                            # White player, so Black responds
-                            response_color = "Black"
-                        else:
-                            # Count remaining black moves (every other move starting from current index + 1)
-                            remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 1]) + 1
-                            # Black player, so White responds
-                            response_color = "White"
-                        
-                        return jsonify({
-                            'success': True,
-                            'puzzle_complete': False,
-                            'moves_required': remaining_player_moves,
-                            'black_move': black_move,
-                            'current_fen': puzzle.board.get_fen()
-                        })
-                    else:
-                        return jsonify({
-                            'success': False
-                        })
-                else:
-                    # Calculate remaining moves for the player's color
-                    player_color = game_state.get('player_color', 'white')
-                    if player_color == "white":
-                        # Count remaining white moves (every other move starting from current index)
-                        remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 0])
-                    else:
-                        # Count remaining black moves (every other move starting from current index + 1)
-                        remaining_player_moves = len([move for i, move in enumerate(puzzle.solution_moves[puzzle.current_move_index:]) if i % 2 == 1]) + 1
-                    
-                    return jsonify({
-                        'success': True,
-                        'puzzle_complete': False,
-                        'moves_required': remaining_player_moves
-                    })
-        else:
-            # Wrong move - reset consecutive wins and reset puzzle board
-            game_state['consecutive_wins'] = 0
+                return jsonify({
+                    'success': False
+                })
+    elif not is_legal_move(puzzle, move_uci):
+        return jsonify({
+            'success': False
+        })
+    else:
+        # Wrong move - reset consecutive wins and reset puzzle board
+        if state.consecutive_wins:
+            state.last_streak = state.consecutive_wins
+        state.consecutive_wins = 0
+        record_puzzle_result(state, False)
+        with tracing.span('chess.reset'):
             puzzle.reset()  # Reset the puzzle board to original position
-            return jsonify({
-                'success': False,
-                'consecutive_wins': game_state['consecutive_wins'],
-                'original_fen': puzzle.initial_fen,  # Send the original puzzle FEN
-                'solution_moves': puzzle.solution_moves,  # Send the solution moves
-                'description': puzzle.description  # Send the puzzle description
-            })
-            
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return jsonify({
+            'success': False,
+            'consecutive_wins': state.consecutive_wins,
+            'original_fen': puzzle.initial_fen,  # Send the original puzzle FEN
+            'solution_moves': puzzle.solution_moves,  # Send the solution moves
+            'description': puzzle.description  # Send the puzzle description
+        })
 
 @app.route('/api/game-stats')
 def game_stats():
     """Get current game statistics."""
+    state = peek_game_state()
     return jsonify({
-        'consecutive_wins': game_state['consecutive_wins'],
-        'total_puzzles_solved': game_state['total_puzzles_solved']
+        'consecutive_wins': state.consecutive_wins if state else 0,
+        'total_puzzles_solved': state.total_puzzles_solved if state else 0,
+        'rating': state.rating if state else DEFAULT_RATING
     })
 
 @app.route('/api/reset-game', methods=['POST'])
 def reset_game():
     """Reset the game state."""
-    game_state['consecutive_wins'] = 0
-    game_state['total_puzzles_solved'] = 0
-    game_state['current_puzzle'] = None
+    try:
+        with checkout_game_state() as state:
+            state.reset()
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     return jsonify({'success': True, 'message': 'Game reset!'})
 
 @app.route('/api/get-hint', methods=['POST'])
 def get_hint():
     """Get a hint for the current puzzle."""
     try:
-        if not game_state['current_puzzle']:
-            return jsonify({'success': False, 'message': 'No active puzzle'}), 400
-        
-        puzzle = game_state['current_puzzle']
-        
-        # Check if puzzle is already complete
-        if puzzle.is_complete():
-            return jsonify({'success': False, 'message': 'Puzzle already complete!'}), 400
-        
-        # Get the next move that should be made
-        if puzzle.current_move_index < len(puzzle.solution_moves):
-            next_move = puzzle.solution_moves[puzzle.current_move_index]
+        data = request.get_json(silent=True) or {}
+        with checkout_game_state() as state:
+            if not switch_to_puzzle(state, data.get('puzzle_id')):
+                return jsonify({'success': False, 'message': 'Puzzle not found'}), 404
+            if not state.current_puzzle:
+                return jsonify({'success': False, 'message': 'No active puzzle'}), 400
+            
+            puzzle = state.current_puzzle
+            
+            # Check if puzzle is already complete
+            if puzzle.is_complete():
+                return jsonify({'success': False, 'message': 'Puzzle already complete!'}), 400
             
+            # Get the next move that should be made
+            next_move = puzzle.get_hint()
+        
+        if next_move:
             # Extract the source square (first 2 characters of the move)
             source_square = next_move[:2]
             
@@ -539,25 +716,45 @@ def get_hint():
         else:
             return jsonify({'success': False, 'message': 'No more moves available'}), 400
             
+    except SessionConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def get_leaderboard_body():
+    """Get the ETag and serialized body of the current leaderboard version."""
+    global leaderboard_body_cache
+    version, data = leaderboard.snapshot()
+    cached = leaderboard_body_cache
+    if cached is None or cached[0] != version:
+        body = app.json.dumps({
+            'success': True,
+            'leaderboard': data
+        }).encode('utf-8')
+        # The content hash keeps ETags correct even if two workers briefly share a version
+        etag = f"{version}-{hashlib.sha1(body).hexdigest()[:16]}"
+        cached = (version, etag, body)
+        leaderboard_body_cache = cached
+    return cached[1], cached[2]
+
 @app.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
     """Get leaderboard data for both modes."""
     try:
-        data = leaderboard.get_leaderboard_data()
-        response = jsonify({
-            'success': True,
-            'leaderboard': data
-        })
+        etag, body = get_leaderboard_body()
         
-        # Enhanced cache-busting headers for mobile browsers
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, private'
+        # Unchanged since the client's copy - nothing to send
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(body)
+            response.mimetype = 'application/json'
+        
+        # Clients may keep a copy but must revalidate it on every request
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache, private'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
-        response.headers['Last-Modified'] = datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT')
-        response.headers['ETag'] = f'"{hash(str(data))}"'
         
         return response
     except Exception as e:
@@ -603,6 +800,14 @@ def add_score():
         if not isinstance(score, int) or score < 0 or score > 10000:
             return jsonify({'success': False, 'error': 'Invalid score value'}), 400
         
+        # In token mode the score must be a streak the token shows was actually played,
+        # and each streak can only be submitted once
+        if game_tokens is not None:
+            with checkout_game_state() as state:
+                if score > state.last_streak:
+                    return jsonify({'success': False, 'error': 'Score does not match a finished streak'}), 403
+                state.last_streak = 0
+        
         # Sanitize player name
         sanitized_name = sanitize_player_name(player_name)
         
@@ -659,6 +864,82 @@ def convert_square_coordinate(square):
     
     return new_file + new_rank
 
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Metrics in the Prometheus text format, aggregated across workers."""
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return response
+
+@app.route('/api/ready')
+@limiter.exempt
+def ready():
+    """Readiness check: 503 until the puzzle store and leaderboard have warmed up."""
+    puzzles_ready = is_puzzle_store_loaded()
+    leaderboard_status = leaderboard.status()
+    is_ready = puzzles_ready and leaderboard_status['ready']
+    return jsonify({
+        'ready': is_ready,
+        'puzzles': puzzles_ready,
+        'leaderboard': leaderboard_status
+    }), 200 if is_ready else 503
+
+def check_profiling_token():
+    """Error response unless profiling is on and the request carries its token, else None."""
+    if not profiling.is_enabled():
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    if not profiling.is_authorized(request.headers.get('X-Profiling-Token')):
+        return jsonify({'success': False, 'error': 'Invalid profiling token'}), 403
+    return None
+
+@app.route('/debug/profile', methods=['GET', 'POST'])
+@limiter.exempt
+def profile():
+    """Start a CPU profile of this worker (POST), or show the running one (GET)."""
+    denied = check_profiling_token()
+    if denied:
+        return denied
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'profile': profiling.status()})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        started = profiling.start(
+            str(data.get('mode', 'sampler')),
+            duration=float(data.get('duration', profiling.DEFAULT_DURATION)),
+            interval_ms=float(data.get('interval_ms', profiling.DEFAULT_INTERVAL_MS)),
+            one_in=int(data.get('one_in', profiling.DEFAULT_ONE_IN))
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except OSError as e:
+        return jsonify({'success': False, 'error': f'Could not create profile directory: {e}'}), 500
+    return jsonify({'success': True, 'profile': started}), 202
+
+@app.route('/debug/memory', methods=['POST', 'DELETE'])
+@limiter.exempt
+def memory_snapshot():
+    """
+    Take a tracemalloc snapshot of this worker, attributed to the puzzle store,
+    sessions and leaderboard (POST), or stop memory tracing (DELETE).
+    """
+    denied = check_profiling_token()
+    if denied:
+        return denied
+    
+    if request.method == 'DELETE':
+        return jsonify({'success': True, 'stopped': profiling.stop_memory_tracing()})
+    
+    try:
+        snapshot = profiling.memory_snapshot()
+    except OSError as e:
+        return jsonify({'success': False, 'error': f'Could not write memory report: {e}'}), 500
+    return jsonify({'success': True, 'memory': snapshot})
+
 if __name__ == '__main__':
     # Production configuration
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
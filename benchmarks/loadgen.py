@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load generator for the chess puzzle game.
+Simulates concurrent players going through the real game flow: a new
+puzzle, its moves (sometimes a wrong one), hints, and now and then a
+leaderboard check or a score submission when a streak ends.
+
+Traffic goes over HTTP to a running server, or through Flask's test
+client in-process. Each request can be recorded to a JSONL file and
+replayed later, with its original timing or sped up.
+
+Usage:
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --players 20 --duration 60
+    python benchmarks/loadgen.py --wsgi --players 8 --duration 30 --record traffic.jsonl
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 --replay traffic.jsonl --speed 2
+
+Start the server with RATELIMIT_ENABLED=false, or most requests will be
+rate limited. In --wsgi mode rate limits are switched off automatically.
+Simulated players submit real scores, so point it at a development
+server (FLASK_ENV=development uses leaderboard_local.json), not production.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import chess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.puzzle_store import PuzzleStore
+
+GAME_TOKEN_HEADER = 'X-Game-Token'
+DIFFICULTY_WEIGHTS = {'easy': 0.6, 'hard': 0.3, 'hikaru': 0.1}
+PERCENTILES = (50, 95, 99)
+
+
+class HttpTarget:
+    """Sends requests to a running server over HTTP, one keep-alive session per player."""
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def new_client(self):
+        return self.requests.Session()
+
+    def send(self, client, method, path, body, headers):
+        response = client.request(method, self.base_url + path, json=body, headers=headers,
+                                  timeout=self.timeout)
+        return response.status_code, response.content, response.headers
+
+
+class WsgiTarget:
+    """Calls the Flask app in-process through its test client, one client (cookie jar) per player."""
+
+    def __init__(self):
+        import app as app_module
+        if hasattr(app_module.limiter, 'enabled'):
+            app_module.limiter.enabled = False
+        self.app = app_module.app
+
+    def new_client(self):
+        return self.app.test_client()
+
+    def send(self, client, method, path, body, headers):
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_data(), response.headers
+
+
+class Stats:
+    """Latencies and errors per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, endpoint, latency, status):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+            # Status 0 marks a request that failed without a response
+            if status == 0 or status >= 400:
+                self.errors[endpoint] += 1
+
+    def report(self):
+        """Summarize as {endpoint: {requests, throughput, error_rate, p50_ms, ...}}, with a 'total' row."""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {}
+        everything = []
+        for endpoint in sorted(self.latencies):
+            latencies = sorted(self.latencies[endpoint])
+            everything.extend(latencies)
+            report[endpoint] = self._summarize(latencies, self.errors[endpoint], elapsed)
+            report[endpoint]['statuses'] = dict(self.statuses[endpoint])
+        everything.sort()
+        report['total'] = self._summarize(everything, sum(self.errors.values()), elapsed)
+        return report
+
+    @staticmethod
+    def _summarize(latencies, errors, elapsed):
+        count = len(latencies)
+        summary = {
+            'requests': count,
+            'throughput': count / elapsed if elapsed else 0.0,
+            'error_rate': errors / count if count else 0.0
+        }
+        for percentile in PERCENTILES:
+            # Nearest-rank percentile
+            rank = max(0, -(-percentile * count // 100) - 1)
+            summary[f'p{percentile}_ms'] = latencies[rank] * 1000 if count else None
+        return summary
+
+
+class Recorder:
+    """Appends every request to a JSONL file, with its offset from the start of the run."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def add(self, player, endpoint, method, path, body):
+        line = json.dumps({
+            't': round(time.perf_counter() - self.started, 6),
+            'player': player,
+            'endpoint': endpoint,
+            'method': method,
+            'path': path,
+            'body': body
+        })
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class PlayerClient:
+    """One simulated browser: a cookie jar, the current game token and the leaderboard ETag."""
+
+    def __init__(self, player, target, stats, recorder=None):
+        self.player = player
+        self.target = target
+        self.client = target.new_client()
+        self.stats = stats
+        self.recorder = recorder
+        self.game_token = None
+        self.leaderboard_etag = None
+
+    def call(self, endpoint, method, path, body=None):
+        """Send a request and time it; returns (status, parsed JSON body or None)."""
+        headers = {}
+        if self.game_token:
+            headers[GAME_TOKEN_HEADER] = self.game_token
+        if endpoint == 'leaderboard' and self.leaderboard_etag:
+            headers['If-None-Match'] = self.leaderboard_etag
+        if self.recorder:
+            self.recorder.add(self.player, endpoint, method, path, body)
+
+        start = time.perf_counter()
+        try:
+            status, content, response_headers = self.target.send(self.client, method, path, body, headers)
+        except Exception:
+            self.stats.add(endpoint, time.perf_counter() - start, 0)
+            return 0, None
+        self.stats.add(endpoint, time.perf_counter() - start, status)
+
+        # Like the browser: keep the freshest token, drop one the server refused
+        if response_headers.get(GAME_TOKEN_HEADER):
+            self.game_token = response_headers[GAME_TOKEN_HEADER]
+        elif status == 401:
+            self.game_token = None
+        if endpoint == 'leaderboard' and response_headers.get('ETag'):
+            self.leaderboard_etag = response_headers['ETag']
+
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+
+class SimulatedPlayer:
+    """Plays puzzles in a loop, with configurable mistake, hint and leaderboard rates."""
+
+    def __init__(self, client, store, rng, options):
+        self.client = client
+        self.store = store
+        self.rng = rng
+        self.options = options
+        self.streak = 0
+
+    def think(self):
+        if self.options.think_time:
+            time.sleep(self.rng.expovariate(1 / self.options.think_time))
+
+    def solution_for(self, puzzle_id):
+        """The solution line of a puzzle, from the local database, or None if it isn't there."""
+        if self.store is None:
+            return None
+        index = self.store.index_of(puzzle_id)
+        return list(self.store.get(index)['solution']) if index is not None else None
+
+    def wrong_move(self, fen, expected):
+        """A legal move other than the expected one, or None if there is none."""
+        moves = [move.uci() for move in chess.Board(fen).legal_moves if move.uci() != expected]
+        return self.rng.choice(moves) if moves else None
+
+    def play_session(self):
+        """Play puzzles until a mistake ends the streak."""
+        difficulty = self.rng.choices(list(DIFFICULTY_WEIGHTS), weights=DIFFICULTY_WEIGHTS.values())[0]
+        if self.rng.random() < self.options.leaderboard_rate:
+            self.client.call('leaderboard', 'GET', '/api/leaderboard')
+
+        while True:
+            status, puzzle = self.client.call('new_puzzle', 'POST', '/api/new-puzzle', {'difficulty': difficulty})
+            if status != 200 or not puzzle or not puzzle.get('success'):
+                return
+            if not self.play_puzzle(puzzle):
+                break
+
+        # The streak is over: maybe submit it, then look at the leaderboard
+        if self.streak and self.rng.random() < self.options.score_rate:
+            self.client.call('check_high_score', 'POST', '/api/check-high-score',
+                             {'mode': difficulty, 'score': self.streak})
+            self.client.call('add_score', 'POST', '/api/add-score',
+                             {'mode': difficulty, 'score': self.streak,
+                              'player_name': f'Load{self.client.player}'})
+        if self.rng.random() < self.options.leaderboard_rate:
+            self.client.call('leaderboard', 'GET', '/api/leaderboard')
+        self.streak = 0
+
+    def play_puzzle(self, puzzle):
+        """Play one puzzle; returns False if a wrong move ended the streak."""
+        puzzle_id = puzzle['puzzle_id']
+        fen = puzzle['fen']
+        solution = self.solution_for(puzzle_id)
+        if self.rng.random() < self.options.hint_rate:
+            self.think()
+            self.client.call('get_hint', 'POST', '/api/get-hint', {'puzzle_id': puzzle_id})
+
+        # Without the solution, a wrong first move makes the server reveal it
+        mistake = solution is None or self.rng.random() < self.options.mistake_rate
+        ply = 0 if solution is None else self.rng.randrange(0, len(solution), 2)
+        index = 0
+        while solution is None or index < len(solution):
+            self.think()
+            expected = solution[index] if solution else None
+            if mistake and index == ply:
+                move = self.wrong_move(fen, expected)
+                if move is None:
+                    if solution is None:
+                        return False
+                    mistake = False
+                    continue
+                status, result = self.client.call('make_move', 'POST', '/api/make-move',
+                                                  {'move': move, 'puzzle_id': puzzle_id})
+                if solution is None and result and 'solution_moves' in result:
+                    # The answer is revealed; play it so the solving moves are exercised too
+                    self.play_line(puzzle_id, result['solution_moves'])
+                return False
+
+            status, result = self.client.call('make_move', 'POST', '/api/make-move',
+                                              {'move': expected, 'puzzle_id': puzzle_id})
+            if status != 200 or not result or not result.get('success'):
+                return False
+            if result.get('puzzle_complete'):
+                self.streak = result.get('consecutive_wins', self.streak + 1)
+                return True
+            fen = result['current_fen']
+            index += 2
+        return True
+
+    def play_line(self, puzzle_id, solution):
+        """Play a whole solution line."""
+        for move in solution[::2]:
+            self.think()
+            status, result = self.client.call('make_move', 'POST', '/api/make-move',
+                                              {'move': move, 'puzzle_id': puzzle_id})
+            if status != 200 or not result or not result.get('success'):
+                return
+
+
+def simulate(target, store, options, stats, recorder):
+    """Run simulated players until the deadline."""
+    deadline = time.monotonic() + options.duration
+
+    def run_player(player):
+        rng = random.Random(options.seed * 100003 + player)
+        simulated = SimulatedPlayer(PlayerClient(player, target, stats, recorder), store, rng, options)
+        while time.monotonic() < deadline:
+            simulated.play_session()
+            if options.new_players:
+                # A fresh browser: new cookies and no game token
+                simulated.client = PlayerClient(player, target, stats, recorder)
+
+    run_threads(run_player, options.players)
+
+
+def replay(target, path, options, stats):
+    """Replay recorded traffic, each recorded player on its own thread and client."""
+    requests_by_player = defaultdict(list)
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                requests_by_player[entry['player']].append(entry)
+
+    start = time.monotonic()
+    players = sorted(requests_by_player)
+
+    def run_player(slot):
+        client = PlayerClient(players[slot], target, stats)
+        for entry in requests_by_player[players[slot]]:
+            delay = start + entry['t'] / options.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # Moves carry their puzzle ID, so they apply to the recorded puzzle
+            # even though new-puzzle picks a different one this time
+            client.call(entry['endpoint'], entry['method'], entry['path'], entry['body'])
+
+    run_threads(run_player, len(players))
+
+
+def run_threads(function, count):
+    threads = [threading.Thread(target=function, args=(i,), daemon=True) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def print_report(report):
+    print(f"{'endpoint':18} {'requests':>9} {'req/s':>9} {'errors':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for endpoint, row in report.items():
+        latencies = ' '.join(f"{row[f'p{p}_ms']:7.1f}ms" if row[f'p{p}_ms'] is not None else f"{'-':>9}"
+                             for p in PERCENTILES)
+        print(f"{endpoint:18} {row['requests']:9d} {row['throughput']:9.1f} {row['error_rate']:7.1%} {latencies}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent players against the chess puzzle app.")
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--url', help="Base URL of a running server")
+    target_group.add_argument('--wsgi', action='store_true', help="Call the app in-process through its test client")
+    parser.add_argument('--players', type=int, default=10, help="Concurrent simulated players")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="Mean pause between a player's actions in seconds (0 for maximum load)")
+    parser.add_argument('--mistake-rate', type=float, default=0.2, help="Chance of a wrong move on each puzzle")
+    parser.add_argument('--hint-rate', type=float, default=0.15, help="Chance of asking for a hint on each puzzle")
+    parser.add_argument('--score-rate', type=float, default=0.5, help="Chance of submitting a finished streak")
+    parser.add_argument('--leaderboard-rate', type=float, default=0.3,
+                        help="Chance of loading the leaderboard before and after a streak")
+    parser.add_argument('--new-players', action='store_true',
+                        help="Start every streak as a new visitor (fresh cookies and token)")
+    parser.add_argument('--database', default=os.environ.get('PUZZLE_DATABASE', os.path.join(ROOT, 'puzzles_combined.json')),
+                        help="Local copy of the server's puzzle database, used to look up solutions")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    parser.add_argument('--record', help="Record every request to this JSONL file")
+    parser.add_argument('--replay', help="Replay a recorded JSONL file instead of simulating")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument('--output', help="Write the report as JSON to this file")
+    options = parser.parse_args()
+
+    target = WsgiTarget() if options.wsgi else HttpTarget(options.url)
+    stats = Stats()
+    if options.replay:
+        replay(target, options.replay, options, stats)
+    else:
+        try:
+            store = PuzzleStore.from_file(options.database)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not load {options.database} ({e}); players will learn solutions from wrong moves")
+            store = None
+        recorder = Recorder(options.record) if options.record else None
+        stats.started = time.perf_counter()
+        try:
+            simulate(target, store, options, stats, recorder)
+        finally:
+            if recorder:
+                recorder.close()
+    stats.finished = time.perf_counter()
+
+    report = stats.report()
+    print_report(report)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {options.output}")
+
+
+if __name__ == '__main__':
+    main()
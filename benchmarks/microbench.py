@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the chess puzzle game's hot paths.
+Times puzzle store loading, puzzle selection and ID lookup (as the
+new-puzzle and shared-puzzle routes do them), board moves, puzzle resets,
+description generation and leaderboard updates.
+
+Store benchmarks run against synthetic databases of 5k, 100k and 1M
+puzzles, built from puzzles_combined.json and cached in benchmarks/.data.
+
+Usage:
+    python benchmarks/microbench.py [--sizes 5000 100000] [--output results.json]
+    python benchmarks/microbench.py --baseline results.json [--tolerance 0.2]
+
+With --baseline, every benchmark whose median time per operation grew by
+more than the tolerance is reported as a regression and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.board import ChessBoard
+from src.descriptions import generate_puzzle_description
+from src.puzzle import ChessPuzzle
+from src.puzzle_db import write_puzzle_db
+from src.puzzle_store import PuzzleStore, DIFFICULTY_RATING_RANGES
+
+DEFAULT_SIZES = (5000, 100000, 1000000)
+SOURCE_DATABASE = os.path.join(ROOT, 'puzzles_combined.json')
+DATA_DIRECTORY = os.path.join(ROOT, 'benchmarks', '.data')
+# Loading JSON databases larger than this takes minutes and gigabytes, so only the binary one is timed
+MAX_JSON_SIZE = 100000
+
+# Each repeat runs for at least this long; the median of the repeats is reported
+MIN_REPEAT_SECONDS = 0.2
+REPEATS = 5
+# Distinct inputs cycled through by each benchmark, so caches see realistic traffic
+SAMPLE_INPUTS = 1000
+
+
+def build_puzzles(size, seed=0):
+    """
+    Build a synthetic puzzle list by cycling through the real database.
+
+    Each pass shifts ratings by one point, so copies get distinct IDs while
+    the rating distribution stays close to the original.
+    """
+    with open(SOURCE_DATABASE, 'r') as f:
+        base = json.load(f)['puzzles']
+    random.Random(seed).shuffle(base)
+
+    puzzles = []
+    for i in range(size):
+        copy, puzzle = divmod(i, len(base))
+        puzzle = dict(base[puzzle])
+        if 'rating' in puzzle:
+            puzzle['rating'] += copy % 200 - 100
+        puzzles.append(puzzle)
+    return puzzles
+
+
+def prepare_dataset(size):
+    """Create (or reuse) the JSON and binary databases for a size; returns their paths."""
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    json_path = os.path.join(DATA_DIRECTORY, f'puzzles_{size}.json')
+    db_path = os.path.join(DATA_DIRECTORY, f'puzzles_{size}.db')
+    if size > MAX_JSON_SIZE:
+        json_path = None
+
+    missing = not os.path.exists(db_path) or (json_path and not os.path.exists(json_path))
+    if missing:
+        print(f"Building {size} puzzle dataset in {DATA_DIRECTORY}...")
+        puzzles = build_puzzles(size)
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump({'puzzles': puzzles}, f)
+        write_puzzle_db(PuzzleStore(puzzles, source=f'synthetic-{size}'), db_path)
+    return json_path, db_path
+
+
+def measure(operation, inputs):
+    """
+    Time an operation over a list of inputs.
+
+    The number of calls per repeat is calibrated so each repeat runs for
+    at least MIN_REPEAT_SECONDS.
+
+    Returns:
+        Dict with the median and best time per call in microseconds, and the call count
+    """
+    count = len(inputs)
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(loops):
+            operation(inputs[i % count])
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_REPEAT_SECONDS:
+            break
+        loops = max(loops * 2, int(loops * MIN_REPEAT_SECONDS / max(elapsed, 1e-9) * 1.1))
+
+    timings = [elapsed / loops]
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for i in range(loops):
+            operation(inputs[i % count])
+        timings.append((time.perf_counter() - start) / loops)
+
+    return {
+        'median_us': statistics.median(timings) * 1e6,
+        'best_us': min(timings) * 1e6,
+        'calls': loops * REPEATS
+    }
+
+
+def measure_once(operation, repeats=3):
+    """Time a slow operation a few times; same result shape as measure()."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return {
+        'median_us': statistics.median(timings) * 1e6,
+        'best_us': min(timings) * 1e6,
+        'calls': repeats
+    }
+
+
+def store_benchmarks(size):
+    """Benchmarks of loading and querying a store of the given size."""
+    json_path, db_path = prepare_dataset(size)
+    results = {}
+
+    results['store_load_db'] = measure_once(lambda: PuzzleStore.from_file(db_path))
+    if json_path:
+        results['store_load_json'] = measure_once(lambda: PuzzleStore.from_file(json_path), repeats=1)
+
+    store = PuzzleStore.from_file(db_path)
+    rng = random.Random(1)
+
+    # new_puzzle: pick the next puzzle of the player's walk, then build the playable puzzle
+    def new_puzzle(args):
+        seed, counter, min_rating, max_rating = args
+        positions, _ = store.sample_sequence(seed, counter, 1, min_rating, max_rating)
+        puzzle = store.get(positions[0])
+        return ChessPuzzle(puzzle['fen'], puzzle['solution'], store.get_description(positions[0]))
+
+    for difficulty, (min_rating, max_rating) in DIFFICULTY_RATING_RANGES.items():
+        inputs = [(rng.getrandbits(32), rng.randrange(1000), min_rating, max_rating)
+                  for _ in range(SAMPLE_INPUTS)]
+        results[f'new_puzzle_{difficulty}'] = measure(new_puzzle, inputs)
+
+    # new_puzzle with a theme filter goes through the inverted theme index
+    theme = 'fork' if 'fork' in store.theme_bits else store.themes[0]
+    min_rating, max_rating = DIFFICULTY_RATING_RANGES['easy']
+    results['new_puzzle_theme'] = measure(
+        lambda _: store.sample_indexes(1, min_rating, max_rating, include_themes=(theme,)),
+        [None]
+    )
+
+    # get_specific_puzzle: find a shared-link ID and fetch the puzzle
+    ids = [store.get_id(rng.randrange(len(store))) for _ in range(SAMPLE_INPUTS)]
+    results['lookup_by_id'] = measure(lambda puzzle_id: store.get(store.index_of(puzzle_id)), ids)
+    results['lookup_missing_id'] = measure(store.index_of, ['ffffffff', '00000000'])
+    return results
+
+
+def board_benchmarks():
+    """Benchmarks of board and puzzle operations (independent of the database size)."""
+    store = PuzzleStore.from_file(SOURCE_DATABASE)
+    rng = random.Random(2)
+    puzzles = [store.get(rng.randrange(len(store))) for _ in range(SAMPLE_INPUTS)]
+    results = {}
+
+    boards = [(ChessBoard(puzzle['fen']), puzzle['solution'][0]) for puzzle in puzzles]
+    results['board_is_valid_move'] = measure(lambda args: args[0].is_valid_move(args[1]), boards)
+    results['board_is_valid_move_illegal'] = measure(lambda args: args[0].is_valid_move('a1a1'), boards)
+
+    # make_move is paired with a pop, so every call starts from the same position
+    def make_move(args):
+        board, move = args
+        board.make_move(move)
+        board.board.pop()
+    results['board_make_move'] = measure(make_move, boards)
+
+    # A puzzle played halfway through, as when a player asks for a new attempt
+    def reset(puzzle):
+        puzzle.advance()
+        puzzle.advance()
+        puzzle.reset()
+    chess_puzzles = []
+    for puzzle in puzzles:
+        chess_puzzle = ChessPuzzle(puzzle['fen'], puzzle['solution'], puzzle.get('description', ''))
+        chess_puzzle.board
+        chess_puzzles.append(chess_puzzle)
+    results['puzzle_advance_reset'] = measure(reset, chess_puzzles)
+
+    inputs = [(puzzle.get('description', ''), puzzle['player_color'], puzzle) for puzzle in puzzles]
+    results['generate_puzzle_description'] = measure(lambda args: generate_puzzle_description(*args), inputs)
+    return results
+
+
+def leaderboard_benchmarks():
+    """Benchmarks of in-memory leaderboard updates against a temporary file."""
+    # Never touch a real GitHub repository from a benchmark
+    os.environ.pop('GITHUB_TOKEN', None)
+    from leaderboard import Leaderboard
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        leaderboard = Leaderboard(os.path.join(directory, 'leaderboard.json'), flush_interval=3600)
+        rng = random.Random(3)
+        inputs = [(rng.choice(('easy', 'hard', 'hikaru')), rng.randrange(1, 50), f'Player{i}')
+                  for i in range(SAMPLE_INPUTS)]
+        results['leaderboard_add_score'] = measure(lambda args: leaderboard.add_score(*args), inputs)
+        results['leaderboard_check_if_high_score'] = measure(
+            lambda args: leaderboard.check_if_high_score(args[0], args[1]), inputs
+        )
+        leaderboard.close()
+    return results
+
+
+def git_commit():
+    """Current commit of the repository, or None."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes):
+    """Run every benchmark; returns the results document."""
+    benchmarks = {}
+    for size in sizes:
+        for name, result in store_benchmarks(size).items():
+            benchmarks[f'{name}[{size}]'] = result
+    benchmarks.update(board_benchmarks())
+    benchmarks.update(leaderboard_benchmarks())
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'sizes': list(sizes)
+        },
+        'benchmarks': benchmarks
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline document.
+
+    Returns:
+        List of (name, baseline_us, current_us) for benchmarks slower than the tolerance allows
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if previous and result['median_us'] > previous['median_us'] * (1 + tolerance):
+            regressions.append((name, previous['median_us'], result['median_us']))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    """Print a table of results, with the change against the baseline if given."""
+    print(f"{'benchmark':44} {'median':>12} {'best':>12}  change")
+    for name, result in results['benchmarks'].items():
+        change = ''
+        previous = baseline['benchmarks'].get(name) if baseline else None
+        if previous:
+            change = f"{(result['median_us'] / previous['median_us'] - 1) * 100:+.1f}%"
+        print(f"{name:44} {result['median_us']:10.2f}us {result['best_us']:10.2f}us  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chess puzzle microbenchmarks.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Puzzle database sizes to benchmark")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline before flagging (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = run(args.sizes)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for name, previous, current in regressions:
+            print(f"REGRESSION {name}: {previous:.2f}us -> {current:.2f}us")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,35 @@ class Config:
     MAX_PLAYER_NAME_LENGTH = 20
     MAX_SCORE_VALUE = 10000
     
+    # Number of top scores kept per leaderboard mode
+    LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 5))
+    
+    # Player sessions ('memory' for a single worker, 'sqlite' to share across workers,
+    # 'token' to keep no server-side state and pass signed progress tokens instead)
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+    SESSION_DATABASE = os.environ.get('SESSION_DATABASE', 'sessions.db')
+    SESSION_MAX_COUNT = int(os.environ.get('SESSION_MAX_COUNT', 50000))
+    SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', 3600))
+    # Redeemed game tokens are recorded in this SQLite file, shared by the workers on the host
+    # (empty: remembered per worker, GAME_TOKEN_NONCE_WINDOW at a time, for a single worker only)
+    GAME_TOKEN_DATABASE = os.environ.get('GAME_TOKEN_DATABASE', SESSION_DATABASE)
+    GAME_TOKEN_NONCE_WINDOW = int(os.environ.get('GAME_TOKEN_NONCE_WINDOW', 100000))
+    
+    # Directory where worker processes share metrics for /metrics (empty: this process only)
+    METRICS_DIRECTORY = os.environ.get('METRICS_DIRECTORY', '')
+    
+    # Request tracing: kept traces are appended to TRACE_FILE as OTLP JSON lines (empty: off).
+    # Traces slower than TRACE_THRESHOLD_MS are always kept, a TRACE_SAMPLE_RATE fraction of the rest
+    TRACE_FILE = os.environ.get('TRACE_FILE', '')
+    TRACE_THRESHOLD_MS = float(os.environ.get('TRACE_THRESHOLD_MS', 500))
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.0))
+    
+    # On-demand profiling under /debug, for requests carrying PROFILING_TOKEN (empty: off).
+    # PROFILING_TRACEMALLOC > 0 traces allocations from startup with that many frames each
+    PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+    PROFILE_DIRECTORY = os.environ.get('PROFILE_DIRECTORY', '.profiles')
+    PROFILING_TRACEMALLOC = int(os.environ.get('PROFILING_TRACEMALLOC', 0))
+    
     # File paths
     PUZZLE_DATABASE = os.environ.get('PUZZLE_DATABASE', 'puzzles_combined.json')
     LEADERBOARD_FILE = os.environ.get('LEADERBOARD_FILE', 'leaderboard.json')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Puzzle database converter for chess puzzle game.
+Converts a JSON puzzle database into the compact memory-mapped binary format.
+
+Usage:
+    python convert_puzzles.py [input.json] [output.db]
+
+Point PUZZLE_DATABASE at the output file to serve it.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from src.puzzle_db import write_puzzle_db
+from src.puzzle_store import PuzzleStore
+
+
+def convert(input_path, output_path):
+    """Convert a JSON puzzle database to the binary format."""
+    start = time.perf_counter()
+    store = PuzzleStore.from_file(input_path)
+    if store.db is not None:
+        raise ValueError(f"{input_path} is already a binary puzzle database")
+
+    # Write to a temporary file first so a running server never maps a partial file
+    temp_path = f"{output_path}.tmp"
+    write_puzzle_db(store, temp_path)
+    os.replace(temp_path, output_path)
+
+    elapsed = time.perf_counter() - start
+    input_size = os.path.getsize(input_path)
+    output_size = os.path.getsize(output_path)
+    print(f"✓ Converted {len(store)} puzzles from {input_path} to {output_path} in {elapsed:.2f}s")
+    print(f"  {input_size / 1024:.0f} KB JSON -> {output_size / 1024:.0f} KB binary")
+    if store.id_collisions:
+        print(f"  Warning: {len(store.id_collisions)} puzzle ID collisions (first puzzle keeps the ID)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSON puzzle database to the binary format.")
+    parser.add_argument('input', nargs='?', default='puzzles_combined.json', help="JSON puzzle database")
+    parser.add_argument('output', nargs='?', default='puzzles_combined.db', help="Binary output file")
+    args = parser.parse_args()
+
+    try:
+        convert(args.input, args.output)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
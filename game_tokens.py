@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Signed game-progress tokens for chess puzzle game.
+In token mode the server keeps no per-player state: every game request
+carries a compact HMAC-signed token with the puzzle, move index and streak,
+and every response returns a fresh one, so any worker or node can serve
+any player.
+
+Each token can be redeemed once, so an old token cannot be replayed to
+undo a wrong move or to submit the same streak twice. Redeemed nonces are
+recorded in a SQLite table shared by every worker on the host (a unique
+key, so two workers cannot both redeem one token), or with no database
+in a bounded window in process memory, which only protects a single worker.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sessions import GameState
+
+
+class InvalidGameToken(ValueError):
+    """Raised for a game token that is malformed, forged, expired or already used."""
+
+
+class NonceWindow:
+    """Redeemed nonces remembered in process memory, in a bounded window (single worker)."""
+
+    def __init__(self, ttl_seconds: float, size: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.size = size
+        self._used = OrderedDict()
+        # Tokens issued at or before this time are refused, since their nonces may have been evicted
+        self.floor = 0
+        self._lock = threading.Lock()
+
+    def consume(self, nonce: bytes, issued_at: int, now: float):
+        """Record a nonce as redeemed, refusing one that already was."""
+        with self._lock:
+            if issued_at <= self.floor:
+                raise InvalidGameToken("Game token expired")
+            if nonce in self._used:
+                raise InvalidGameToken("Game token already used")
+            self._used[nonce] = issued_at
+
+            # Drop nonces of tokens that have expired anyway, then enforce the size cap
+            while self._used:
+                oldest = next(iter(self._used.values()))
+                if len(self._used) <= self.size and now - oldest <= self.ttl_seconds:
+                    break
+                self._used.popitem(last=False)
+                if len(self._used) >= self.size:
+                    self.floor = max(self.floor, oldest)
+
+
+class SQLiteNonceRegistry:
+    """
+    Redeemed nonces recorded in a SQLite database shared by the workers.
+
+    Redeeming is one INSERT of the nonce as primary key: whichever worker
+    inserts it first wins and every later attempt fails the unique
+    constraint, so a token is redeemed once across all workers.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS redeemed_game_tokens (
+            nonce BLOB PRIMARY KEY,
+            issued_at INTEGER NOT NULL
+        )
+    """
+    INDEX = "CREATE INDEX IF NOT EXISTS redeemed_game_tokens_issued_at ON redeemed_game_tokens (issued_at)"
+    INSERT = "INSERT INTO redeemed_game_tokens (nonce, issued_at) VALUES (?, ?)"
+    EXPIRE = "DELETE FROM redeemed_game_tokens WHERE issued_at < ?"
+
+    # How often each worker deletes the nonces of expired tokens
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        # Nonces are only deleted once their tokens have expired, so no issue-time floor is needed
+        self.floor = 0
+        self._local = threading.local()
+        self._last_prune = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(self.SCHEMA)
+        connection.execute(self.INDEX)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+        return connection
+
+    def consume(self, nonce: bytes, issued_at: int, now: float):
+        """Record a nonce as redeemed, refusing one that already was."""
+        connection = self._connection()
+        try:
+            connection.execute(self.INSERT, (nonce, issued_at))
+        except sqlite3.IntegrityError:
+            raise InvalidGameToken("Game token already used")
+
+        if now - self._last_prune >= self.PRUNE_INTERVAL:
+            self._last_prune = now
+            connection.execute(self.EXPIRE, (int(now - self.ttl_seconds),))
+
+
+class GameTokenStore:
+    """
+    Issues and redeems signed game-progress tokens.
+
+    A token is base64url(payload + HMAC-SHA256(payload)[:16]); the payload
+    packs the format version, flags, issue time, puzzle index and ID, move
+    index, streak, total solved, the last broken streak, the position in the
+    player's puzzle walk, the rating estimate and a random nonce.
+    """
+
+    TOKEN_VERSION = 3
+    # version, flags, issued_at, puzzle_index, move_index, wins, solved, last_streak,
+    # sample_seed, sample_counter, rating, rated_games, puzzle_id, nonce
+    PAYLOAD = struct.Struct('<BBIiHIIIIIHH4s8s')
+    DIGEST_SIZE = 16
+    FLAG_BLACK = 1
+    FLAG_PUZZLE_RATED = 2
+
+    def __init__(self, secret_key: str, puzzle_loader: Callable, ttl_seconds: float = 3600,
+                 nonce_window: int = 100000, nonce_database: Optional[str] = None):
+        """
+        Initialize the token store.
+
+        Args:
+            secret_key: Application secret; must be the same on every worker
+            puzzle_loader: Called as puzzle_loader(puzzle_index, puzzle_id, move_index);
+                returns a ChessPuzzle at that move and its (possibly relocated) index,
+                or (None, None) if the puzzle no longer exists
+            ttl_seconds: Lifetime of a token
+            nonce_window: Redeemed nonces remembered without a nonce database
+            nonce_database: SQLite file where workers share redeemed nonces
+                (None: remember them in this process only)
+        """
+        if isinstance(secret_key, str):
+            secret_key = secret_key.encode('utf-8')
+        # Separate key, so tokens cannot be confused with other uses of the secret
+        self._key = hmac.new(secret_key, b'chess-puzzle game token', hashlib.sha256).digest()
+        self.puzzle_loader = puzzle_loader
+        self.ttl_seconds = ttl_seconds
+        if nonce_database:
+            self.nonces = SQLiteNonceRegistry(nonce_database, ttl_seconds)
+        else:
+            self.nonces = NonceWindow(ttl_seconds, nonce_window)
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:self.DIGEST_SIZE]
+
+    def issue(self, state: GameState) -> str:
+        """Create a token for a state."""
+        (puzzle_index, puzzle_id, move_index, color, wins, solved,
+         seed, counter, rating, rated_games, puzzle_rated) = state.progress()
+        flags = (self.FLAG_BLACK if color == 'black' else 0) | (self.FLAG_PUZZLE_RATED if puzzle_rated else 0)
+        payload = self.PAYLOAD.pack(
+            self.TOKEN_VERSION, flags, int(time.time()),
+            -1 if puzzle_index is None else puzzle_index, move_index,
+            wins, solved, state.last_streak, seed, counter, rating, min(rated_games, 0xFFFF),
+            bytes.fromhex(puzzle_id) if puzzle_id else bytes(4),
+            os.urandom(8)
+        )
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).rstrip(b'=').decode('ascii')
+
+    def _decode(self, token: str, now: float):
+        """Verify a token and unpack its payload fields."""
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (binascii.Error, ValueError):
+            raise InvalidGameToken("Invalid game token")
+        if len(raw) != self.PAYLOAD.size + self.DIGEST_SIZE:
+            raise InvalidGameToken("Invalid game token")
+
+        payload, signature = raw[:self.PAYLOAD.size], raw[self.PAYLOAD.size:]
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidGameToken("Invalid game token")
+
+        fields = self.PAYLOAD.unpack(payload)
+        if fields[0] != self.TOKEN_VERSION:
+            raise InvalidGameToken("Invalid game token")
+        issued_at = fields[2]
+        if now - issued_at > self.ttl_seconds or issued_at <= self.nonces.floor:
+            raise InvalidGameToken("Game token expired")
+        return fields
+
+    def redeem(self, token: Optional[str], consume: bool = True) -> GameState:
+        """
+        Verify a token and rebuild the state it carries.
+
+        Args:
+            token: Token from the client; a missing token starts a new game
+            consume: Mark the token as used (False for read-only requests)
+
+        Raises:
+            InvalidGameToken: If the token is malformed, forged, expired or already used
+        """
+        if not token:
+            return GameState()
+
+        now = time.time()
+        fields = self._decode(token, now)
+        (_, flags, issued_at, puzzle_index, move_index, wins, solved, last_streak,
+         sample_seed, sample_counter, rating, rated_games, puzzle_id, nonce) = fields
+        if consume:
+            self.nonces.consume(nonce, issued_at, now)
+
+        state = GameState()
+        state.player_color = 'black' if flags & self.FLAG_BLACK else 'white'
+        state.consecutive_wins = wins
+        state.total_puzzles_solved = solved
+        state.last_streak = last_streak
+        state.sample_seed = sample_seed
+        state.sample_counter = sample_counter
+        state.rating = rating
+        state.rated_games = rated_games
+        state.puzzle_rated = bool(flags & self.FLAG_PUZZLE_RATED)
+        if puzzle_index >= 0:
+            puzzle_id = puzzle_id.hex()
+            puzzle, puzzle_index = self.puzzle_loader(puzzle_index, puzzle_id, move_index)
+            if puzzle is not None:
+                state.current_puzzle = puzzle
+                state.current_puzzle_index = puzzle_index
+                state.current_puzzle_id = puzzle_id
+        return state
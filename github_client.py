@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+GitHub contents API client for chess puzzle game.
+Reads and writes single files in a repository over one pooled keep-alive
+session, with connect/read timeouts and bounded retries with backoff.
+
+Reads are conditional: the ETag of the last response for each path is
+sent back as If-None-Match, and a 304 reuses the cached file (GitHub does
+not count those against the rate limit). Concurrent reads of the same
+path are collapsed into a single request whose result every caller shares.
+"""
+
+import base64
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import tracing
+
+DEFAULT_API_URL = 'https://api.github.com'
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 10.0)
+DEFAULT_RETRIES = 3
+# Sleeps 0.5s, 1s, 2s between retries (plus any Retry-After the server asks for)
+DEFAULT_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_SIZE = 4
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def _total_seconds(timeout: Timeout) -> float:
+    """Longest time a (connect, read) timeout allows for one request."""
+    return sum(timeout) if isinstance(timeout, tuple) else timeout
+
+
+class GitHubError(Exception):
+    """Raised for an unexpected response from the GitHub API."""
+
+    def __init__(self, status_code: int, text: str = ''):
+        super().__init__(f"{status_code} - {text}" if text else str(status_code))
+        self.status_code = status_code
+        self.text = text
+
+
+class GitHubConflict(GitHubError):
+    """Raised when a write is refused because the file changed since it was read."""
+
+
+class GitHubFile(NamedTuple):
+    """A file read from the contents API."""
+    content: bytes
+    sha: str
+
+
+class _Flight:
+    """A read in progress, shared by every caller that asks for the same path meanwhile."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GitHubClient:
+    """Reads and writes repository files through the GitHub contents API."""
+
+    def __init__(self, token: str, repo: str, api_url: str = DEFAULT_API_URL,
+                 timeout: Timeout = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF):
+        """
+        Initialize the client.
+
+        Args:
+            token: Personal access token with write access to the repository
+            repo: Repository as 'owner/name'
+            api_url: Base URL of the API (overridable for GitHub Enterprise and tests)
+            timeout: Default (connect, read) timeout in seconds, or one value for both
+            retries: Retries for failed connections and retryable responses
+            backoff: Backoff factor between retries
+        """
+        self.repo = repo
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+
+        # GETs are retried on read errors and throttling too; PUTs only when the request
+        # never reached the server, since a repeated commit could land twice
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        self.session = self._session(token, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE,
+                                                        max_retries=retry))
+        # Single attempts, for reads that must finish by a deadline (retry backoff would overrun it)
+        self.single_attempt_session = self._session(token, HTTPAdapter(pool_connections=1, pool_maxsize=1,
+                                                                       max_retries=0))
+
+        # path -> (etag, GitHubFile or None for a missing file)
+        self._cache: Dict[str, Tuple[str, Optional[GitHubFile]]] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _session(token: str, adapter: HTTPAdapter) -> requests.Session:
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Authorization': f'token {token}',
+            'Accept': 'application/vnd.github.v3+json'
+        })
+        return session
+
+    def url(self, path: str) -> str:
+        """URL of a file in the contents API."""
+        return f'{self.api_url}/repos/{self.repo}/contents/{path}'
+
+    def get_file(self, path: str, timeout: Optional[Timeout] = None, retry: bool = True) -> Optional[GitHubFile]:
+        """
+        Read a file, or None if it doesn't exist.
+
+        With retry=False the read is a single attempt, so it takes at most
+        one connect and one read timeout.
+
+        A caller that arrives while another read of the same path is in
+        flight waits for it and gets the same result (or exception), for no
+        longer than its own request timeout.
+
+        Raises:
+            GitHubError: For any other unexpected response
+            requests.RequestException: If the request failed after retries
+            requests.Timeout: If the in-flight read did not finish within the timeout
+        """
+        with self._lock:
+            flight = self._flights.get(path)
+            leader = flight is None
+            if leader:
+                flight = self._flights[path] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(_total_seconds(timeout or self.timeout)):
+                raise requests.Timeout(f"Timed out waiting for the in-flight read of {path}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._fetch(path, timeout, retry)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[path]
+            flight.done.set()
+
+    def _fetch(self, path: str, timeout: Optional[Timeout], retry: bool = True) -> Optional[GitHubFile]:
+        """Issue a conditional GET for a file."""
+        cached = self._cache.get(path)
+        headers = {'If-None-Match': cached[0]} if cached else {}
+        with tracing.span('github.get', kind=tracing.KIND_CLIENT, **{'github.path': path}) as span:
+            session = self.session if retry else self.single_attempt_session
+            response = session.get(self.url(path), headers=headers, timeout=timeout or self.timeout)
+            span.set_attribute('http.status_code', response.status_code)
+
+        if response.status_code == 304 and cached:
+            return cached[1]
+        if response.status_code == 200:
+            content = response.json()
+            result = GitHubFile(base64.b64decode(content['content']), content['sha'])
+        elif response.status_code == 404:
+            result = None
+        else:
+            raise GitHubError(response.status_code, response.text)
+
+        etag = response.headers.get('ETag')
+        if etag:
+            self._cache[path] = (etag, result)
+        else:
+            self._cache.pop(path, None)
+        return result
+
+    def put_file(self, path: str, content: bytes, message: str, sha: Optional[str] = None,
+                 branch: str = 'master', timeout: Optional[Timeout] = None):
+        """
+        Create or update a file.
+
+        Args:
+            sha: SHA of the file being replaced (None to create it)
+
+        Raises:
+            GitHubConflict: If the file changed since sha was read
+            GitHubError: For any other unexpected response
+        """
+        payload = {
+            'message': message,
+            'content': base64.b64encode(content).decode('ascii'),
+            'branch': branch
+        }
+        if sha:
+            payload['sha'] = sha
+
+        with tracing.span('github.put', kind=tracing.KIND_CLIENT, **{'github.path': path}) as span:
+            response = self.session.put(self.url(path), json=payload, timeout=timeout or self.timeout)
+            span.set_attribute('http.status_code', response.status_code)
+        if response.status_code in (200, 201):
+            return
+        if response.status_code in (409, 422):
+            raise GitHubConflict(response.status_code, response.text)
+        raise GitHubError(response.status_code, response.text)
+
+    def close(self):
+        """Close pooled connections."""
+        self.session.close()
+        self.single_attempt_session.close()
@@ -3,6 +3,10 @@
 Leaderboard system for chess puzzle game.
 Handles high scores for Easy and Hard modes separately.
 Supports both local file storage and GitHub API storage.
+
+Scores are added in memory and persisted write-behind: a background thread
+flushes pending changes on an interval and at shutdown, merging with the
+stored copy so concurrent writers never lose each other's scores.
 """
 
 import json
@@ -10,11 +14,21 @@ import os
 import tempfile
 import shutil
 import platform
-import base64
-import requests
+import atexit
+import bisect
+import threading
+import time
 from datetime import datetime
 from typing import List, Dict, Optional
 
+from github_client import GitHubClient, GitHubError, GitHubConflict, Timeout
+from metrics import Histogram
+import tracing
+
+LEADERBOARD_IO_SECONDS = Histogram('chess_puzzle_leaderboard_io_seconds',
+                                   'Time spent loading and saving the leaderboard',
+                                   ('operation', 'storage'))
+
 # Cross-platform file locking
 try:
     if platform.system() == 'Windows':
@@ -36,12 +50,116 @@ except ImportError:
     def unlock_file(f):
         pass
 
+MODES = ['easy', 'hard', 'hikaru']
+MAX_ENTRIES = 5
+
+
+def _rank_key(entry: Dict):
+    """Rank by score (highest first), then by timestamp (earliest first for ties)."""
+    return (-entry['score'], entry['timestamp'])
+
+
+def merge_leaderboards(*boards: Dict, limit: int = MAX_ENTRIES) -> Dict:
+    """
+    Merge leaderboards into one, keeping the top entries of each mode.
+
+    Entries are identified by name, score and timestamp, so merging is
+    idempotent and merging a board with an older copy of itself is a no-op.
+    """
+    merged = {}
+    for mode in MODES:
+        entries = {}
+        for board in boards:
+            for entry in board.get(mode, []):
+                entries.setdefault((entry['name'], entry['score'], entry['timestamp']), entry)
+        merged[mode] = sorted(entries.values(), key=_rank_key)[:limit]
+    return merged
+
+
+def merge_versioned(mine: Dict, theirs: Dict, limit: int = MAX_ENTRIES) -> Dict:
+    """
+    Merge two stored leaderboards, including their 'version' counters.
+    
+    The version never goes backwards: the result takes the higher of the
+    two, plus one if that would label a changed board with an old version.
+    """
+    merged = merge_leaderboards(mine, theirs, limit=limit)
+    mine_version, their_version = mine.get('version', 0), theirs.get('version', 0)
+    version = max(mine_version, their_version)
+    if ((version == mine_version and merged != merge_leaderboards(mine, limit=limit)) or
+            (version == their_version and merged != merge_leaderboards(theirs, limit=limit))):
+        version += 1
+    merged['version'] = version
+    return merged
+
+
+class TopScores:
+    """
+    The best scores of one mode, kept in rank order and bounded to a limit.
+    
+    Inserts find their position by bisection and replace the list rather
+    than mutating it, so readers can use `entries` without locking.
+    """
+    
+    def __init__(self, entries: List[Dict] = (), limit: int = MAX_ENTRIES):
+        self.limit = limit
+        self.entries = sorted(entries, key=_rank_key)[:limit]
+    
+    def add(self, entry: Dict) -> Optional[int]:
+        """
+        Insert an entry.
+        
+        Returns:
+            Its 1-based position, or None if it did not make the board
+        """
+        position = bisect.bisect_right(self.entries, _rank_key(entry), key=_rank_key)
+        if position >= self.limit:
+            return None
+        self.entries = self.entries[:position] + [entry] + self.entries[position:self.limit - 1]
+        return position + 1
+    
+    def qualifies(self, score: int) -> bool:
+        """Check if a score would make it onto the board."""
+        # If the board isn't full, any score is a high score;
+        # otherwise it must beat the lowest score, which is always last
+        return len(self.entries) < self.limit or score > self.entries[-1]['score']
+
+
 class Leaderboard:
-    def __init__(self, filename: str = 'leaderboard.json'):
+    # Attempts to save to GitHub when the file changed underneath us (SHA conflict)
+    MAX_SAVE_ATTEMPTS = 3
+    # Minimum seconds between checks of the local file for changes by other workers
+    REFRESH_INTERVAL = 1.0
+    # Deadline for merging in the GitHub copy at startup; the local copy is served meanwhile.
+    # The fetch is one attempt with half of it for connecting and half for the response
+    WARM_UP_TIMEOUT = 10.0
+
+    def __init__(self, filename: str = 'leaderboard.json', flush_interval: float = 5.0,
+                 max_entries: int = MAX_ENTRIES):
         self.filename = filename
+        self.max_entries = max_entries
         self.github_token = os.environ.get('GITHUB_TOKEN')
         self.github_repo = os.environ.get('GITHUB_REPO', 'jakereiser/chess-puzzle')
+        self.github_api_url = os.environ.get('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
         self.use_github = bool(self.github_token and self.github_repo)
+        self.github = GitHubClient(self.github_token, self.github_repo, self.github_api_url) if self.use_github else None
+        
+        # Write-behind state: add_score marks the board dirty, the writer thread flushes it
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._changes = 0
+        self._flushed_changes = 0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._writer = None
+        
+        # Incremented on every change; stored with the board so workers agree on it
+        self.version = 0
+        
+        # Change detection for the local file, so it is only re-read when it changed
+        self._file_signature = None
+        self._last_refresh = time.monotonic()
         
         # Debug logging
         if self.use_github:
@@ -49,22 +167,120 @@ class Leaderboard:
         else:
             print(f"GitHub integration disabled. Token: {'Yes' if self.github_token else 'No'}, Repo: {self.github_repo}")
         
-        self.leaderboard = self._load_leaderboard()
+        # Only the local file is read here, so constructing a Leaderboard never
+        # waits on the network; the GitHub copy is merged in by a background warm-up
+        data = self._load_leaderboard()
+        self.leaderboard = data
+        self.version = data.get('version', 0)
+        self.remote_loaded = False
+        self._warm_up_started = time.monotonic()
+        self._warmed_up = threading.Event()
+        atexit.register(self.close)
+        
+        if self.use_github:
+            threading.Thread(target=self._warm_up, name='leaderboard-warm-up', daemon=True).start()
+        else:
+            self._warmed_up.set()
+    
+    @property
+    def leaderboard(self) -> Dict:
+        """The board of every mode as plain lists, in the stored JSON shape."""
+        return {mode: board.entries for mode, board in self._boards.items()}
+    
+    @leaderboard.setter
+    def leaderboard(self, data: Dict):
+        self._boards = {mode: TopScores(data.get(mode, []), self.max_entries) for mode in MODES}
+    
+    def stored_data(self) -> Dict:
+        """The board of every mode plus its version, as saved to storage."""
+        with self._lock:
+            data = self.leaderboard
+            data['version'] = self.version
+        return data
+    
+    def snapshot(self):
+        """Get a consistent (version, board) pair, first picking up other workers' changes."""
+        self.refresh()
+        with self._lock:
+            return self.version, self.leaderboard
+    
+    def _absorb(self, data: Dict):
+        """Merge a stored copy of the leaderboard into memory."""
+        with self._lock:
+            merged = merge_versioned(self.stored_data(), data, limit=self.max_entries)
+            self.version = merged.pop('version')
+            self.leaderboard = merged
+    
+    def _local_signature(self):
+        """Modification time and size of the local file, or None if it doesn't exist."""
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def refresh(self, force: bool = False):
+        """Merge in the local file if another worker changed it since we last read or wrote it."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        
+        signature = self._local_signature()
+        if signature is None or signature == self._file_signature:
+            return
+        data = self._load_from_local_file()
+        if data is not None:
+            self._absorb(data)
+    
+    def _warm_up(self):
+        """Background thread: merge in the GitHub copy of the leaderboard."""
+        try:
+            with tracing.span('leaderboard.warm_up', root=True):
+                github_data = self._load_from_github(timeout=(self.WARM_UP_TIMEOUT / 2, self.WARM_UP_TIMEOUT / 2),
+                                                     retry=False)
+            if github_data:
+                self._absorb(github_data)
+                self.remote_loaded = True
+                print("Loaded leaderboard from GitHub")
+        except Exception as e:
+            print(f"Failed to load from GitHub: {e}")
+        finally:
+            self._warmed_up.set()
+    
+    def is_ready(self) -> bool:
+        """Check whether the startup warm-up finished or ran out of time."""
+        return (self._warmed_up.is_set() or
+                time.monotonic() - self._warm_up_started >= self.WARM_UP_TIMEOUT)
+    
+    def status(self) -> Dict:
+        """Warm-up state, for readiness checks."""
+        return {
+            'ready': self.is_ready(),
+            'source': 'github' if self.remote_loaded else 'local',
+            'version': self.version
+        }
     
     def _load_leaderboard(self) -> Dict:
-        """Load leaderboard from file or GitHub, or create default structure."""
-        # Try to load from GitHub first if configured
-        if self.use_github:
-            try:
-                github_data = self._load_from_github()
-                if github_data:
-                    print("Loaded leaderboard from GitHub")
-                    return github_data
-            except Exception as e:
-                print(f"Failed to load from GitHub: {e}")
+        """Load leaderboard from the local file, or create default structure."""
+        data = self._load_from_local_file()
+        if data is not None:
+            return data
         
-        # Fallback to local file
+        # Default structure
+        return {
+            'easy': [],
+            'hard': [],
+            'hikaru': []
+        }
+    
+    @LEADERBOARD_IO_SECONDS.time('load', 'local')
+    @tracing.traced('leaderboard.load', storage='local')
+    def _load_from_local_file(self) -> Optional[Dict]:
+        """Load leaderboard data from the local file (or its backup)."""
         if os.path.exists(self.filename):
+            # Remember which version of the file we read
+            self._file_signature = self._local_signature()
             try:
                 # Use file locking to prevent concurrent reads during writes
                 with open(self.filename, 'r') as f:
@@ -90,110 +306,142 @@ class Leaderboard:
                             return data
                     except Exception as backup_error:
                         print(f"Could not load from backup either: {backup_error}")
-                pass
-        
-        # Default structure
-        return {
-            'easy': [],
-            'hard': [],
-            'hikaru': []
-        }
+        return None
     
-    def _load_from_github(self) -> Optional[Dict]:
+    @LEADERBOARD_IO_SECONDS.time('load', 'github')
+    @tracing.traced('leaderboard.load', storage='github')
+    def _load_from_github(self, timeout: Optional[Timeout] = None, retry: bool = True) -> Optional[Dict]:
         """Load leaderboard data from GitHub repository."""
         try:
-            headers = {
-                'Authorization': f'token {self.github_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # Get the current content of the file
-            url = f'https://api.github.com/repos/{self.github_repo}/contents/{self.filename}'
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                content = response.json()
-                # Decode the content
-                file_content = base64.b64decode(content['content']).decode('utf-8')
-                return json.loads(file_content)
-            elif response.status_code == 404:
+            github_file = self.github.get_file(self.filename, timeout=timeout, retry=retry)
+            if github_file is None:
                 # File doesn't exist on GitHub, return None to use default
                 return None
-            else:
-                print(f"GitHub API error: {response.status_code}")
-                return None
-                
+            return json.loads(github_file.content.decode('utf-8'))
+        except GitHubError as e:
+            print(f"GitHub API error: {e.status_code}")
+            return None
         except Exception as e:
             print(f"Error loading from GitHub: {e}")
             return None
     
-    def _save_to_github(self) -> bool:
-        """Save leaderboard data to GitHub repository."""
+    @LEADERBOARD_IO_SECONDS.time('save', 'github')
+    @tracing.traced('leaderboard.save', storage='github')
+    def _save_to_github(self, data: Dict) -> Optional[Dict]:
+        """
+        Save leaderboard data to GitHub repository.
+        
+        The remote copy is merged in before every write. If someone else
+        committed in between (SHA conflict), the file is re-fetched, merged
+        and the write retried.
+        
+        Returns:
+            The merged data that was saved, or None if saving failed
+        """
         try:
-            headers = {
-                'Authorization': f'token {self.github_token}',
-                'Accept': 'application/vnd.github.v3+json'
-            }
-            
-            # Get the current file to get the SHA
-            url = f'https://api.github.com/repos/{self.github_repo}/contents/{self.filename}'
-            print(f"Checking existing file at: {url}")
-            response = requests.get(url, headers=headers)
-            
-            sha = None
-            if response.status_code == 200:
-                sha = response.json()['sha']
-                print(f"Found existing file with SHA: {sha[:8]}...")
-            elif response.status_code == 404:
-                print("File doesn't exist on GitHub, will create new file")
-            else:
-                print(f"Unexpected response when checking file: {response.status_code} - {response.text}")
-            
-            # Prepare the content
-            content = json.dumps(self.leaderboard, indent=2)
-            encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-            
-            # Create the commit
-            data = {
-                'message': f'Update leaderboard - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}',
-                'content': encoded_content,
-                'branch': 'master'
-            }
-            
-            if sha:
-                data['sha'] = sha
-            
-            print(f"Attempting to save to GitHub with data size: {len(content)} characters")
-            response = requests.put(url, headers=headers, json=data)
-            
-            if response.status_code in [200, 201]:
+            for attempt in range(1, self.MAX_SAVE_ATTEMPTS + 1):
+                # Get the current file for its SHA and the scores saved by others
+                sha = None
+                github_file = self.github.get_file(self.filename)
+                if github_file is not None:
+                    sha = github_file.sha
+                    remote = json.loads(github_file.content.decode('utf-8'))
+                    data = merge_versioned(data, remote, limit=self.max_entries)
+                else:
+                    print("File doesn't exist on GitHub, will create new file")
+                
+                try:
+                    self.github.put_file(
+                        self.filename,
+                        json.dumps(data, indent=2).encode('utf-8'),
+                        f'Update leaderboard - {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}',
+                        sha=sha
+                    )
+                except GitHubConflict:
+                    # The file changed since we read it - re-fetch, merge and retry
+                    print(f"GitHub save conflict (attempt {attempt}/{self.MAX_SAVE_ATTEMPTS}), retrying")
+                    continue
+                
                 print("Successfully saved leaderboard to GitHub")
-                return True
-            else:
-                print(f"Failed to save to GitHub: {response.status_code} - {response.text}")
-                return False
+                return data
+            
+            print("Giving up on GitHub save after repeated conflicts")
+            return None
                 
+        except GitHubError as e:
+            print(f"Failed to save to GitHub: {e}")
+            return None
         except Exception as e:
             print(f"Error saving to GitHub: {e}")
-            return False
+            return None
     
     def _save_leaderboard(self):
         """Save leaderboard to file and/or GitHub using atomic write operation."""
+        # Merge in scores other workers wrote to the local file
+        self.refresh(force=True)
+        data = self.stored_data()
+        
         # Try to save to GitHub first if configured
         if self.use_github:
-            print("Attempting to save to GitHub...")
-            if self._save_to_github():
-                print("Successfully saved to GitHub, also saving locally as backup")
-                # Also save locally as backup
-                self._save_to_local_file()
-                return
+            saved = self._save_to_github(data)
+            if saved is not None:
+                # Pick up scores merged in from GitHub (and keep any added meanwhile)
+                self._absorb(saved)
             else:
                 print("GitHub save failed, falling back to local file")
         
-        # Fallback to local file only
-        print("Saving to local file only")
+        # Always keep the local file up to date (backup when GitHub is used)
         self._save_to_local_file()
     
+    def _writer_loop(self):
+        """Background thread: flush pending changes every flush_interval seconds."""
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+    
+    def _ensure_writer(self):
+        """Start the background writer thread on first use."""
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None and not self._stopped:
+                    self._writer = threading.Thread(target=self._writer_loop,
+                                                    name='leaderboard-writer', daemon=True)
+                    self._writer.start()
+    
+    def flush(self) -> bool:
+        """
+        Persist pending changes now.
+        
+        Returns:
+            True if there was something to save
+        """
+        with self._flush_lock:
+            with self._lock:
+                changes = self._changes
+            if changes == self._flushed_changes:
+                return False
+            try:
+                # Saves run on the writer thread, so each one is traced on its own
+                with tracing.span('leaderboard.flush', root=True, changes=changes - self._flushed_changes):
+                    self._save_leaderboard()
+            except Exception as e:
+                # Keep the changes pending; the next flush retries
+                print(f"Error flushing leaderboard: {e}")
+                return True
+            self._flushed_changes = changes
+            return True
+    
+    def close(self):
+        """Stop the writer thread and flush anything still pending (called at shutdown)."""
+        self._stopped = True
+        self._wake.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join(timeout=self.flush_interval + 30)
+        self.flush()
+    
+    @LEADERBOARD_IO_SECONDS.time('save', 'local')
+    @tracing.traced('leaderboard.save', storage='local')
     def _save_to_local_file(self):
         """Save leaderboard to local file using atomic write operation."""
         try:
@@ -210,13 +458,14 @@ class Leaderboard:
             
             try:
                 # Write data to temporary file
-                json.dump(self.leaderboard, temp_file, indent=2)
+                json.dump(self.stored_data(), temp_file, indent=2)
                 temp_file.flush()
                 os.fsync(temp_file.fileno())  # Ensure data is written to disk
                 temp_file.close()
                 
                 # Atomic move operation (rename is atomic on most filesystems)
                 shutil.move(temp_file.name, self.filename)
+                self._file_signature = self._local_signature()
                 
                 # Clean up old backup if save was successful
                 backup_filename = f"{self.filename}.backup"
@@ -249,14 +498,14 @@ class Leaderboard:
             # Fallback to direct write if atomic operation fails
             try:
                 with open(self.filename, 'w') as f:
-                    json.dump(self.leaderboard, f, indent=2)
+                    json.dump(self.stored_data(), f, indent=2)
             except Exception as fallback_error:
                 print(f"Critical error: Could not save leaderboard: {fallback_error}")
                 # Last resort: try to save to a different location
                 try:
                     emergency_filename = f"{self.filename}.emergency"
                     with open(emergency_filename, 'w') as f:
-                        json.dump(self.leaderboard, f, indent=2)
+                        json.dump(self.stored_data(), f, indent=2)
                     print(f"Emergency save to {emergency_filename}")
                 except Exception as emergency_error:
                     print(f"Emergency save also failed: {emergency_error}")
@@ -273,7 +522,7 @@ class Leaderboard:
         Returns:
             Dict with info about the score placement
         """
-        if mode not in ['easy', 'hard', 'hikaru']:
+        if mode not in MODES:
             raise ValueError("Mode must be 'easy', 'hard', or 'hikaru'")
         
         # Generate anonymous name if none provided
@@ -288,24 +537,23 @@ class Leaderboard:
             'timestamp': datetime.now().timestamp()
         }
         
-        # Reload leaderboard to get latest data from file/GitHub
-        self.leaderboard = self._load_leaderboard()
+        self.refresh()
         
-        # Add to appropriate leaderboard
-        self.leaderboard[mode].append(score_entry)
+        # Update the in-memory board; the writer thread persists it shortly after.
+        # Ties rank by timestamp, so the first person to achieve a score gets the higher rank
+        with self._lock:
+            board = self._boards[mode]
+            position = board.add(score_entry)
+            if position is not None:
+                self._changes += 1
+                self.version += 1
         
-        # Sort by score (highest first), then by timestamp (earliest first for ties)
-        # This ensures that when scores are tied, the first person to achieve that score gets the higher rank
-        self.leaderboard[mode].sort(key=lambda x: (x['score'], -x['timestamp']), reverse=True)
-        
-        # Keep only top 5 scores
-        self.leaderboard[mode] = self.leaderboard[mode][:5]
-        
-        # Save to file and/or GitHub
-        self._save_leaderboard()
+        if position is None:
+            position = len(board.entries) + 1
+        else:
+            self._ensure_writer()
         
         # Check if this is a new high score
-        position = self._get_score_position(mode, score, score_entry['timestamp'])
         is_new_high_score = position == 1
         
         return {
@@ -314,45 +562,22 @@ class Leaderboard:
             'top_scores': self.get_top_scores(mode)
         }
     
-    def _get_score_position(self, mode: str, score: int, timestamp: float = None) -> int:
-        """
-        Get the position of a score in the leaderboard.
-        For tied scores, earlier timestamps get higher positions.
-        """
-        if timestamp is None:
-            # If no timestamp provided, find the position of the first occurrence of this score
-            for i, entry in enumerate(self.leaderboard[mode]):
-                if entry['score'] == score:
-                    return i + 1
-            return len(self.leaderboard[mode]) + 1
-        
-        # Find the position based on the specific timestamp
-        for i, entry in enumerate(self.leaderboard[mode]):
-            if entry['score'] == score and entry['timestamp'] == timestamp:
-                return i + 1
-        return len(self.leaderboard[mode]) + 1
-    
     def get_top_scores(self, mode: str) -> List[Dict]:
-        """Get top 5 scores for a mode."""
-        return self.leaderboard.get(mode, [])
+        """Get the top scores for a mode."""
+        board = self._boards.get(mode)
+        return board.entries if board else []
     
     def check_if_high_score(self, mode: str, score: int) -> bool:
-        """Check if a score would make it to the top 5."""
-        if mode not in ['easy', 'hard', 'hikaru']:
+        """Check if a score would make it onto the board."""
+        if mode not in MODES:
             return False
         
-        current_scores = self.leaderboard[mode]
-        
-        # If less than 5 scores, it's automatically a high score
-        if len(current_scores) < 5:
-            return True
-        
-        # Check if score is higher than the lowest score
-        lowest_score = min(entry['score'] for entry in current_scores)
-        return score > lowest_score
+        self.refresh()
+        return self._boards[mode].qualifies(score)
     
     def get_leaderboard_data(self) -> Dict:
         """Get complete leaderboard data for all modes."""
+        self.refresh()
         return {
             'easy': self.get_top_scores('easy'),
             'hard': self.get_top_scores('hard'),
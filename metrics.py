@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Metrics for chess puzzle game, exposed in the Prometheus text format.
+
+Recording is lock-free: every thread updates its own shard (a plain dict
+keyed by metric and label values), and shards are only merged when the
+metrics are read. Shards of finished threads are folded into a retired
+total, so servers that start a thread per request don't accumulate them.
+
+With several worker processes, each worker periodically writes its totals
+to a file in a shared directory (METRICS_DIRECTORY); whichever worker
+serves /metrics merges every file, so counters and histograms cover the
+whole server. Gauges are combined per gauge (summed, or the maximum for
+values that every worker sees identically). Only live workers count: the
+file of a worker that has exited, or stopped writing, is deleted, so its
+counters leave the totals (Prometheus sees a counter reset).
+"""
+
+import atexit
+import bisect
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from 0.5 ms to 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between writes of this worker's totals to the shared directory
+FLUSH_INTERVAL = 5.0
+# Files older than this are deleted when merging (their worker is gone or stuck)
+STALE_AFTER = 3 * FLUSH_INTERVAL
+# Folding finished threads' shards is checked every this many new shards
+SWEEP_EVERY = 64
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry: Dict[str, 'Metric'] = {}
+_local = threading.local()
+_shards = []
+_retired: Dict[tuple, object] = {}
+_shards_lock = threading.Lock()
+_directory = None
+_snapshot_path = None
+
+
+def _shard() -> dict:
+    """Get this thread's shard, creating it on the thread's first recording."""
+    try:
+        return _local.values
+    except AttributeError:
+        values = _local.values = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), values))
+            if len(_shards) % SWEEP_EVERY == 0:
+                _sweep()
+        return values
+
+
+def _sweep():
+    """Fold the shards of finished threads into the retired totals (caller holds _shards_lock)."""
+    alive = []
+    for thread, values in _shards:
+        if thread.is_alive():
+            alive.append((thread, values))
+        else:
+            _merge_into(_retired, values.items())
+    _shards[:] = alive
+
+
+def _merge_into(totals: dict, items: Iterable):
+    """Add (key, value) samples into totals; histogram values are lists of bucket counts plus the sum."""
+    for key, value in items:
+        current = totals.get(key)
+        if current is None:
+            totals[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            for i, part in enumerate(value):
+                current[i] += part
+        else:
+            totals[key] = current + value
+
+
+class Metric:
+    """Base class: a named metric with label names, registered once per process."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        if name in _registry:
+            raise ValueError(f"Metric {name} is already registered")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = None
+        _registry[name] = self
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]):
+        """Compute this metric when it is read, from a function returning {label values: value}."""
+        self.function = function
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        values = _shard()
+        key = (self.name, labelvalues)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value computed when read, via set_function.
+
+    Across workers the values are summed, or with aggregate='max' the
+    largest is taken (for values every worker reads from shared storage).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), aggregate: str = 'sum'):
+        super().__init__(name, documentation, labelnames)
+        if aggregate not in ('sum', 'max'):
+            raise ValueError(f"Unknown gauge aggregate {aggregate!r}")
+        self.aggregate = aggregate
+        self.derived = None
+
+    def set_derived(self, function: Callable[[Dict[tuple, object]], Dict[Tuple[str, ...], float]]):
+        """
+        Compute this gauge from the other metrics' totals across all workers,
+        e.g. a ratio of two counters; function(totals) returns {label values: value}.
+        """
+        self.derived = function
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str):
+        values = _shard()
+        key = (self.name, labelvalues)
+        entry = values.get(key)
+        if entry is None:
+            # One count per bucket, one for +Inf, then the sum
+            entry = values[key] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def time(self, *labelvalues: str) -> '_Timer':
+        """Time a block (as a context manager) or every call of a function (as a decorator)."""
+        return _Timer(self, labelvalues)
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labelvalues: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+    def __call__(self, function):
+        histogram, labelvalues = self.histogram, self.labelvalues
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labelvalues)
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        timed.__wrapped__ = function
+        return timed
+
+
+def collect() -> Dict[tuple, object]:
+    """Merge this process's shards and computed metrics into {(name, label values): value}."""
+    with _shards_lock:
+        _sweep()
+        totals = {}
+        _merge_into(totals, _retired.items())
+        for _, values in _shards:
+            # Another thread may be adding a key; copying the items is a single step under the GIL
+            _merge_into(totals, list(values.items()))
+
+    for metric in list(_registry.values()):
+        if metric.function is None:
+            continue
+        try:
+            computed = metric.function()
+        except Exception as e:
+            print(f"Warning: Could not compute metric {metric.name}: {e}")
+            continue
+        for labelvalues, value in computed.items():
+            totals[(metric.name, tuple(labelvalues))] = value
+    return totals
+
+
+def configure(directory: Optional[str]):
+    """
+    Share metrics between worker processes through a directory.
+
+    Starts a background thread writing this worker's totals every
+    FLUSH_INTERVAL seconds (and at exit). Does nothing if directory is empty.
+    """
+    global _directory, _snapshot_path
+    if not directory or _directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _directory = directory
+    # A random suffix, so a restarted worker that reuses a PID never overwrites a dead one's counters
+    _snapshot_path = os.path.join(directory, f'metrics-{os.getpid()}-{secrets.token_hex(4)}.json')
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+    atexit.register(write_snapshot)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        write_snapshot()
+
+
+def write_snapshot():
+    """Write this worker's totals to the shared directory."""
+    if _snapshot_path is None:
+        return
+    samples = [[name, list(labelvalues), value] for (name, labelvalues), value in collect().items()]
+    temp_path = f"{_snapshot_path}.tmp"
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'samples': samples}, f)
+        os.replace(temp_path, _snapshot_path)
+    except OSError as e:
+        print(f"Warning: Could not write metrics snapshot {_snapshot_path}: {e}")
+
+
+def _is_running(pid) -> bool:
+    """Check whether a process exists (workers share one host, so one PID space)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, TypeError, ValueError, OverflowError):
+        # Exists but belongs to another user, or the PID is unusable: leave it to the age check
+        return True
+    return True
+
+
+def _read_snapshots():
+    """Load the snapshots of live workers from the shared directory, deleting those of dead ones."""
+    snapshots = []
+    now = time.time()
+    for filename in os.listdir(_directory):
+        if not (filename.startswith('metrics-') and filename.endswith('.json')):
+            continue
+        path = os.path.join(_directory, filename)
+        try:
+            with open(path, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            # Being replaced by its worker, or left half-written by one that crashed
+            continue
+        # A PID reused by another process is still caught by the age check
+        stale = now - snapshot.get('time', 0) > STALE_AFTER or not _is_running(snapshot.get('pid'))
+        if stale and path != _snapshot_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def aggregate() -> Dict[tuple, object]:
+    """Totals across every worker (or just this process without a shared directory)."""
+    if _directory is None:
+        return collect()
+
+    write_snapshot()
+    totals = {}
+    for snapshot in _read_snapshots():
+        for name, labelvalues, value in snapshot['samples']:
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+            key = (name, tuple(labelvalues))
+            if isinstance(metric, Gauge) and metric.aggregate == 'max':
+                totals[key] = max(totals.get(key, value), value)
+                continue
+            _merge_into(totals, [(key, value)])
+    return totals
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    totals = aggregate()
+    for metric in list(_registry.values()):
+        if isinstance(metric, Gauge) and metric.derived is not None:
+            for labelvalues, value in metric.derived(totals).items():
+                totals[(metric.name, tuple(labelvalues))] = value
+    by_metric = {}
+    for (name, labelvalues), value in totals.items():
+        by_metric.setdefault(name, []).append((labelvalues, value))
+
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labelvalues, value in sorted(by_metric.get(name, ()), key=lambda sample: sample[0]):
+            labels = _format_labels(metric.labelnames, labelvalues)
+            if not isinstance(metric, Histogram):
+                lines.append(f'{name}{labels} {_format_value(value)}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (math.inf,), value):
+                cumulative += count
+                bucket_labels = _format_labels(metric.labelnames + ('le',), labelvalues + (_format_value(float(bound)),))
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{name}_sum{labels} {_format_value(value[-1])}')
+            lines.append(f'{name}_count{labels} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling for chess puzzle game workers.
+Disabled unless a PROFILING_TOKEN is configured; every request to start
+a profile or take a memory snapshot must carry that token.
+
+Two CPU modes run for a bounded window and write their result to the
+profile directory, named after the worker's PID:
+- 'sampler' walks every thread's stack at a fixed interval and writes
+  collapsed stacks ("frame;frame;frame count"), the input format of
+  flamegraph.pl and speedscope
+- 'cprofile' runs cProfile on one request in N and writes the merged
+  pstats file
+
+Memory snapshots use tracemalloc and attribute allocations to the puzzle
+store, the sessions and the leaderboard by the first frame in their code.
+They also diff against the previous snapshot, to see what grows between two
+points in time. Allocations made before tracemalloc started are invisible,
+so set PROFILING_TRACEMALLOC to start it at import when the startup
+footprint matters. Tracing started by a snapshot request is bounded too: it
+stops, and the kept snapshot is dropped, MAX_DURATION seconds after the last
+snapshot, or when stop_memory_tracing() is called.
+"""
+
+import cProfile
+import hmac
+import itertools
+import io
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# Upper bounds, so a profile cannot be left running
+MAX_DURATION = 300
+MIN_INTERVAL_MS = 1
+MAX_INTERVAL_MS = 1000
+DEFAULT_DURATION = 30
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_ONE_IN = 10
+# Stack frames kept per sample
+MAX_STACK_DEPTH = 64
+# Stack frames kept per allocation when a snapshot request starts tracemalloc
+TRACEMALLOC_FRAMES = 16
+
+# Source files of each component, for attributing memory; the chess puzzles and
+# boards built for games in progress are held by player sessions
+COMPONENTS = {
+    'puzzle_store': ('puzzle_store.py', 'puzzle_db.py', 'descriptions.py', 'puzzle_validation.py'),
+    'sessions': ('sessions.py', 'game_tokens.py', 'puzzle.py', 'board.py'),
+    'leaderboard': ('leaderboard.py', 'github_client.py'),
+}
+
+_token = None
+_directory = '.profiles'
+_sequence = itertools.count(1)
+_lock = threading.Lock()
+_active = None
+_memory_lock = threading.Lock()
+_last_snapshot = None
+# Stops tracemalloc started on demand once snapshots stop coming
+_memory_timer = None
+
+
+def configure(token: Optional[str], directory: str = '.profiles', tracemalloc_frames: int = 0):
+    """
+    Enable profiling for requests carrying token (profiling stays off if it is empty).
+
+    Args:
+        token: Secret the profiling endpoints require
+        directory: Where profiles and memory reports are written
+        tracemalloc_frames: Start tracemalloc now with this many frames per allocation (0: on demand)
+    """
+    global _token, _directory
+    if not token:
+        return
+    _token = token
+    _directory = directory
+    if tracemalloc_frames and not tracemalloc.is_tracing():
+        tracemalloc.start(tracemalloc_frames)
+
+
+def is_enabled() -> bool:
+    return _token is not None
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Check a request's token against the configured one in constant time."""
+    return _token is not None and bool(token) and hmac.compare_digest(token.encode(), _token.encode())
+
+
+def _output_path(kind: str, extension: str) -> str:
+    os.makedirs(_directory, exist_ok=True)
+    # A window can still be writing when the next one starts, so the sequence number keeps names apart
+    return os.path.join(_directory, f"{kind}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}-{next(_sequence)}.{extension}")
+
+
+class _Session:
+    """A running profile: its mode, settings, deadline and output file."""
+
+    def __init__(self, mode: str, duration: float, **settings):
+        self.mode = mode
+        self.settings = settings
+        self.started = time.time()
+        self.deadline = time.monotonic() + duration
+        self.path = _output_path('profile', 'collapsed' if mode == 'sampler' else 'pstats')
+        self.samples = 0
+
+    def describe(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'pid': os.getpid(),
+            'started': self.started,
+            'remaining_seconds': max(0.0, round(self.deadline - time.monotonic(), 1)),
+            'samples': self.samples,
+            'output': self.path,
+            **self.settings
+        }
+
+
+def status() -> Optional[Dict]:
+    """The running profile, or None."""
+    session = _active
+    return session.describe() if session else None
+
+
+def start(mode: str, duration: float = DEFAULT_DURATION, interval_ms: float = DEFAULT_INTERVAL_MS,
+          one_in: int = DEFAULT_ONE_IN) -> Dict:
+    """
+    Start a profile in this worker.
+
+    Raises:
+        ValueError: For an unknown mode or out-of-range settings
+        RuntimeError: If a profile is already running
+    """
+    global _active
+    if mode not in ('sampler', 'cprofile'):
+        raise ValueError("Mode must be 'sampler' or 'cprofile'")
+    if not math.isfinite(duration) or not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"Duration must be between 0 and {MAX_DURATION} seconds")
+    if mode == 'sampler':
+        # The sampler only checks its deadline between samples, so one interval must fit in the window
+        max_interval_ms = min(MAX_INTERVAL_MS, duration * 1000)
+        if not math.isfinite(interval_ms) or not MIN_INTERVAL_MS <= interval_ms <= max_interval_ms:
+            raise ValueError(f"Interval must be between {MIN_INTERVAL_MS} and {max_interval_ms:g} ms")
+    elif one_in < 1:
+        raise ValueError("one_in must be at least 1")
+
+    with _lock:
+        if _active is not None:
+            raise RuntimeError("A profile is already running in this worker")
+        if mode == 'sampler':
+            session = _Session(mode, duration, interval_ms=interval_ms)
+            session.stacks = Counter()
+            threading.Thread(target=_sample, args=(session, interval_ms / 1000), name='profiling-sampler',
+                             daemon=True).start()
+        else:
+            session = _Session(mode, duration, one_in=one_in)
+            session.requests = 0
+            session.stats = None
+            session.busy = False
+            session.ended = False
+            timer = threading.Timer(duration, _finish_cprofile, args=(session,))
+            timer.daemon = True
+            timer.start()
+        _active = session
+    return session.describe()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample(session: _Session, interval: float):
+    """Sampler thread: record every other thread's stack until the deadline, then write them."""
+    global _active
+    own_id = threading.get_ident()
+    names = {}
+    try:
+        while time.monotonic() < session.deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                session.stacks[';'.join(reversed(stack))] += 1
+            session.samples += 1
+            time.sleep(min(interval, max(0.0, session.deadline - time.monotonic())))
+
+        try:
+            with open(session.path, 'w') as f:
+                for stack, count in session.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"Profile written to {session.path} ({session.samples} samples)")
+        except OSError as e:
+            print(f"Warning: Could not write profile {session.path}: {e}")
+    finally:
+        # Whatever happens to the sampler, the worker must be free to start another profile
+        with _lock:
+            if _active is session:
+                _active = None
+
+
+def start_request() -> Optional[Tuple[_Session, cProfile.Profile]]:
+    """
+    Called before each request: start cProfile if this is the request to profile.
+
+    Only one request is profiled at a time; returns the session and the
+    profiler, to hand back to finish_request, or None.
+    """
+    session = _active
+    if session is None or session.mode != 'cprofile':
+        return None
+    with _lock:
+        if session is not _active:
+            return None
+        session.requests += 1
+        if session.busy or session.requests % session.settings['one_in']:
+            return None
+        session.busy = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return session, profiler
+
+
+def finish_request(session: _Session, profiler: cProfile.Profile):
+    """
+    Called after a profiled request: stop cProfile and merge its statistics.
+
+    The statistics go to the session the request started in, even if its
+    window has ended since (it then waits for this request to be written)
+    or another profile has started.
+    """
+    profiler.disable()
+    with _lock:
+        if session.stats is None:
+            session.stats = pstats.Stats(profiler, stream=io.StringIO())
+        else:
+            session.stats.add(profiler)
+        session.samples += 1
+        session.busy = False
+        ended = session.ended
+    if ended:
+        _write_cprofile(session)
+
+
+def _finish_cprofile(session: _Session):
+    """Timer: end a cProfile window and write its statistics, unless a profiled request is still running."""
+    global _active
+    with _lock:
+        if session.ended:
+            return
+        if _active is session:
+            _active = None
+        session.ended = True
+        if session.busy:
+            # finish_request writes the statistics once that request is done
+            return
+    _write_cprofile(session)
+
+
+def _write_cprofile(session: _Session):
+    """Write the merged statistics of a finished cProfile window."""
+    stats = session.stats
+    if stats is None:
+        print("Profile window ended without a profiled request")
+        return
+    try:
+        stats.dump_stats(session.path)
+        print(f"Profile written to {session.path} ({session.samples} requests)")
+    except OSError as e:
+        print(f"Warning: Could not write profile {session.path}: {e}")
+
+
+def _component(traceback) -> str:
+    """The component whose code made an allocation, from the innermost frame that belongs to one."""
+    for frame in reversed(traceback):
+        filename = os.path.basename(frame.filename)
+        for component, filenames in COMPONENTS.items():
+            if filename in filenames:
+                return component
+    return 'other'
+
+
+def _by_component(statistics) -> Dict[str, int]:
+    sizes = Counter()
+    for statistic in statistics:
+        sizes[_component(statistic.traceback)] += statistic.size
+    return dict(sizes)
+
+
+def _schedule_memory_stop():
+    """(Re)start the countdown that stops tracemalloc started on demand (caller holds _memory_lock)."""
+    global _memory_timer
+    if _memory_timer is not None:
+        _memory_timer.cancel()
+    _memory_timer = threading.Timer(MAX_DURATION, stop_memory_tracing)
+    _memory_timer.daemon = True
+    _memory_timer.start()
+
+
+def stop_memory_tracing() -> bool:
+    """Stop tracemalloc and drop the kept snapshot; returns whether tracemalloc was running."""
+    global _last_snapshot, _memory_timer
+    with _memory_lock:
+        if _memory_timer is not None:
+            _memory_timer.cancel()
+            _memory_timer = None
+        _last_snapshot = None
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        print("Memory tracing stopped")
+        return True
+
+
+def memory_snapshot(top: int = 25) -> Dict:
+    """
+    Take a tracemalloc snapshot of this worker and write a report.
+
+    The first call starts tracemalloc (with TRACEMALLOC_FRAMES frames) if it
+    is not running yet, so only allocations made from then on are seen; it
+    stops again MAX_DURATION seconds after the last snapshot.
+
+    Returns:
+        Summary with bytes per component, the growth per component since the
+        previous snapshot, and the path of the full report
+    """
+    with _memory_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _schedule_memory_stop()
+            return {'tracing': 'started', 'pid': os.getpid(), 'stops_after_seconds': MAX_DURATION,
+                    'message': 'tracemalloc started; take another snapshot later to see allocations'}
+        if _memory_timer is not None:
+            _schedule_memory_stop()
+        return _memory_report(top)
+
+
+def _memory_report(top: int) -> Dict:
+    """Snapshot, compare with the previous snapshot and write the report (caller holds _memory_lock)."""
+    global _last_snapshot
+    # Leave out what the reports themselves allocate (source lines read for tracebacks)
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, __file__, all_frames=True),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    statistics = snapshot.statistics('traceback')
+    components = _by_component(statistics)
+
+    growth = None
+    top_growth = []
+    if _last_snapshot is not None:
+        differences = snapshot.compare_to(_last_snapshot, 'traceback')
+        growth = Counter()
+        for difference in differences:
+            growth[_component(difference.traceback)] += difference.size_diff
+        growth = dict(growth)
+        top_growth = [d for d in differences if d.size_diff > 0][:top]
+    _last_snapshot = snapshot
+
+    path = _output_path('memory', 'txt')
+    traced, peak = tracemalloc.get_traced_memory()
+    with open(path, 'w') as f:
+        f.write(f"pid {os.getpid()}: {traced} bytes traced, peak {peak}\n\n")
+        f.write("By component:\n")
+        for component, size in sorted(components.items(), key=lambda item: -item[1]):
+            change = f" ({growth.get(component, 0):+d} since last snapshot)" if growth is not None else ""
+            f.write(f"  {component:14} {size:>14,d} bytes{change}\n")
+        f.write(f"\nTop {top} allocation sites:\n")
+        for statistic in statistics[:top]:
+            f.write(f"\n{statistic.size:,d} bytes in {statistic.count:,d} blocks ({_component(statistic.traceback)})\n")
+            f.write('\n'.join(statistic.traceback.format(limit=8)) + '\n')
+        if top_growth:
+            f.write(f"\nTop {top} growing sites since last snapshot:\n")
+            for difference in top_growth:
+                f.write(f"\n{difference.size_diff:+,d} bytes ({_component(difference.traceback)})\n")
+                f.write('\n'.join(difference.traceback.format(limit=8)) + '\n')
+
+    return {
+        'pid': os.getpid(),
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'components': components,
+        'growth_since_last': growth,
+        'report': path
+    }
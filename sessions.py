@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Per-player game state for chess puzzle game.
+Keeps each session's puzzle progress and streak in a bounded store with
+LRU eviction and idle-time expiry.
+
+Two backends share the same interface:
+- GameStateStore keeps sessions in process memory (single worker)
+- SQLiteGameStateStore keeps them in a local SQLite database in WAL mode,
+  so any worker on the host can serve any player
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import tracing
+
+# Elo-style rating estimate of the player, used by the adaptive mode
+DEFAULT_RATING = 1200
+MIN_RATING = 400
+MAX_RATING = 3200
+RATING_K = 32
+# A larger step for the first results, so new players converge quickly
+PROVISIONAL_RATING_K = 64
+PROVISIONAL_GAMES = 10
+
+
+class SessionConflict(Exception):
+    """Raised when another worker saved a session while this worker was using it."""
+
+
+class GameState:
+    """Puzzle progress and statistics for one player session."""
+
+    def __init__(self):
+        self.current_puzzle = None
+        self.current_puzzle_id = None
+        self.current_puzzle_index = None
+        self.player_color = 'white'
+        self.consecutive_wins = 0
+        self.total_puzzles_solved = 0
+        # Streak ended by the last wrong move, which may still be submitted as a score
+        self.last_streak = 0
+        # Position in this player's shuffled walk through the puzzles (see PuzzleStore.sample_sequence)
+        self.sample_seed = random.getrandbits(32)
+        self.sample_counter = 0
+        self.rating = DEFAULT_RATING
+        self.rated_games = 0
+        # Only the first result on each puzzle counts towards the rating
+        self.puzzle_rated = False
+        self.last_seen = time.monotonic()
+        # Serializes requests from the same player without blocking anyone else
+        self.lock = threading.Lock()
+
+    def progress(self):
+        """Get the persistent part of the state as a tuple."""
+        move_index = self.current_puzzle.current_move_index if self.current_puzzle else 0
+        return (self.current_puzzle_index, self.current_puzzle_id, move_index,
+                self.player_color, self.consecutive_wins, self.total_puzzles_solved,
+                self.sample_seed, self.sample_counter, self.rating, self.rated_games,
+                self.puzzle_rated)
+
+    def record_result(self, puzzle_rating, solved):
+        """Update the rating estimate with the first result on the active puzzle."""
+        if self.puzzle_rated or puzzle_rating is None:
+            return
+        self.puzzle_rated = True
+        expected = 1 / (1 + 10 ** ((puzzle_rating - self.rating) / 400))
+        k = PROVISIONAL_RATING_K if self.rated_games < PROVISIONAL_GAMES else RATING_K
+        rating = self.rating + k * ((1 if solved else 0) - expected)
+        self.rating = round(min(max(rating, MIN_RATING), MAX_RATING))
+        self.rated_games += 1
+
+    def reset(self):
+        """Clear the streak, statistics and active puzzle (the puzzle walk and rating estimate carry on)."""
+        self.consecutive_wins = 0
+        self.total_puzzles_solved = 0
+        self.last_streak = 0
+        self.current_puzzle = None
+        self.current_puzzle_id = None
+        self.current_puzzle_index = None
+
+
+class GameStateStore:
+    """
+    Thread-safe, bounded map from session ID to GameState.
+
+    Sessions are kept in least-recently-used order, so both the size cap and
+    the idle TTL evict from the front in amortized O(1). The store-wide lock
+    only guards the map itself; game logic runs under each session's own lock.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _evict(self, now: float):
+        """Drop expired sessions and the least recently used ones beyond the cap."""
+        while self._states:
+            oldest = next(iter(self._states.values()))
+            if len(self._states) <= self.max_sessions and now - oldest.last_seen <= self.ttl_seconds:
+                break
+            self._states.popitem(last=False)
+
+    def get(self, session_id: str) -> GameState:
+        """Get the state for a session, creating it if needed."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is None or now - state.last_seen > self.ttl_seconds:
+                state = GameState()
+                self._states[session_id] = state
+            else:
+                self._states.move_to_end(session_id)
+            state.last_seen = now
+            self._evict(now)
+        return state
+
+    def peek(self, session_id: str) -> Optional[GameState]:
+        """Get the state for a session without creating or refreshing it."""
+        with self._lock:
+            state = self._states.get(session_id)
+        if state is None or time.monotonic() - state.last_seen > self.ttl_seconds:
+            return None
+        return state
+
+    def discard(self, session_id: str):
+        """Forget a session."""
+        with self._lock:
+            self._states.pop(session_id, None)
+
+    @contextmanager
+    def checkout(self, session_id: str):
+        """Hold a session's state exclusively for the duration of a request."""
+        state = self.get(session_id)
+        with state.lock:
+            yield state
+
+
+class SQLiteGameStateStore:
+    """
+    Game state shared by all worker processes through a local SQLite database.
+
+    Only progress is stored (puzzle index and ID, move index, streak,
+    totals, the position in the player's puzzle walk and rating estimate); the puzzle itself is rebuilt with puzzle_loader. Each worker
+    keeps a small LRU of rebuilt states keyed by row version, so an
+    unchanged session costs one primary-key SELECT and no board replay.
+    Versions are random 63-bit IDs rather than a counter, so a row that is
+    deleted and created again never reuses a version another worker cached.
+    Writes only succeed against the version that was loaded; if another
+    worker saved the session in between, checkout raises SessionConflict.
+    Every statement is a fixed SQL string, which sqlite3 compiles once per
+    connection and reuses from its statement cache.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS game_sessions (
+            session_id TEXT PRIMARY KEY,
+            puzzle_index INTEGER,
+            puzzle_id TEXT,
+            move_index INTEGER NOT NULL DEFAULT 0,
+            player_color TEXT NOT NULL DEFAULT 'white',
+            consecutive_wins INTEGER NOT NULL DEFAULT 0,
+            total_puzzles_solved INTEGER NOT NULL DEFAULT 0,
+            last_seen REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            sample_seed INTEGER NOT NULL DEFAULT 0,
+            sample_counter INTEGER NOT NULL DEFAULT 0,
+            player_rating INTEGER NOT NULL DEFAULT 1200,
+            rated_games INTEGER NOT NULL DEFAULT 0,
+            puzzle_rated INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    # Columns added since the first release, created on databases that predate them
+    MIGRATIONS = {
+        'sample_seed': "ALTER TABLE game_sessions ADD COLUMN sample_seed INTEGER NOT NULL DEFAULT 0",
+        'sample_counter': "ALTER TABLE game_sessions ADD COLUMN sample_counter INTEGER NOT NULL DEFAULT 0",
+        'player_rating': "ALTER TABLE game_sessions ADD COLUMN player_rating INTEGER NOT NULL DEFAULT 1200",
+        'rated_games': "ALTER TABLE game_sessions ADD COLUMN rated_games INTEGER NOT NULL DEFAULT 0",
+        'puzzle_rated': "ALTER TABLE game_sessions ADD COLUMN puzzle_rated INTEGER NOT NULL DEFAULT 0"
+    }
+    INDEX = "CREATE INDEX IF NOT EXISTS game_sessions_last_seen ON game_sessions (last_seen)"
+    SELECT = """
+        SELECT puzzle_index, puzzle_id, move_index, player_color,
+               consecutive_wins, total_puzzles_solved, sample_seed, sample_counter,
+               player_rating, rated_games, puzzle_rated, last_seen, version
+        FROM game_sessions WHERE session_id = ?
+    """
+    INSERT = """
+        INSERT INTO game_sessions (session_id, puzzle_index, puzzle_id, move_index, player_color,
+                                   consecutive_wins, total_puzzles_solved, sample_seed,
+                                   sample_counter, player_rating, rated_games, puzzle_rated,
+                                   last_seen, version)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    # Only succeeds if the row still has the version this worker loaded
+    UPDATE = """
+        UPDATE game_sessions SET
+            puzzle_index = ?, puzzle_id = ?, move_index = ?, player_color = ?,
+            consecutive_wins = ?, total_puzzles_solved = ?, sample_seed = ?,
+            sample_counter = ?, player_rating = ?, rated_games = ?, puzzle_rated = ?,
+            last_seen = ?, version = ?
+        WHERE session_id = ? AND version = ?
+    """
+    TOUCH = "UPDATE game_sessions SET last_seen = ? WHERE session_id = ?"
+    DELETE = "DELETE FROM game_sessions WHERE session_id = ?"
+    COUNT = "SELECT COUNT(*) FROM game_sessions"
+    EXPIRE = "DELETE FROM game_sessions WHERE last_seen < ?"
+    TRIM = """
+        DELETE FROM game_sessions WHERE session_id IN (
+            SELECT session_id FROM game_sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?
+        )
+    """
+
+    # Refresh last_seen on reads at most this often, so reads rarely write
+    TOUCH_INTERVAL = 60
+    # How often each worker prunes expired and excess sessions
+    PRUNE_INTERVAL = 60
+    LOCK_STRIPES = 64
+
+    def __init__(self, path: str, puzzle_loader: Callable, max_sessions: int = 10000,
+                 ttl_seconds: float = 3600, cache_size: int = 1024):
+        """
+        Initialize the store.
+
+        Args:
+            path: SQLite database file shared by the workers
+            puzzle_loader: Called as puzzle_loader(puzzle_index, puzzle_id, move_index);
+                returns a ChessPuzzle at that move and its (possibly relocated) index,
+                or (None, None) if the puzzle no longer exists
+            max_sessions: Cap on stored sessions, least recently seen are pruned first
+            ttl_seconds: Idle time after which a session expires
+            cache_size: Rebuilt states kept in this worker's read cache
+        """
+        self.path = path
+        self.puzzle_loader = puzzle_loader
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Serializes requests of one session within this worker
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._last_prune = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(self.SCHEMA)
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(game_sessions)")}
+        for column, statement in self.MIGRATIONS.items():
+            if column not in columns:
+                try:
+                    connection.execute(statement)
+                except sqlite3.OperationalError:
+                    # Another worker added it first
+                    pass
+        connection.execute(self.INDEX)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode: every statement is its own short transaction
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute(self.COUNT).fetchone()[0]
+
+    def _cached(self, session_id: str, version: int) -> Optional[GameState]:
+        """Get a rebuilt state from the read cache if it is still current."""
+        with self._cache_lock:
+            entry = self._cache.get(session_id)
+            if entry is None or entry[0] != version:
+                self.cache_misses += 1
+                return None
+            self.cache_hits += 1
+            self._cache.move_to_end(session_id)
+            return entry[1]
+
+    def _remember(self, session_id: str, version: int, state: GameState):
+        """Put a rebuilt state in the read cache."""
+        with self._cache_lock:
+            self._cache[session_id] = (version, state)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, session_id: str):
+        with self._cache_lock:
+            self._cache.pop(session_id, None)
+
+    @tracing.traced('session.load')
+    def _load(self, session_id: str, now: float):
+        """
+        Load a session's state, its row version (0 if it has no row yet), and
+        whether it is live (an expired row gives a new state but keeps its version).
+        """
+        row = self._connection().execute(self.SELECT, (session_id,)).fetchone()
+        if row is None:
+            return GameState(), 0, False
+        if now - row[11] > self.ttl_seconds:
+            return GameState(), row[12], False
+
+        (puzzle_index, puzzle_id, move_index, player_color, wins, solved, sample_seed,
+         sample_counter, rating, rated_games, puzzle_rated, last_seen, version) = row
+        state = self._cached(session_id, version)
+        if state is None:
+            state = GameState()
+            state.player_color = player_color
+            state.consecutive_wins = wins
+            state.total_puzzles_solved = solved
+            state.sample_seed = sample_seed
+            state.sample_counter = sample_counter
+            state.rating = rating
+            state.rated_games = rated_games
+            state.puzzle_rated = bool(puzzle_rated)
+            if puzzle_index is not None:
+                puzzle, puzzle_index = self.puzzle_loader(puzzle_index, puzzle_id, move_index)
+                if puzzle is not None:
+                    state.current_puzzle = puzzle
+                    state.current_puzzle_index = puzzle_index
+                    state.current_puzzle_id = puzzle_id
+            self._remember(session_id, version, state)
+
+        if now - last_seen > self.TOUCH_INTERVAL:
+            self._connection().execute(self.TOUCH, (now, session_id))
+        return state, version, True
+
+    @tracing.traced('session.save')
+    def _save(self, session_id: str, state: GameState, now: float, version: int):
+        """
+        Write a session's progress over the row version it was loaded from,
+        and cache the state under its new version.
+
+        Raises:
+            SessionConflict: If the row changed since it was loaded
+        """
+        new_version = (int.from_bytes(os.urandom(8), 'big') >> 1) or 1
+        connection = self._connection()
+        if version:
+            saved = connection.execute(self.UPDATE, (*state.progress(), now, new_version,
+                                                     session_id, version)).rowcount == 1
+        else:
+            try:
+                connection.execute(self.INSERT, (session_id, *state.progress(), now, new_version))
+                saved = True
+            except sqlite3.IntegrityError:
+                # Another worker created the session first
+                saved = False
+        if not saved:
+            raise SessionConflict("Game state was changed by another request, please try again")
+        self._remember(session_id, new_version, state)
+
+    def _prune(self, now: float):
+        """Delete expired sessions and the least recently seen ones beyond the cap."""
+        if now - self._last_prune < self.PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        connection = self._connection()
+        connection.execute(self.EXPIRE, (now - self.ttl_seconds,))
+        connection.execute(self.TRIM, (self.max_sessions,))
+
+    def peek(self, session_id: str) -> Optional[GameState]:
+        """Get the state for a session without creating it."""
+        state, _, live = self._load(session_id, time.time())
+        return state if live else None
+
+    def discard(self, session_id: str):
+        """Forget a session."""
+        self._connection().execute(self.DELETE, (session_id,))
+        self._forget(session_id)
+
+    @contextmanager
+    def checkout(self, session_id: str):
+        """
+        Hold a session's state for the duration of a request and save it if it changed.
+
+        The stripe lock serializes a session's requests within this worker;
+        across workers the conditional write detects a concurrent save.
+
+        Raises:
+            SessionConflict: If another worker saved the session meanwhile (its progress is kept)
+        """
+        with self._locks[hash(session_id) % self.LOCK_STRIPES]:
+            now = time.time()
+            state, version, _ = self._load(session_id, now)
+            before = state.progress()
+            try:
+                yield state
+            finally:
+                if state.progress() != before:
+                    try:
+                        self._save(session_id, state, now, version)
+                    except (sqlite3.Error, SessionConflict):
+                        # The cached state no longer matches the stored row
+                        self._forget(session_id)
+                        raise
+        self._prune(now)
+
+
+def create_game_state_store(backend: str, puzzle_loader: Callable, path: str = 'sessions.db',
+                            max_sessions: int = 10000, ttl_seconds: float = 3600):
+    """Create the game state store for a backend name ('memory' or 'sqlite')."""
+    if backend == 'sqlite':
+        return SQLiteGameStateStore(path, puzzle_loader, max_sessions=max_sessions,
+                                    ttl_seconds=ttl_seconds)
+    if backend != 'memory':
+        print(f"Warning: Unknown session backend '{backend}', using memory")
+    return GameStateStore(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
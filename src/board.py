@@ -3,14 +3,51 @@ Chess Board Module
 Handles chess board representation and basic operations.
 """
 
+from functools import lru_cache
+
 import chess
 
+# Parsed starting positions kept for hot puzzles, shared by every session
+POSITION_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=POSITION_CACHE_SIZE)
+def parse_position(fen):
+    """
+    Parse a FEN string once and share the result.
+    
+    The returned board is shared between callers and must never be
+    modified; copy it before playing moves on it.
+    """
+    return chess.Board(fen) if fen else chess.Board()
+
+
 class ChessBoard:
-    """Represents a chess board and handles board operations."""
+    """
+    Represents a chess board and handles board operations.
+    
+    The parsed starting position is kept as an immutable snapshot, so
+    resetting pops the move stack instead of parsing the FEN again.
+    """
     
     def __init__(self, fen=None):
         """Initialize a chess board with optional FEN string."""
-        self.board = chess.Board(fen) if fen else chess.Board()
+        self.start = parse_position(fen)
+        self.board = self.start.copy(stack=False)
+    
+    def reset(self):
+        """Return to the starting position."""
+        # Popping a few moves is cheaper than copying the board
+        if len(self.board.move_stack) <= 8:
+            while self.board.move_stack:
+                self.board.pop()
+        else:
+            self.board = self.start.copy(stack=False)
+    
+    def replay(self, moves_uci):
+        """Play moves already known to be legal, skipping legality checks."""
+        for move_uci in moves_uci:
+            self.board.push(chess.Move.from_uci(move_uci))
     
     def get_board_state(self):
         """Return the current board state as a string."""
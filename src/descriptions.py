@@ -0,0 +1,106 @@
+"""
+Puzzle Description Module
+Builds the human-readable description shown for each puzzle.
+"""
+
+
+def generate_puzzle_description(original_description, player_color, puzzle_data):
+    """Generate a better puzzle description based on player color and puzzle data."""
+    # Convert player color to proper case
+    color_name = player_color.capitalize()
+    
+    # Check if the original description has specific tactical themes
+    original_lower = original_description.lower()
+    
+    # Define common tactical themes and their descriptions
+    tactical_themes = {
+        'fork': f"{color_name} to move and fork",
+        'pin': f"{color_name} to move and pin",
+        'skewer': f"{color_name} to move and skewer",
+        'discovered attack': f"{color_name} to move with discovered attack",
+        'double attack': f"{color_name} to move with double attack",
+        'back rank': f"{color_name} to move and checkmate on back rank",
+        'checkmate': f"{color_name} to move and checkmate",
+        'mate': f"{color_name} to move and checkmate",
+        'win material': f"{color_name} to move and win material",
+        'capture': f"{color_name} to move and capture",
+        'check': f"{color_name} to move and check",
+        'promote': f"{color_name} to move and promote",
+        'defend': f"{color_name} to move and defend",
+        'block': f"{color_name} to move and block",
+        'escape': f"{color_name} to move and escape",
+        'sacrifice': f"{color_name} to move and sacrifice",
+        'zugzwang': f"{color_name} to move and create zugzwang",
+        'gain advantage': f"{color_name} to gain advantage",
+        'advantage': f"{color_name} to gain advantage",
+        'tactical advantage': f"{color_name} to gain tactical advantage",
+        'positional advantage': f"{color_name} to gain positional advantage"
+    }
+    
+    # Check for specific themes in the original description
+    for theme, description in tactical_themes.items():
+        if theme in original_lower:
+            return description
+    
+    # Check for themes in puzzle data if available
+    if 'themes' in puzzle_data and puzzle_data['themes']:
+        themes = puzzle_data['themes']
+        if isinstance(themes, list):
+            themes = ' '.join(themes).lower()
+        else:
+            themes = str(themes).lower()
+        
+        # Check themes for specific tactical patterns
+        for theme, description in tactical_themes.items():
+            if theme in themes:
+                return description
+    
+    # If no specific theme found, use a generic description
+    return f"{color_name} to move"
+
+
+def describe_puzzle(puzzle_data):
+    """Build the full description shown for a puzzle, including its rounded rating."""
+    description = generate_puzzle_description(puzzle_data['description'], puzzle_data['player_color'], puzzle_data)
+    
+    # Add puzzle rating to description if available
+    if 'rating' in puzzle_data:
+        rating = puzzle_data['rating']
+        # Round to nearest 50
+        rounded_rating = round(rating / 50) * 50
+        description = f"{description} (Rated {rounded_rating})"
+    
+    return description
+
+
+def split_themes(themes):
+    """Split a puzzle's themes (space-separated string, list or None) into names."""
+    if not themes:
+        return []
+    if isinstance(themes, list):
+        return themes
+    return str(themes).split()
+
+
+def describe_puzzles(puzzles):
+    """
+    Build the full description of every puzzle.
+    
+    Most puzzles share their original description, color and themes, so the
+    theme scan runs once per distinct combination and only the rating
+    suffix is formatted per puzzle.
+    """
+    generated = {}
+    descriptions = []
+    for puzzle in puzzles:
+        themes = puzzle.get('themes')
+        key = (puzzle['description'], puzzle['player_color'],
+               tuple(themes) if isinstance(themes, list) else themes)
+        description = generated.get(key)
+        if description is None:
+            description = generate_puzzle_description(puzzle['description'], puzzle['player_color'], puzzle)
+            generated[key] = description
+        if 'rating' in puzzle:
+            description = f"{description} (Rated {round(puzzle['rating'] / 50) * 50})"
+        descriptions.append(description)
+    return descriptions
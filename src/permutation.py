@@ -0,0 +1,45 @@
+"""
+Permutation Module
+Keyed pseudo-random permutations of integer ranges, used to walk a rating
+window in a per-player shuffled order without storing the order.
+
+A small Feistel network permutes the smallest power of four covering the
+range; values that land outside the range are fed through again (cycle
+walking) until they land inside, which keeps the mapping a bijection on
+[0, size). Only the key and a counter are needed to continue a walk.
+"""
+
+MASK_64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+FEISTEL_ROUNDS = 4
+
+
+def mix64(value):
+    """Scramble a 64-bit integer (the SplitMix64 finalizer)."""
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK_64
+    return value ^ (value >> 31)
+
+
+def permute(value, size, key):
+    """
+    Map value in [0, size) to its image under the permutation selected by key.
+
+    For a fixed key and size, distinct values always map to distinct results.
+    """
+    if not 0 <= value < size:
+        raise ValueError(f"value {value} outside range [0, {size})")
+    if size == 1:
+        return 0
+    half_bits = ((size - 1).bit_length() + 1) // 2
+    mask = (1 << half_bits) - 1
+    round_keys = [mix64((key + (i + 1) * GOLDEN_GAMMA) & MASK_64) for i in range(FEISTEL_ROUNDS)]
+
+    # The domain is at most four times the range, so this loops about twice on average
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_key in round_keys:
+            left, right = right, left ^ (mix64(right ^ round_key) & mask)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
@@ -3,10 +3,54 @@ Chess Puzzle Module
 Handles puzzle creation, validation, and solving.
 """
 
-from .board import ChessBoard
+from functools import lru_cache
+
+import chess
+
+from .board import ChessBoard, parse_position
+
+# Solution lines whose ply tables are kept, shared by every session
+PLY_TABLE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PLY_TABLE_CACHE_SIZE)
+def build_ply_table(initial_fen, solution_moves):
+    """
+    Replay a solution line once and record the FEN after every ply.
+    
+    Args:
+        initial_fen: FEN string of the initial position
+        solution_moves: Tuple of moves in UCI notation
+    
+    Returns:
+        Tuple whose k-th entry is the FEN after the first k + 1 moves. The
+        table stops at the first illegal move, so a broken line is shorter.
+    """
+    board = parse_position(initial_fen).copy(stack=False)
+    fens = []
+    for move_uci in solution_moves:
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            break
+        if not board.is_legal(move):
+            break
+        board.push(move)
+        fens.append(board.fen())
+    return tuple(fens)
+
 
 class ChessPuzzle:
-    """Represents a chess puzzle with solution and validation."""
+    """
+    Represents a chess puzzle with solution and validation.
+    
+    The solution is a fixed line, so the position after every ply is
+    precomputed once (see build_ply_table). Playing the expected move is a
+    string comparison plus a table lookup; the board is only built when a
+    full legality check is needed. It starts from the shared parsed
+    starting position and is then kept in step with the solution line, so
+    resets pop its move stack rather than parsing the FEN again.
+    """
     
     def __init__(self, initial_fen, solution_moves, description=""):
         """
@@ -20,13 +64,57 @@ class ChessPuzzle:
         self.initial_fen = initial_fen
         self.solution_moves = solution_moves
         self.description = description
-        self.board = ChessBoard(initial_fen)
+        self.ply_fens = build_ply_table(initial_fen, tuple(solution_moves))
         self.current_move_index = 0
+        self._board = None
+    
+    @property
+    def board(self):
+        """The board at the current position, built on first use."""
+        if self._board is None:
+            self._board = ChessBoard(self.initial_fen)
+            self._board.replay(self.solution_moves[:self._played()])
+        return self._board
+    
+    def _played(self):
+        """Number of solution moves actually on the board (a broken line stops early)."""
+        return min(self.current_move_index, len(self.ply_fens))
+    
+    def get_fen(self):
+        """Get the FEN of the current position from the ply table."""
+        played = self._played()
+        return self.ply_fens[played - 1] if played else self.initial_fen
     
     def reset(self):
         """Reset the puzzle to the initial position."""
-        self.board = ChessBoard(self.initial_fen)
         self.current_move_index = 0
+        if self._board is not None:
+            self._board.reset()
+    
+    def restore_progress(self, move_index):
+        """Move to move_index in the solution, e.g. when restoring a saved session."""
+        self.current_move_index = move_index
+        self._board = None
+    
+    def is_expected_move(self, move_uci):
+        """Check whether a move is the next one in the solution line."""
+        index = self.current_move_index
+        return index < len(self.ply_fens) and move_uci == self.solution_moves[index]
+    
+    def advance(self):
+        """
+        Play the next move of the solution.
+        
+        Returns:
+            FEN after the move, or None if the solution line is illegal at this ply
+        """
+        index = self.current_move_index
+        self.current_move_index = index + 1
+        if index >= len(self.ply_fens):
+            return None
+        if self._board is not None:
+            self._board.replay(self.solution_moves[index:index + 1])
+        return self.ply_fens[index]
     
     def check_solution(self, player_moves):
         """Check if the provided moves match the solution."""
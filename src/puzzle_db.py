@@ -0,0 +1,399 @@
+"""
+Puzzle Database Module
+Compact, memory-mapped binary format for the puzzle database.
+
+The file is columnar: fixed-width integer arrays for numeric fields, packed
+UTF-8 blobs with offset tables for strings, per-puzzle theme bitmasks,
+per-theme bitsets of puzzle positions, precomputed display descriptions
+and an open-addressing hash table for shared-link IDs. Everything is read straight out of an mmap, so
+worker processes share a single page-cache copy and opening the file costs
+the same no matter how many puzzles it holds.
+
+Layout (little-endian):
+    header    magic (8s), version (I), section count (I)
+    sections  name (16s), offset (Q), length (Q) per section
+    data      each section padded to 8 bytes
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from .descriptions import split_themes
+
+MAGIC = b'CPZLDB\x00\x01'
+FORMAT_VERSION = 3
+
+_HEADER = struct.Struct('<8sII')
+_SECTION = struct.Struct('<16sQQ')
+_ALIGNMENT = 8
+
+# Sentinels for optional fields
+MISSING_POPULARITY = -128
+MISSING_SOURCE_ID = -1
+MISSING_DIFFICULTY = 255
+
+PLAYER_COLORS = ('white', 'black')
+
+# Fixed-width column formats (array / memoryview type codes)
+COLUMN_FORMATS = {
+    'ratings': 'i',
+    'popularity': 'b',
+    'source_ids': 'i',
+    'colors': 'B',
+    'difficulties': 'B',
+    'fen_offsets': 'I',
+    'solution_offsets': 'I',
+    'desc_offsets': 'I',
+    'theme_offsets': 'I',
+    'theme_ids': 'H',
+    'display_offsets': 'I',
+    'id_table': 'I'
+}
+
+
+def is_puzzle_db(path):
+    """Check whether a file is in the binary puzzle format."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _pack_strings(strings):
+    """Pack strings into a UTF-8 blob and an offset table with one extra end entry."""
+    offsets = array(COLUMN_FORMATS['fen_offsets'], [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _to_little_endian(column):
+    """Serialize an array column in little-endian byte order."""
+    if sys.byteorder != 'little':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _build_id_table(puzzle_ids, id_index):
+    """
+    Build an open-addressing hash table from shared-link ID to position.
+
+    IDs are hex digests, so their integer value is already uniformly spread.
+    Slots hold position + 1 (0 marks an empty slot) and collide by linear
+    probing. Only the positions in id_index are inserted, so colliding IDs
+    resolve exactly as they do in memory.
+    """
+    size = 1
+    while size < 2 * max(len(puzzle_ids), 1):
+        size *= 2
+    mask = size - 1
+
+    table = array(COLUMN_FORMATS['id_table'], bytes(4 * size))
+    for puzzle_id, index in id_index.items():
+        slot = int(puzzle_id, 16) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = index + 1
+    return table
+
+
+def write_puzzle_db(store, path):
+    """
+    Write a PuzzleStore to the binary format.
+
+    Args:
+        store: PuzzleStore built from puzzle dicts (already rating-sorted and ID-indexed)
+        path: Output file path
+    """
+    puzzles = store.puzzles
+
+    # Intern repeated strings into small lookup tables
+    themes = store.themes
+    theme_numbers = {theme: i for i, theme in enumerate(themes)}
+    difficulties = sorted({p['difficulty'] for p in puzzles if 'difficulty' in p})
+    difficulty_numbers = {difficulty: i for i, difficulty in enumerate(difficulties)}
+
+    ratings = array(COLUMN_FORMATS['ratings'], (p.get('rating', 0) for p in puzzles))
+    popularity = array(COLUMN_FORMATS['popularity'],
+                       (p.get('popularity', MISSING_POPULARITY) for p in puzzles))
+    source_ids = array(COLUMN_FORMATS['source_ids'], (p.get('id', MISSING_SOURCE_ID) for p in puzzles))
+    colors = array(COLUMN_FORMATS['colors'], (PLAYER_COLORS.index(p['player_color']) for p in puzzles))
+    difficulty_column = array(COLUMN_FORMATS['difficulties'],
+                              (difficulty_numbers.get(p.get('difficulty'), MISSING_DIFFICULTY) for p in puzzles))
+
+    theme_offsets = array(COLUMN_FORMATS['theme_offsets'], [0])
+    theme_ids = array(COLUMN_FORMATS['theme_ids'])
+    for p in puzzles:
+        theme_ids.extend(theme_numbers[theme] for theme in split_themes(p.get('themes')))
+        theme_offsets.append(len(theme_ids))
+
+    fen_offsets, fen_blob = _pack_strings(p['fen'] for p in puzzles)
+    solution_offsets, solution_blob = _pack_strings(' '.join(p['solution']) for p in puzzles)
+    description_offsets, description_blob = _pack_strings(p.get('description', '') for p in puzzles)
+    display_offsets, display_blob = _pack_strings(store.descriptions)
+
+    # Theme bitmasks as fixed-width little-endian words
+    mask_words = max(1, (len(themes) + 63) // 64)
+    theme_masks = b''.join(mask.to_bytes(8 * mask_words, 'little') for mask in store.theme_masks)
+
+    # Inverted theme index: one fixed-size bitset of puzzle positions per theme
+    bitset_size = (len(puzzles) + 7) // 8
+    theme_bitsets = b''.join(store.theme_positions(theme).to_bytes(bitset_size, 'little') for theme in themes)
+
+    meta = {
+        'count': len(puzzles),
+        'rated_start': store._rated_start,
+        'themes': themes,
+        'theme_mask_words': mask_words,
+        'difficulties': difficulties,
+        'id_collisions': store.id_collisions,
+        'source': store.source
+    }
+
+    sections = [
+        ('meta', json.dumps(meta).encode('utf-8')),
+        ('ids', ''.join(store.puzzle_ids).encode('ascii')),
+        ('id_table', _to_little_endian(_build_id_table(store.puzzle_ids, store._id_index))),
+        ('ratings', _to_little_endian(ratings)),
+        ('popularity', _to_little_endian(popularity)),
+        ('source_ids', _to_little_endian(source_ids)),
+        ('colors', _to_little_endian(colors)),
+        ('difficulties', _to_little_endian(difficulty_column)),
+        ('fen_offsets', _to_little_endian(fen_offsets)),
+        ('fen_blob', fen_blob),
+        ('solution_offsets', _to_little_endian(solution_offsets)),
+        ('solution_blob', solution_blob),
+        ('desc_offsets', _to_little_endian(description_offsets)),
+        ('desc_blob', description_blob),
+        ('theme_offsets', _to_little_endian(theme_offsets)),
+        ('theme_ids', _to_little_endian(theme_ids)),
+        ('theme_masks', theme_masks),
+        ('theme_bitsets', theme_bitsets),
+        ('display_offsets', _to_little_endian(display_offsets)),
+        ('display_blob', display_blob)
+    ]
+
+    # Lay out the sections after the header and section table
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    table = []
+    for name, data in sections:
+        offset += -offset % _ALIGNMENT
+        table.append((name, offset, len(data)))
+        offset += len(data)
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+        for name, section_offset, length in table:
+            f.write(_SECTION.pack(name.encode('ascii'), section_offset, length))
+        for (name, section_offset, length), (_, data) in zip(table, sections):
+            f.write(b'\x00' * (section_offset - f.tell()))
+            f.write(data)
+
+
+class StringColumn:
+    """Read-only sequence of strings stored as a blob plus an offset table."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self._blob[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+
+class IdColumn:
+    """Read-only sequence of fixed-width 8-character shared-link IDs."""
+
+    WIDTH = 8
+
+    def __init__(self, blob):
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._blob) // self.WIDTH
+
+    def __getitem__(self, index):
+        start = index * self.WIDTH
+        return str(self._blob[start:start + self.WIDTH], 'ascii')
+
+
+class ThemeMaskColumn:
+    """Read-only sequence of theme bitmasks stored as fixed-width little-endian words."""
+
+    def __init__(self, blob, words):
+        self._blob = blob
+        self._width = 8 * words
+
+    def __len__(self):
+        return len(self._blob) // self._width
+
+    def __getitem__(self, index):
+        start = index * self._width
+        return int.from_bytes(self._blob[start:start + self._width], 'little')
+
+
+class ThemeBitsets:
+    """
+    Dict-like view of the per-theme bitsets of puzzle positions.
+
+    Each bitset is converted to an int on first use and kept, so the cost
+    is paid once per theme per worker.
+    """
+
+    def __init__(self, blob, themes, count):
+        self._blob = blob
+        self._numbers = {theme: i for i, theme in enumerate(themes)}
+        self._size = (count + 7) // 8
+        self._cache = {}
+
+    def get(self, theme, default=0):
+        """Get the bitset of a theme, or default for an unknown theme."""
+        bits = self._cache.get(theme)
+        if bits is None:
+            number = self._numbers.get(theme)
+            if number is None:
+                return default
+            start = number * self._size
+            bits = int.from_bytes(self._blob[start:start + self._size], 'little')
+            self._cache[theme] = bits
+        return bits
+
+
+class IdTable:
+    """Dict-like view of the on-disk shared-link ID hash table."""
+
+    def __init__(self, slots, ids):
+        self._slots = slots
+        self._mask = len(slots) - 1
+        self._ids = ids
+
+    def get(self, puzzle_id, default=None):
+        """Get the position of a puzzle ID, or default if it is not present."""
+        if not isinstance(puzzle_id, str) or len(puzzle_id) != IdColumn.WIDTH:
+            return default
+        try:
+            slot = int(puzzle_id, 16) & self._mask
+        except ValueError:
+            return default
+
+        while True:
+            entry = self._slots[slot]
+            if not entry:
+                return default
+            if self._ids[entry - 1] == puzzle_id:
+                return entry - 1
+            slot = (slot + 1) & self._mask
+
+
+class PuzzleRecords:
+    """Read-only sequence of puzzle dicts decoded on access from the columns."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __len__(self):
+        return self._db.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._db.get_puzzle(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('puzzle index out of range')
+        return self._db.get_puzzle(index)
+
+
+class PuzzleDB:
+    """A memory-mapped binary puzzle database."""
+
+    def __init__(self, path):
+        """Open and map a binary puzzle database."""
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, version, section_count = _HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a puzzle database")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported puzzle database version {version} in {path} "
+                             f"(re-run convert_puzzles.py)")
+
+        self._sections = {}
+        for i in range(section_count):
+            name, offset, length = _SECTION.unpack_from(self._view, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b'\x00').decode('ascii')] = (offset, length)
+
+        meta = json.loads(bytes(self._section('meta')))
+        self.count = meta['count']
+        self.rated_start = meta['rated_start']
+        self.themes = meta['themes']
+        self.difficulties = meta['difficulties']
+        self.id_collisions = [tuple(collision) for collision in meta['id_collisions']]
+        self.source = meta['source']
+
+        self.ratings = self._column('ratings')
+        self.popularity = self._column('popularity')
+        self.source_ids = self._column('source_ids')
+        self.colors = self._column('colors')
+        self.difficulty_column = self._column('difficulties')
+        self.theme_offsets = self._column('theme_offsets')
+        self.theme_ids = self._column('theme_ids')
+        self.fens = StringColumn(self._column('fen_offsets'), self._section('fen_blob'))
+        self.solutions = StringColumn(self._column('solution_offsets'), self._section('solution_blob'))
+        self.descriptions = StringColumn(self._column('desc_offsets'), self._section('desc_blob'))
+        self.theme_masks = ThemeMaskColumn(self._section('theme_masks'), meta['theme_mask_words'])
+        self.theme_bitsets = ThemeBitsets(self._section('theme_bitsets'), self.themes, self.count)
+        self.display_descriptions = StringColumn(self._column('display_offsets'), self._section('display_blob'))
+        self.ids = IdColumn(self._section('ids'))
+        self.id_index = IdTable(self._column('id_table'), self.ids)
+        self.records = PuzzleRecords(self)
+
+    def _section(self, name):
+        """Get the raw bytes of a section as a zero-copy view."""
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length]
+
+    def _column(self, name):
+        """Get a fixed-width integer column, zero-copy on little-endian hosts."""
+        fmt = COLUMN_FORMATS[name]
+        data = self._section(name)
+        if sys.byteorder == 'little':
+            return data.cast(fmt)
+        column = array(fmt)
+        column.frombytes(data)
+        column.byteswap()
+        return column
+
+    def get_themes(self, index):
+        """Get the theme names of the puzzle at a position."""
+        start, stop = self.theme_offsets[index], self.theme_offsets[index + 1]
+        return [self.themes[self.theme_ids[i]] for i in range(start, stop)]
+
+    def get_puzzle(self, index):
+        """Decode the puzzle at a position into the same dict shape as the JSON database."""
+        puzzle = {
+            'fen': self.fens[index],
+            'solution': self.solutions[index].split(),
+            'description': self.descriptions[index],
+            'player_color': PLAYER_COLORS[self.colors[index]],
+            'themes': ' '.join(self.get_themes(index))
+        }
+        if index >= self.rated_start:
+            puzzle['rating'] = self.ratings[index]
+        if self.source_ids[index] != MISSING_SOURCE_ID:
+            puzzle['id'] = self.source_ids[index]
+        if self.popularity[index] != MISSING_POPULARITY:
+            puzzle['popularity'] = self.popularity[index]
+        if self.difficulty_column[index] != MISSING_DIFFICULTY:
+            puzzle['difficulty'] = self.difficulties[self.difficulty_column[index]]
+        return puzzle
@@ -0,0 +1,461 @@
+"""
+Puzzle Store Module
+Loads the puzzle database once and shares it between requests.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import random
+import threading
+
+from .descriptions import describe_puzzles, split_themes
+from .permutation import mix64, permute
+from .puzzle_db import PuzzleDB, is_puzzle_db
+from .puzzle_validation import validate_store
+
+# Rating windows (inclusive) used by each difficulty mode
+DIFFICULTY_RATING_RANGES = {
+    'easy': (400, 1500),
+    'hard': (1500, 2000),
+    'hikaru': (1800, 3050)
+}
+
+# Adaptive mode: puzzles are drawn from a window around the player's rating,
+# widened until it holds enough puzzles
+ADAPTIVE_HALF_WIDTH = 100
+ADAPTIVE_MAX_HALF_WIDTH = 3200
+ADAPTIVE_MIN_PUZZLES = 20
+
+# Database used when the configured one cannot be loaded
+SECONDARY_DATABASE = 'puzzles.json'
+
+# Built-in puzzles used when no database file can be loaded at all
+FALLBACK_PUZZLES = [
+    {
+        'fen': "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 0 1",
+        'solution': ["d2d4", "e5d4", "c4f7"],
+        # Not "win material": the description scan would match "mate" in it
+        'description': "Find the best move",
+        'player_color': "white",
+        'themes': "advantage"
+    },
+    {
+        'fen': "rnbqkb1r/pppp1ppp/5n2/4p3/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+        'solution': ["f6e4", "d2d4", "e4c3"],
+        'description': "Black to move and fork",
+        'player_color': "black"
+    }
+]
+
+
+def compute_puzzle_id(puzzle):
+    """Compute the short content-hash ID used in shared puzzle links."""
+    puzzle_content = f"{puzzle['fen']}{puzzle['solution']}{puzzle.get('rating', 0)}"
+    return hashlib.md5(puzzle_content.encode()).hexdigest()[:8]
+
+
+class PuzzleStore:
+    """
+    Read-only, in-memory puzzle database shared by all requests.
+
+    Puzzles are kept sorted by rating (unrated puzzles first), so every
+    rating window is a contiguous range of positions found by bisection.
+    The store is either built from puzzle dicts or backed by a memory-mapped
+    binary database (see puzzle_db), which exposes the same columns.
+
+    Themes are tokenized once into a bitmask per puzzle (bit i set for
+    themes[i]) and every display description is built up front, so serving
+    a puzzle does no string work. An inverted index maps each theme to a
+    bitset of puzzle positions (bit p set for position p), so theme filters
+    are answered by intersecting integers rather than scanning puzzles.
+
+    Puzzles whose solution line fails validation (see puzzle_validation)
+    can be quarantined: they are never sampled or found by ID.
+    """
+
+    # Random draws tried before sampling from the exact set of valid candidates
+    SAMPLE_ATTEMPTS = 8
+
+    def __init__(self, puzzles, source=None):
+        """
+        Initialize the store.
+
+        Args:
+            puzzles: List of puzzle dicts (fen, solution, description, player_color, ...)
+            source: Where the puzzles were loaded from (for logging)
+        """
+        self.source = source
+        self.db = None
+
+        # Stable sort, so puzzles with equal ratings keep their file order
+        order = sorted(range(len(puzzles)), key=lambda i: _rating_sort_key(puzzles[i]))
+        self.puzzles = [puzzles[i] for i in order]
+        self.puzzle_ids = [compute_puzzle_id(puzzle) for puzzle in self.puzzles]
+
+        self._rated_start = sum(1 for puzzle in puzzles if 'rating' not in puzzle)
+        self.ratings = [puzzle['rating'] for puzzle in self.puzzles[self._rated_start:]]
+
+        self.id_collisions = []
+        self._id_index = self._build_id_index(order)
+
+        self.themes = sorted({theme for puzzle in self.puzzles for theme in split_themes(puzzle.get('themes'))})
+        self.theme_bits = {theme: 1 << i for i, theme in enumerate(self.themes)}
+        self.theme_masks = [self._theme_mask(puzzle.get('themes')) for puzzle in self.puzzles]
+        self.descriptions = describe_puzzles(self.puzzles)
+        self._theme_index = self._build_theme_index()
+        self.quarantine(())
+
+    @classmethod
+    def from_puzzle_db(cls, db):
+        """Create a store backed by a memory-mapped binary puzzle database."""
+        store = cls.__new__(cls)
+        store.source = db.path
+        store.db = db
+        store.puzzles = db.records
+        store.puzzle_ids = db.ids
+        store._rated_start = db.rated_start
+        store.ratings = db.ratings[db.rated_start:]
+        store.id_collisions = db.id_collisions
+        store._id_index = db.id_index
+        store.themes = db.themes
+        store.theme_bits = {theme: 1 << i for i, theme in enumerate(db.themes)}
+        store.theme_masks = db.theme_masks
+        store.descriptions = db.display_descriptions
+        store._theme_index = db.theme_bitsets
+        store.quarantine(())
+        return store
+
+    @classmethod
+    def from_file(cls, path):
+        """Load a store from a binary or JSON puzzle database."""
+        if is_puzzle_db(path):
+            return cls.from_puzzle_db(PuzzleDB(path))
+
+        with open(path, 'r') as f:
+            puzzle_data = json.load(f)
+        puzzles = puzzle_data['puzzles']
+        if not puzzles:
+            raise ValueError(f"No puzzles found in {path}")
+        return cls(puzzles, source=path)
+
+    @classmethod
+    def fallback(cls):
+        """Create a store from the built-in fallback puzzles."""
+        return cls(list(FALLBACK_PUZZLES), source='built-in')
+
+    def _build_id_index(self, order):
+        """
+        Map every shared-link ID to the position of its puzzle.
+
+        IDs are only 8 hex characters, so two puzzles can collide. Links
+        already in the wild resolve to the first match in file order, so
+        that puzzle keeps the ID and the rest are recorded in id_collisions.
+        """
+        id_index = {}
+        for index in sorted(range(len(order)), key=order.__getitem__):
+            puzzle_id = self.puzzle_ids[index]
+            first_index = id_index.setdefault(puzzle_id, index)
+            if first_index != index:
+                self.id_collisions.append((puzzle_id, first_index, index))
+
+        if self.id_collisions:
+            print(f"Warning: {len(self.id_collisions)} puzzle ID collisions in {self.source}")
+        return id_index
+
+    def _theme_mask(self, themes):
+        """Get the bitmask of a puzzle's themes."""
+        mask = 0
+        for theme in split_themes(themes):
+            mask |= self.theme_bits[theme]
+        return mask
+
+    def _build_theme_index(self):
+        """Build the theme -> bitset of positions index from the per-puzzle masks."""
+        size = (len(self.puzzles) + 7) // 8
+        bitmaps = [bytearray(size) for _ in self.themes]
+        for index, mask in enumerate(self.theme_masks):
+            while mask:
+                theme = (mask & -mask).bit_length() - 1
+                bitmaps[theme][index >> 3] |= 1 << (index & 7)
+                mask &= mask - 1
+        return {theme: int.from_bytes(bitmap, 'little') for theme, bitmap in zip(self.themes, bitmaps)}
+
+    def quarantine(self, positions):
+        """Exclude the puzzles at these positions from sampling and ID lookups."""
+        self.quarantined = frozenset(positions)
+        self._quarantine_mask = 0
+        for index in self.quarantined:
+            self._quarantine_mask |= 1 << index
+
+    def __len__(self):
+        return len(self.puzzles)
+
+    def get(self, index):
+        """Get a puzzle by its position in the store."""
+        return self.puzzles[index]
+
+    def get_id(self, index):
+        """Get the shared-link ID of the puzzle at a position."""
+        return self.puzzle_ids[index]
+
+    def get_description(self, index):
+        """Get the precomputed display description of the puzzle at a position."""
+        return self.descriptions[index]
+
+    def get_theme_mask(self, index):
+        """Get the theme bitmask of the puzzle at a position."""
+        return self.theme_masks[index]
+
+    def get_rating(self, index):
+        """Get the rating of the puzzle at a position, or None if it is unrated."""
+        if index < self._rated_start:
+            return None
+        return self.ratings[index - self._rated_start]
+
+    def theme_positions(self, theme):
+        """Get the bitset of positions of puzzles with a theme (0 for an unknown theme)."""
+        return self._theme_index.get(theme, 0)
+
+    def index_of(self, puzzle_id):
+        """Get the position of the puzzle with a shared-link ID, or None."""
+        index = self._id_index.get(puzzle_id)
+        return None if index in self.quarantined else index
+
+    def find_by_id(self, puzzle_id):
+        """Find a puzzle by its shared-link ID, or None if there is no match."""
+        index = self.index_of(puzzle_id)
+        return None if index is None else self.puzzles[index]
+
+    def rating_range(self, min_rating=None, max_rating=None):
+        """
+        Get the (start, stop) positions of puzzles rated within the inclusive window.
+
+        With no bounds at all the range covers every puzzle, including unrated ones.
+        """
+        if min_rating is None and max_rating is None:
+            return 0, len(self.puzzles)
+        start = 0 if min_rating is None else bisect.bisect_left(self.ratings, min_rating)
+        stop = len(self.ratings) if max_rating is None else bisect.bisect_right(self.ratings, max_rating)
+        return self._rated_start + start, self._rated_start + max(start, stop)
+
+    def rating_window(self, center, min_count=ADAPTIVE_MIN_PUZZLES, half_width=ADAPTIVE_HALF_WIDTH):
+        """
+        Get a (min_rating, max_rating) band around a rating that holds at least min_count puzzles.
+
+        Bands are centred on the multiple of half_width nearest the rating and
+        reach half_width either side (half_width doubles until the band is big
+        enough). The rating is never more than half_width / 2 from the centre,
+        and nearby ratings share one band, so a player's walk through it
+        continues without repeats while the rating moves inside it. Finding
+        the band costs a few bisections.
+        """
+        while True:
+            middle = round(center / half_width) * half_width
+            min_rating, max_rating = middle - half_width, middle + half_width - 1
+            start, stop = self.rating_range(min_rating, max_rating)
+            if stop - start >= min_count or half_width >= ADAPTIVE_MAX_HALF_WIDTH:
+                return min_rating, max_rating
+            half_width *= 2
+
+    def filter(self, min_rating=None, max_rating=None):
+        """Get all puzzles whose rating lies in the inclusive window."""
+        start, stop = self.rating_range(min_rating, max_rating)
+        return self.puzzles[start:stop]
+
+    def candidates(self, min_rating=None, max_rating=None, include_themes=(), exclude_themes=()):
+        """
+        Get the bitset of positions in the rating window that have every
+        included theme and none of the excluded ones, minus quarantined puzzles.
+        """
+        start, stop = self.rating_range(min_rating, max_rating)
+        positions = ((1 << stop) - (1 << start)) & ~self._quarantine_mask
+        for theme in include_themes:
+            positions &= self.theme_positions(theme)
+        for theme in exclude_themes:
+            positions &= ~self.theme_positions(theme)
+        return positions
+
+    def sample_index(self, min_rating=None, max_rating=None, include_themes=(), exclude_themes=()):
+        """
+        Pick the position of a random puzzle from the rating window.
+
+        Without theme filters this falls back to the whole store if no puzzle
+        matches the window. With theme filters it returns None instead, since
+        ignoring the filters would serve the wrong kind of puzzle. None is
+        also returned if every candidate is quarantined.
+        """
+        if include_themes or exclude_themes:
+            return self._sample_candidates(min_rating, max_rating, include_themes, exclude_themes)
+
+        start, stop = self.rating_range(min_rating, max_rating)
+        if start == stop:
+            start, stop = 0, len(self.puzzles)
+            min_rating = max_rating = None
+
+        # Quarantined puzzles are rare, so a few rejected draws beat building a mask
+        for _ in range(self.SAMPLE_ATTEMPTS):
+            index = random.randrange(start, stop)
+            if index not in self.quarantined:
+                return index
+        return self._sample_candidates(min_rating, max_rating)
+
+    def _sample_candidates(self, min_rating=None, max_rating=None, include_themes=(), exclude_themes=()):
+        """Pick a uniformly random position from the candidate bitset, or None if it is empty."""
+        positions = self.candidates(min_rating, max_rating, include_themes, exclude_themes)
+        count = positions.bit_count()
+        if not count:
+            return None
+        return nth_set_bit(positions, random.randrange(count))
+
+    def _sequence_range(self, min_rating, max_rating):
+        """Get the range walked by sequence sampling, falling back to the whole store if the window is empty."""
+        start, stop = self.rating_range(min_rating, max_rating)
+        if start == stop:
+            return 0, len(self.puzzles)
+        return start, stop
+
+    def _sequence_index(self, seed, counter, start, stop):
+        """Get the position at a counter in a player's permutation of a range."""
+        size = stop - start
+        # Every pass over the range uses a fresh permutation
+        cycle, offset = divmod(counter, size)
+        return start + permute(offset, size, mix64((seed << 32) + cycle))
+
+    def sample_sequence(self, seed, counter, count=1, min_rating=None, max_rating=None):
+        """
+        Pick the next puzzles of a player's pseudo-random walk through a rating window.
+
+        The window is visited in the order of a permutation keyed by seed, so
+        no puzzle repeats until every puzzle in the window has been served,
+        and the player only needs to keep the seed and a counter.
+
+        Returns:
+            (positions, next counter); at most one full pass of the window is returned
+        """
+        start, stop = self._sequence_range(min_rating, max_rating)
+        count = min(count, stop - start)
+        positions = []
+        seen = set()
+        attempts = count + self.SAMPLE_ATTEMPTS
+        while len(positions) < count and attempts:
+            index = self._sequence_index(seed, counter, start, stop)
+            counter += 1
+            attempts -= 1
+            # A pass boundary can bring back a puzzle already in this batch
+            if index not in self.quarantined and index not in seen:
+                positions.append(index)
+                seen.add(index)
+
+        if len(positions) < count:
+            # Mostly quarantined window: top up at random
+            extra = [index for index in self.sample_indexes(count, min_rating, max_rating) if index not in seen]
+            positions.extend(extra[:count - len(positions)])
+        return positions, counter
+
+    def sample_indexes(self, count, min_rating=None, max_rating=None, include_themes=(), exclude_themes=()):
+        """
+        Pick up to count distinct random positions, with the same window and
+        filter rules as sample_index. Fewer are returned only if fewer puzzles match.
+        """
+        if not (include_themes or exclude_themes):
+            start, stop = self.rating_range(min_rating, max_rating)
+            if start == stop:
+                start, stop = 0, len(self.puzzles)
+                min_rating = max_rating = None
+            if not self.quarantined:
+                return random.sample(range(start, stop), min(count, stop - start))
+
+        positions = self.candidates(min_rating, max_rating, include_themes, exclude_themes)
+        total = positions.bit_count()
+        return nth_set_bits(positions, random.sample(range(total), min(count, total)))
+
+    def sample(self, min_rating=None, max_rating=None, include_themes=(), exclude_themes=()):
+        """Pick a random puzzle from the rating window, or None if the theme filters match nothing."""
+        index = self.sample_index(min_rating, max_rating, include_themes, exclude_themes)
+        return None if index is None else self.puzzles[index]
+
+
+def nth_set_bit(bits, n):
+    """Get the position of the n-th (0-based) set bit of a non-negative int."""
+    return nth_set_bits(bits, [n])[0]
+
+
+def nth_set_bits(bits, ns):
+    """
+    Get the positions of the n-th (0-based) set bits of a non-negative int, for each n in ns.
+
+    The int is converted to bytes once, and the ranks are found in ascending
+    order in one pass that skips over 4 KB blocks, then 8-byte words, by
+    popcount, so the Python-level loop stays short even for bitsets over
+    millions of puzzles. Positions are returned in the order of ns.
+    """
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    positions = [None] * len(ns)
+    offset = 0
+    passed = 0  # Set bits before offset
+    for i in sorted(range(len(ns)), key=ns.__getitem__):
+        n = ns[i]
+        for block in (4096, 8):
+            while True:
+                count = int.from_bytes(data[offset:offset + block], 'little').bit_count()
+                if n - passed < count:
+                    break
+                passed += count
+                offset += block
+
+        word = int.from_bytes(data[offset:offset + 8], 'little')
+        for _ in range(n - passed):
+            word &= word - 1  # Clear the lowest set bit
+        positions[i] = offset * 8 + (word & -word).bit_length() - 1
+    return positions
+
+
+def _rating_sort_key(puzzle):
+    """Sort unrated puzzles first, then by ascending rating."""
+    return ('rating' in puzzle, puzzle.get('rating', 0))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def load_puzzle_store(path):
+    """
+    Load the best available store: the given database, then puzzles.json, then built-ins.
+
+    Every puzzle's solution line is validated and invalid puzzles are quarantined.
+    """
+    candidates = [path]
+    if os.path.basename(path) != SECONDARY_DATABASE:
+        candidates.append(os.path.join(os.path.dirname(path), SECONDARY_DATABASE))
+
+    for candidate in candidates:
+        try:
+            store = PuzzleStore.from_file(candidate)
+            print(f"Loaded {len(store)} puzzles from {candidate}")
+            validate_store(store, candidate)
+            return store
+        except Exception as e:
+            print(f"Warning: Could not load puzzle database {candidate}: {e}")
+
+    print("Using built-in fallback puzzles")
+    store = PuzzleStore.fallback()
+    validate_store(store)
+    return store
+
+
+def is_puzzle_store_loaded():
+    """Check whether the shared puzzle store has been loaded."""
+    return _store is not None
+
+
+def get_puzzle_store(path='puzzles_combined.json'):
+    """Get the shared puzzle store, loading it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = load_puzzle_store(path)
+    return _store
@@ -0,0 +1,181 @@
+"""
+Puzzle Validation Module
+Replays every puzzle's solution line with python-chess and quarantines
+puzzles that cannot be played to the end.
+
+Validation is spread over a process pool and its result is cached under
+the database file's size and modification time, so only the first start
+after the database changes pays for it.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from .puzzle_db import FORMAT_VERSION
+
+# Bump when the checks change, so cached results are recomputed
+VALIDATOR_VERSION = 1
+
+# Directory (next to the database) holding cached results and reports
+CACHE_DIRECTORY = '.puzzle_cache'
+
+# Stores smaller than this are validated in-process; a pool would cost more than it saves
+MIN_PARALLEL_PUZZLES = 2000
+BATCHES_PER_WORKER = 4
+
+
+def validate_solution(fen, solution, player_color):
+    """
+    Check that a puzzle can be played from its FEN to the end of its solution.
+
+    Returns:
+        None if the puzzle is valid, otherwise a short description of the problem
+    """
+    try:
+        board = chess.Board(fen)
+    except ValueError:
+        return "invalid FEN"
+    if not board.is_valid():
+        return "illegal position"
+    if not solution:
+        return "empty solution"
+    if board.turn != (player_color == 'white'):
+        return f"{player_color} is not to move"
+
+    for ply, move_uci in enumerate(solution):
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            return f"malformed move {move_uci!r} at ply {ply}"
+        if not board.is_legal(move):
+            return f"illegal move {move_uci} at ply {ply}"
+        board.push(move)
+    return None
+
+
+def _validate_batch(batch):
+    """Validate (index, fen, solution, player_color) tuples; returns (index, error) pairs."""
+    problems = []
+    for index, fen, solution, player_color in batch:
+        error = validate_solution(fen, solution, player_color)
+        if error:
+            problems.append((index, error))
+    return problems
+
+
+def file_signature(path):
+    """
+    Identify a database file's version without reading it.
+
+    Returns:
+        (size, mtime_ns, FORMAT_VERSION); the database is only ever replaced
+        by writing a new file, which changes its modification time
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, FORMAT_VERSION
+
+
+def find_invalid_puzzles(store, workers=None):
+    """
+    Validate every puzzle in a store.
+
+    Args:
+        store: PuzzleStore to check
+        workers: Worker processes to use (defaults to every core)
+
+    Returns:
+        Sorted list of (position, error) pairs
+    """
+    jobs = [(index, puzzle['fen'], puzzle['solution'], puzzle['player_color'])
+            for index, puzzle in enumerate(store.puzzles)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < MIN_PARALLEL_PUZZLES:
+        return _validate_batch(jobs)
+
+    size = -(-len(jobs) // (workers * BATCHES_PER_WORKER))
+    batches = [jobs[start:start + size] for start in range(0, len(jobs), size)]
+    try:
+        # Spawned workers: this runs on the warm-up thread, and forking a process with
+        # other threads running can copy locks held at that moment into the child
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = executor.map(_validate_batch, batches)
+            return sorted(problem for problems in results for problem in problems)
+    except (OSError, RuntimeError) as e:
+        # Process pools are unavailable in some sandboxes; do the work here instead
+        print(f"Warning: Parallel puzzle validation failed ({e}), validating in-process")
+        return _validate_batch(jobs)
+
+
+def _load_report(report_path, signature):
+    """Load a cached validation report, or None if there is no usable one."""
+    try:
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if report.get('validator_version') != VALIDATOR_VERSION or report.get('signature') != list(signature):
+        return None
+    return report
+
+
+def _save_report(report_path, report):
+    """Write a validation report atomically, so concurrent workers never read a partial file."""
+    try:
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        temp_path = f"{report_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(temp_path, report_path)
+    except OSError as e:
+        print(f"Warning: Could not save puzzle validation report {report_path}: {e}")
+
+
+def validate_store(store, path=None):
+    """
+    Validate a store's puzzles and quarantine the invalid ones.
+
+    When the store was loaded from a file the result is cached (and reported)
+    in CACHE_DIRECTORY next to it, keyed by the file's signature (see
+    file_signature), which costs one stat rather than a read of the file.
+
+    Returns:
+        The validation report (signature, count, quarantined entries)
+    """
+    start = time.perf_counter()
+    signature = report_path = report = None
+    if path is not None:
+        signature = file_signature(path)
+        size, mtime_ns, format_version = signature
+        report_path = os.path.join(os.path.dirname(path), CACHE_DIRECTORY,
+                                   f"validation-{size}-{mtime_ns}-v{format_version}.json")
+        report = _load_report(report_path, signature)
+
+    if report is None:
+        quarantined = [
+            {'index': index, 'id': store.get_id(index), 'error': error}
+            for index, error in find_invalid_puzzles(store)
+        ]
+        report = {
+            'validator_version': VALIDATOR_VERSION,
+            'database': path,
+            'signature': signature,
+            'count': len(store),
+            'quarantined': quarantined
+        }
+        if report_path is not None:
+            _save_report(report_path, report)
+        elapsed = time.perf_counter() - start
+        print(f"Validated {len(store)} puzzles in {elapsed:.2f}s")
+
+    store.quarantine(entry['index'] for entry in report['quarantined'])
+    if report['quarantined']:
+        location = f" (see {report_path})" if report_path else ""
+        print(f"Warning: Quarantined {len(report['quarantined'])} invalid puzzles{location}")
+        for entry in report['quarantined'][:5]:
+            print(f"  {entry['id']}: {entry['error']}")
+    return report
@@ -10,6 +10,11 @@ let hintUsedTotal = false; // Track if hint was used in hard mode (one total)
 let hintCount = 0; // Track hint count for hard mode (max 3)
 let currentStreak = 0; // Track current streak for leaderboard
 
+// Prefetched puzzles for the current mode, shown without waiting for the server
+const PUZZLE_QUEUE_BATCH_SIZE = 10;
+const PUZZLE_QUEUE_LOW_WATER = 3;
+let puzzleQueue = { mode: null, puzzles: [], loading: false };
+
 // Click-to-select variables
 let selectedPiece = null;
 let selectedSquare = null;
@@ -49,6 +54,43 @@ console.error = function(...args) {
     originalError.apply(console, args);
 };
 
+// Signed game-progress token (only used when the server runs in token mode)
+let gameToken = localStorage.getItem('gameToken');
+
+// Send the game token with every request and keep the fresh one from each response.
+// The token is stored before the request's own success handler runs.
+$.ajaxPrefilter(function(options, originalOptions, jqXHR) {
+    if (gameToken) {
+        jqXHR.setRequestHeader('X-Game-Token', gameToken);
+    }
+    jqXHR.always(function() {
+        const token = jqXHR.getResponseHeader('X-Game-Token');
+        if (token) {
+            gameToken = token;
+            localStorage.setItem('gameToken', token);
+        } else if (jqXHR.status === 401) {
+            // Expired or already used - start over with a new game
+            gameToken = null;
+            localStorage.removeItem('gameToken');
+        }
+    });
+});
+
+// Requests that use up the game token run one at a time, so each one is sent with
+// the token returned by the previous one rather than a token that is already spent
+let gameRequestChain = $.Deferred().resolve().promise();
+
+function gameRequest(options) {
+    const previous = gameRequestChain;
+    const done = $.Deferred();
+    gameRequestChain = done.promise();
+    previous.always(function() {
+        $.ajax(options).always(function() {
+            done.resolve();
+        });
+    });
+}
+
 // Initialize the application
 $(document).ready(function() {
     try {
@@ -361,7 +403,15 @@ function loadNewPuzzle() {
         });
     }
     
-    $.ajax({
+    // Show a prefetched puzzle straight away when one is queued for this mode
+    const queuedPuzzle = puzzleQueue.mode === currentMode ? puzzleQueue.puzzles.shift() : null;
+    if (queuedPuzzle) {
+        showNewPuzzle(queuedPuzzle);
+        refillPuzzleQueue();
+        return;
+    }
+    
+    gameRequest({
         url: '/api/new-puzzle',
         method: 'POST',
         contentType: 'application/json',
@@ -370,97 +420,8 @@ function loadNewPuzzle() {
         }),
         success: function(response) {
             if (response.success) {
-                currentPuzzle = {
-                    fen: response.fen,
-                    description: response.description,
-                    movesRequired: response.moves_required,
-                    playerColor: response.player_color || 'white'
-                };
-                
-                // Store puzzle ID and enable share button
-                currentPuzzleId = response.puzzle_id;
-                isSharedPuzzle = false; // This is a new random puzzle
-                $('#share-puzzle-btn').prop('disabled', false);
-                
-                // Reset puzzle failure state
-                puzzleFailed = false;
-                
-                // Update the board position to the scrambled puzzle
-                game = new Chess(response.fen);
-                
-                // Add safety check before setting board position
-                if (board && typeof board.setPosition === 'function') {
-                    try {
-                        board.setPosition(response.fen);
-                    } catch (error) {
-                        console.warn('Error setting board position:', error);
-                        // Retry after a short delay
-                        setTimeout(function() {
-                            if (board && typeof board.setPosition === 'function') {
-                                try {
-                                    board.setPosition(response.fen);
-                                } catch (retryError) {
-                                    console.warn('Retry failed:', retryError);
-                                }
-                            }
-                        }, 100);
-                    }
-                }
-                
-                // Set board orientation based on player color
-                if (response.player_color === 'black') {
-                    if (board && typeof board.config === 'function') {
-                        board.config({ orientation: 'black' });
-                    }
-                    // Flip coordinate labels for black orientation
-                    flipCoordinateLabels();
-                } else {
-                    if (board && typeof board.config === 'function') {
-                        board.config({ orientation: 'white' });
-                    }
-                    // Reset coordinate labels for white orientation
-                    resetCoordinateLabels();
-                }
-                
-                // Enable dragging for the puzzle with proper animation settings
-                if (board && typeof board.config === 'function') {
-                    board.config({ 
-                        draggable: true, // Enable dragging alongside click-to-select functionality
-                        moveSpeed: 200,
-                        snapbackSpeed: 200,
-                        trashSpeed: 0 // Hide piece immediately when dragging starts
-                    });
-                }
-                
-                // Ensure board is properly sized after position change
-                setTimeout(function() {
-                    if (board) {
-                        // Board updated
-                    }
-                }, 100); // Increased delay for better stability
-                
-                // Update UI
-                $('#puzzle-description').text(response.description);
-                $('#moves-required').text(`Moves required: ${response.moves_required}`);
-                
-                // Clear any hint highlighting
-                clearHintHighlight();
-                // Clear feedback messages immediately when loading new puzzle
-                $('#feedback-message').removeClass('show');
-                
-                // Clear any piece selection for new puzzle
-                deselectPiece();
-                
-                // Reset puzzle failed state for new puzzle
-                puzzleFailed = false;
-                
-                // Re-setup custom click handlers for new puzzle
-                setupCustomClickHandlers();
-                
-                // Update hint button state for new puzzle
-                updateHintButtonState();
-                    
-                showFeedback('Puzzle loaded! Good luck! 🎯', 'success');
+                showNewPuzzle(response);
+                refillPuzzleQueue();
             } else {
                 showFeedback('Failed to load puzzle. Try again!', 'error');
             }
@@ -471,6 +432,138 @@ function loadNewPuzzle() {
     });
 }
 
+// Keep a few puzzles for the current mode queued, fetched in one batch request
+function refillPuzzleQueue() {
+    if (puzzleQueue.mode !== currentMode) {
+        puzzleQueue = { mode: currentMode, puzzles: [], loading: false };
+    }
+    if (puzzleQueue.loading || puzzleQueue.puzzles.length >= PUZZLE_QUEUE_LOW_WATER) {
+        return;
+    }
+    
+    const queue = puzzleQueue;
+    queue.loading = true;
+    gameRequest({
+        url: '/api/prefetch-puzzles',
+        method: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({
+            difficulty: queue.mode,
+            count: PUZZLE_QUEUE_BATCH_SIZE
+        }),
+        success: function(response) {
+            if (response.success) {
+                // Skip puzzles already queued or on the board
+                const seen = new Set(queue.puzzles.map(puzzle => puzzle.puzzle_id));
+                seen.add(currentPuzzleId);
+                response.puzzles.forEach(puzzle => {
+                    if (!seen.has(puzzle.puzzle_id)) {
+                        queue.puzzles.push(puzzle);
+                    }
+                });
+            }
+        },
+        complete: function() {
+            queue.loading = false;
+        }
+    });
+}
+
+// Show a new puzzle (from /api/new-puzzle or the prefetch queue) on the board
+function showNewPuzzle(response) {
+    currentPuzzle = {
+        fen: response.fen,
+        description: response.description,
+        movesRequired: response.moves_required,
+        playerColor: response.player_color || 'white'
+    };
+    
+    // Store puzzle ID and enable share button
+    currentPuzzleId = response.puzzle_id;
+    isSharedPuzzle = false; // This is a new random puzzle
+    $('#share-puzzle-btn').prop('disabled', false);
+    
+    // Reset puzzle failure state
+    puzzleFailed = false;
+    
+    // Update the board position to the scrambled puzzle
+    game = new Chess(response.fen);
+    
+    // Add safety check before setting board position
+    if (board && typeof board.setPosition === 'function') {
+        try {
+            board.setPosition(response.fen);
+        } catch (error) {
+            console.warn('Error setting board position:', error);
+            // Retry after a short delay
+            setTimeout(function() {
+                if (board && typeof board.setPosition === 'function') {
+                    try {
+                        board.setPosition(response.fen);
+                    } catch (retryError) {
+                        console.warn('Retry failed:', retryError);
+                    }
+                }
+            }, 100);
+        }
+    }
+    
+    // Set board orientation based on player color
+    if (response.player_color === 'black') {
+        if (board && typeof board.config === 'function') {
+            board.config({ orientation: 'black' });
+        }
+        // Flip coordinate labels for black orientation
+        flipCoordinateLabels();
+    } else {
+        if (board && typeof board.config === 'function') {
+            board.config({ orientation: 'white' });
+        }
+        // Reset coordinate labels for white orientation
+        resetCoordinateLabels();
+    }
+    
+    // Enable dragging for the puzzle with proper animation settings
+    if (board && typeof board.config === 'function') {
+        board.config({ 
+            draggable: true, // Enable dragging alongside click-to-select functionality
+            moveSpeed: 200,
+            snapbackSpeed: 200,
+            trashSpeed: 0 // Hide piece immediately when dragging starts
+        });
+    }
+    
+    // Ensure board is properly sized after position change
+    setTimeout(function() {
+        if (board) {
+            // Board updated
+        }
+    }, 100); // Increased delay for better stability
+    
+    // Update UI
+    $('#puzzle-description').text(response.description);
+    $('#moves-required').text(`Moves required: ${response.moves_required}`);
+    
+    // Clear any hint highlighting
+    clearHintHighlight();
+    // Clear feedback messages immediately when loading new puzzle
+    $('#feedback-message').removeClass('show');
+    
+    // Clear any piece selection for new puzzle
+    deselectPiece();
+    
+    // Reset puzzle failed state for new puzzle
+    puzzleFailed = false;
+    
+    // Re-setup custom click handlers for new puzzle
+    setupCustomClickHandlers();
+    
+    // Update hint button state for new puzzle
+    updateHintButtonState();
+        
+    showFeedback('Puzzle loaded! Good luck! 🎯', 'success');
+}
+
 // Setup custom click handlers for board squares
 function setupCustomClickHandlers() {
     // Click detection is handled through Chessboard2 callbacks:
@@ -992,11 +1085,11 @@ function makeMove(moveUCI) {
         return;
     }
     
-    $.ajax({
+    gameRequest({
         url: '/api/make-move',
         method: 'POST',
         contentType: 'application/json',
-        data: JSON.stringify({ move: moveUCI }),
+        data: JSON.stringify({ move: moveUCI, puzzle_id: currentPuzzleId }),
         success: function(response) {
             if (response.success) {
                 if (response.puzzle_complete) {
@@ -1207,7 +1300,7 @@ function updateStats() {
 }
 
 function resetGame() {
-    $.ajax({
+    gameRequest({
         url: '/api/reset-game',
         method: 'POST',
         success: function(response) {
@@ -1374,9 +1467,11 @@ function getHint() {
         return;
     }
     
-    $.ajax({
+    gameRequest({
         url: '/api/get-hint',
         method: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({ puzzle_id: currentPuzzleId }),
         success: function(response) {
             if (response.success) {
                 // Deselect any currently selected piece before showing hint
@@ -1567,18 +1662,11 @@ function resetCoordinateLabels() {
 
 // Leaderboard Functions
 function loadLeaderboard() {
-    // Add timestamp to prevent caching
-    const timestamp = new Date().getTime();
+    // The server marks the leaderboard no-cache with an ETag, so the browser
+    // always revalidates and an unchanged leaderboard costs an empty 304
     $.ajax({
-        url: `/api/leaderboard?t=${timestamp}`,
+        url: '/api/leaderboard',
         method: 'GET',
-        cache: false, // Prevent browser caching
-        headers: {
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'If-None-Match': '', // Force fresh data
-            'If-Modified-Since': '' // Force fresh data
-        },
         timeout: 10000, // 10 second timeout
         success: function(response) {
             if (response.success) {
@@ -1689,7 +1777,7 @@ function saveHighScore() {
         localStorage.setItem('chess_puzzle_player_name', playerName);
     }
     
-    $.ajax({
+    gameRequest({
         url: '/api/add-score',
         method: 'POST',
         contentType: 'application/json',
@@ -1898,7 +1986,7 @@ function retrySharedPuzzle() {
 function loadSharedPuzzle(puzzleId) {
     showFeedback('Loading shared puzzle...', 'success');
     
-    $.ajax({
+    gameRequest({
         url: `/api/get-puzzle/${puzzleId}`,
         method: 'GET',
         success: function(response) {
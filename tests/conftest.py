@@ -0,0 +1,109 @@
+"""Shared fixtures: a stub of the GitHub contents API served over local HTTP."""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class StubGitHub:
+    """
+    In-memory repository behind the contents API endpoints the app uses.
+
+    Files are keyed by path. ETags are the file SHA, so conditional GETs
+    get a 304 while a file is unchanged. Set conflicts to make that many
+    PUTs lose a race: another writer commits on_conflict's change first and
+    the PUT gets a 409. Set unavailable to answer that many GETs with a 503.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.conflicts = 0
+        self.on_conflict = None
+        self.get_delay = 0.0
+        self.unavailable = 0
+        self._lock = threading.Lock()
+
+    def set_file(self, path, content: bytes):
+        self.files[path] = (content, hashlib.sha1(content).hexdigest())
+
+    def json_file(self, path):
+        return json.loads(self.files[path][0].decode('utf-8'))
+
+    def count(self, method, status=None):
+        return sum(1 for m, _, s in self.requests if m == method and (status is None or s == status))
+
+    def handle_get(self, path, headers):
+        time.sleep(self.get_delay)
+        with self._lock:
+            if self.unavailable:
+                self.unavailable -= 1
+                return 503, {}, {'message': 'Service Unavailable'}
+            if path not in self.files:
+                return 404, {}, {'message': 'Not Found'}
+            content, sha = self.files[path]
+            etag = f'"{sha}"'
+            if headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, None
+            return 200, {'ETag': etag}, {'content': base64.b64encode(content).decode('ascii'), 'sha': sha}
+
+    def handle_put(self, path, payload):
+        with self._lock:
+            if self.conflicts:
+                self.conflicts -= 1
+                if self.on_conflict is not None:
+                    self.on_conflict(self, path)
+                return 409, {}, {'message': 'conflict'}
+            current = self.files.get(path)
+            if (current[1] if current else None) != payload.get('sha'):
+                return 409, {}, {'message': 'sha does not match'}
+            self.set_file(path, base64.b64decode(payload['content']))
+            return (200 if current else 201), {}, {'content': {'sha': self.files[path][1]}}
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def _path(self):
+            # /repos/<owner>/<name>/contents/<path>
+            return self.path.split('/contents/', 1)[1]
+
+        def _reply(self, method, result):
+            status, headers, body = result
+            stub.requests.append((method, self._path(), status))
+            data = b'' if body is None else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply('GET', stub.handle_get(self._path(), self.headers))
+
+        def do_PUT(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self._reply('PUT', stub.handle_put(self._path(), payload))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def github_stub():
+    """A running StubGitHub; its base URL is stub.url."""
+    stub = StubGitHub()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(stub))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stub.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield stub
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,76 @@
+"""GitHub client: conditional reads, single-flight reads and timeouts."""
+
+import threading
+import time
+
+import pytest
+import requests
+
+from github_client import GitHubClient, GitHubConflict, GitHubFile
+
+
+@pytest.fixture
+def client(github_stub):
+    github_stub.set_file('data.json', b'{"a": 1}')
+    client = GitHubClient('test-token', 'owner/repo', api_url=github_stub.url, retries=0)
+    yield client
+    client.close()
+
+
+def test_not_modified_serves_cached_file(client, github_stub):
+    first = client.get_file('data.json')
+    second = client.get_file('data.json')
+
+    assert first == second == GitHubFile(b'{"a": 1}', github_stub.files['data.json'][1])
+    assert github_stub.count('GET', 200) == 1
+    assert github_stub.count('GET', 304) == 1
+
+
+def test_changed_file_is_read_again(client, github_stub):
+    client.get_file('data.json')
+    github_stub.set_file('data.json', b'{"a": 2}')
+
+    assert client.get_file('data.json').content == b'{"a": 2}'
+    assert github_stub.count('GET', 200) == 2
+
+
+def test_missing_file(client, github_stub):
+    assert client.get_file('missing.json') is None
+    assert github_stub.count('GET', 404) == 1
+
+
+def test_concurrent_reads_share_one_request(client, github_stub):
+    github_stub.get_delay = 0.3
+    results = []
+
+    def read():
+        results.append(client.get_file('data.json'))
+
+    threads = [threading.Thread(target=read) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5 and all(result.content == b'{"a": 1}' for result in results)
+    assert github_stub.count('GET') == 1
+
+
+def test_waiting_reader_times_out(client, github_stub):
+    github_stub.get_delay = 1.0
+    leader = threading.Thread(target=client.get_file, args=('data.json',))
+    leader.start()
+    # Let the leader's request start before following it
+    while not client._flights:
+        time.sleep(0.001)
+
+    with pytest.raises(requests.Timeout):
+        client.get_file('data.json', timeout=0.2)
+    leader.join()
+
+
+def test_put_with_stale_sha_conflicts(client, github_stub):
+    with pytest.raises(GitHubConflict):
+        client.put_file('data.json', b'{}', 'update', sha='stale')
+    client.put_file('data.json', b'{}', 'update', sha=github_stub.files['data.json'][1])
+    assert github_stub.files['data.json'][0] == b'{}'
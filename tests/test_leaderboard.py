@@ -0,0 +1,89 @@
+"""Leaderboard saves to GitHub: SHA conflicts are re-read, merged and retried."""
+
+import json
+import time
+
+import pytest
+
+from leaderboard import Leaderboard
+
+
+def other_writer_adds(name, score):
+    """An on_conflict hook: another worker commits a score just before our PUT."""
+    def commit(stub, path):
+        data = stub.json_file(path)
+        data['easy'].append({'name': name, 'score': score, 'date': '2024-01-01T00:00:00', 'timestamp': 1.0})
+        data['version'] = data.get('version', 0) + 1
+        stub.set_file(path, json.dumps(data).encode('utf-8'))
+    return commit
+
+
+@pytest.fixture
+def github_env(github_stub, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GITHUB_TOKEN', 'test-token')
+    monkeypatch.setenv('GITHUB_REPO', 'owner/repo')
+    monkeypatch.setenv('GITHUB_API_URL', github_stub.url)
+
+
+@pytest.fixture
+def leaderboard(github_env, github_stub):
+    github_stub.set_file('leaderboard.json', json.dumps({'easy': [], 'hard': [], 'hikaru': [], 'version': 1}).encode())
+
+    board = Leaderboard('leaderboard.json', flush_interval=3600)
+    deadline = time.monotonic() + 5
+    while not board.remote_loaded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert board.remote_loaded
+    yield board
+    board.close()
+
+
+def test_conflict_is_merged_and_retried(leaderboard, github_stub):
+    github_stub.conflicts = 1
+    github_stub.on_conflict = other_writer_adds('Other', 7)
+
+    leaderboard.add_score('easy', 5, 'Alice')
+    assert leaderboard.flush()
+
+    assert github_stub.count('PUT') == 2
+    assert github_stub.count('PUT', 409) == 1
+    saved = github_stub.json_file('leaderboard.json')
+    assert [entry['name'] for entry in saved['easy']] == ['Other', 'Alice']
+    # The merged board is kept in memory and in the local copy as well
+    assert [entry['name'] for entry in leaderboard.get_top_scores('easy')] == ['Other', 'Alice']
+    with open('leaderboard.json') as f:
+        assert [entry['name'] for entry in json.load(f)['easy']] == ['Other', 'Alice']
+
+
+def test_gives_up_after_repeated_conflicts(leaderboard, github_stub):
+    github_stub.conflicts = Leaderboard.MAX_SAVE_ATTEMPTS + 1
+    github_stub.on_conflict = other_writer_adds('Other', 7)
+
+    leaderboard.add_score('easy', 5, 'Alice')
+    assert leaderboard._save_to_github(leaderboard.stored_data()) is None
+    assert github_stub.count('PUT') == Leaderboard.MAX_SAVE_ATTEMPTS
+    assert 'Alice' not in [entry['name'] for entry in github_stub.json_file('leaderboard.json')['easy']]
+
+
+def test_falls_back_to_local_file_when_github_save_fails(leaderboard, github_stub):
+    github_stub.conflicts = Leaderboard.MAX_SAVE_ATTEMPTS
+
+    leaderboard.add_score('hard', 9, 'Bob')
+    assert leaderboard.flush()
+
+    with open('leaderboard.json') as f:
+        assert [entry['name'] for entry in json.load(f)['hard']] == ['Bob']
+
+
+def test_warm_up_makes_a_single_attempt(github_env, github_stub):
+    github_stub.unavailable = 5
+
+    board = Leaderboard('leaderboard.json', flush_interval=3600)
+    deadline = time.monotonic() + 5
+    while not board.is_ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert board.is_ready() and not board.remote_loaded
+    assert github_stub.count('GET') == 1
+    board.close()
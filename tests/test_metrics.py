@@ -0,0 +1,47 @@
+"""Metrics shared between workers: snapshots of dead workers leave the totals."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import metrics
+
+JOBS = metrics.Counter('test_metrics_jobs_total', 'Jobs done by a worker')
+
+
+@pytest.fixture
+def shared_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, '_directory', str(tmp_path))
+    monkeypatch.setattr(metrics, '_snapshot_path', str(tmp_path / f'metrics-{os.getpid()}-0.json'))
+    return tmp_path
+
+
+def write_worker_snapshot(directory, pid, jobs, age=0.0):
+    path = directory / f'metrics-{pid}-{len(os.listdir(directory))}.json'
+    samples = [['test_metrics_jobs_total', [], jobs]]
+    path.write_text(json.dumps({'pid': pid, 'time': time.time() - age, 'samples': samples}))
+    return path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_snapshots_of_dead_and_silent_workers_are_dropped(shared_directory):
+    JOBS.inc()
+    own = metrics.collect()[('test_metrics_jobs_total', ())]
+    live = write_worker_snapshot(shared_directory, os.getppid(), 10)
+    dead = write_worker_snapshot(shared_directory, exited_pid(), 100)
+    # A live PID whose file stopped being updated: the worker is stuck, or the PID was reused
+    silent = write_worker_snapshot(shared_directory, os.getppid(), 1000, age=metrics.STALE_AFTER + 1)
+
+    assert metrics.aggregate()[('test_metrics_jobs_total', ())] == own + 10
+    assert live.exists()
+    assert not dead.exists() and not silent.exists()
+    assert os.path.exists(metrics._snapshot_path)
@@ -0,0 +1,72 @@
+"""CPU profiles: settings are bounded and profiled requests land in their own window."""
+
+import math
+import os
+import pstats
+import sys
+import time
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture(autouse=True)
+def profile_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, '_directory', str(tmp_path))
+    monkeypatch.setattr(profiling, '_active', None)
+    return tmp_path
+
+
+@pytest.mark.parametrize('interval_ms', [0.5, 1e12, math.inf, math.nan])
+def test_sampler_rejects_out_of_range_interval(interval_ms):
+    with pytest.raises(ValueError):
+        profiling.start('sampler', duration=10, interval_ms=interval_ms)
+    assert profiling.status() is None
+
+
+def test_sampler_interval_must_fit_in_the_window():
+    with pytest.raises(ValueError):
+        profiling.start('sampler', duration=0.5, interval_ms=600)
+
+
+@pytest.mark.parametrize('duration', [0, math.inf, math.nan])
+def test_rejects_out_of_range_duration(duration):
+    with pytest.raises(ValueError):
+        profiling.start('cprofile', duration=duration)
+
+
+def test_request_crossing_the_end_of_a_window():
+    profiling.start('cprofile', duration=60, one_in=1)
+    first = profiling._active
+    session, profiler = profiling.start_request()
+    assert session is first
+
+    # The window ends while the request is still running, and a new profile starts
+    profiling._finish_cprofile(first)
+    assert not os.path.exists(first.path)
+    profiling.start('cprofile', duration=60, one_in=2)
+    second = profiling._active
+    assert second is not first
+
+    profiling.finish_request(session, profiler)
+    assert first.samples == 1 and not first.busy
+    assert second.samples == 0 and second.stats is None and not second.busy
+    # The ended window is written once its last request is done
+    assert first.path != second.path
+    assert pstats.Stats(first.path).total_calls > 0
+
+    profiling._finish_cprofile(second)
+    assert profiling.status() is None
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_sampler_failure_frees_the_worker(monkeypatch):
+    def fail():
+        raise RuntimeError("no frames")
+    monkeypatch.setattr(sys, '_current_frames', fail)
+    profiling.start('sampler', duration=5, interval_ms=10)
+    deadline = time.monotonic() + 5
+    while profiling.status() is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profiling.status() is None
@@ -0,0 +1,59 @@
+"""Puzzle store sampling: adaptive rating bands and bitset ranks."""
+
+import random
+
+import pytest
+
+from src.puzzle_store import ADAPTIVE_HALF_WIDTH, PuzzleStore, nth_set_bit, nth_set_bits
+
+
+def make_puzzle(rating):
+    return {
+        'fen': "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+        'solution': ["d1d8"],
+        'player_color': 'white',
+        'description': "Find the best move",
+        'rating': rating,
+        'themes': 'mateIn1',
+    }
+
+
+@pytest.fixture
+def store():
+    # One puzzle every 5 points, so every band is dense enough to stay at the base width
+    return PuzzleStore([make_puzzle(rating) for rating in range(400, 3000, 5)])
+
+
+@pytest.mark.parametrize('rating', [1500, 1549, 1550, 1551, 1599, 1600, 1601, 1650])
+def test_adaptive_band_is_centred_on_rating(store, rating):
+    min_rating, max_rating = store.rating_window(rating)
+    assert max_rating - min_rating + 1 == 2 * ADAPTIVE_HALF_WIDTH
+    # The rating sits in the middle half of the band, never at its edge
+    assert min_rating + ADAPTIVE_HALF_WIDTH // 2 <= rating <= max_rating - ADAPTIVE_HALF_WIDTH // 2 + 1
+
+
+def test_nearby_ratings_share_a_band(store):
+    assert store.rating_window(1560) == store.rating_window(1640) == (1500, 1699)
+
+
+def test_sparse_band_is_widened():
+    sparse = PuzzleStore([make_puzzle(rating) for rating in range(400, 3000, 50)])
+    min_rating, max_rating = sparse.rating_window(1600)
+    start, stop = sparse.rating_range(min_rating, max_rating)
+    assert stop - start >= 20
+    assert min_rating < 1600 < max_rating
+
+
+def test_nth_set_bits_matches_a_scan():
+    rng = random.Random(7)
+    bits = rng.getrandbits(80000) & rng.getrandbits(80000)
+    positions = [p for p in range(bits.bit_length()) if bits >> p & 1]
+    ranks = rng.sample(range(len(positions)), 50) + [0, len(positions) - 1]
+    assert nth_set_bits(bits, ranks) == [positions[n] for n in ranks]
+    assert nth_set_bit(bits, 3) == positions[3]
+
+
+def test_sample_indexes_with_theme_filter(store):
+    sampled = store.sample_indexes(30, 1000, 1999, include_themes=('mateIn1',))
+    assert len(set(sampled)) == 30
+    assert all(1000 <= store.get_rating(index) <= 1999 for index in sampled)
@@ -0,0 +1,55 @@
+"""Puzzle validation: parallel replay and the per-file result cache."""
+
+import json
+import os
+
+import pytest
+
+from src import puzzle_validation
+from src.puzzle_store import PuzzleStore
+
+
+def make_puzzle(solution, rating=1500):
+    return {
+        'fen': "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+        'solution': solution,
+        'player_color': 'white',
+        'description': "Find the best move",
+        'rating': rating,
+    }
+
+
+PUZZLES = [make_puzzle(["d1d8"], 1000 + i) for i in range(40)] + [make_puzzle(["d1d9"], 2000)]
+
+
+def test_parallel_validation_matches_in_process(monkeypatch):
+    store = PuzzleStore(PUZZLES)
+    expected = puzzle_validation.find_invalid_puzzles(store, workers=1)
+    monkeypatch.setattr(puzzle_validation, 'MIN_PARALLEL_PUZZLES', 1)
+    assert puzzle_validation.find_invalid_puzzles(store, workers=2) == expected
+    assert [index for index, _ in expected] == [len(PUZZLES) - 1]
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / 'puzzles.json'
+    path.write_text(json.dumps(PUZZLES))
+    return str(path)
+
+
+def test_cached_report_is_reused_until_the_file_changes(database, monkeypatch):
+    report = puzzle_validation.validate_store(PuzzleStore(PUZZLES), database)
+    assert len(report['quarantined']) == 1
+
+    def fail(store, workers=None):
+        raise AssertionError("validated again")
+    monkeypatch.setattr(puzzle_validation, 'find_invalid_puzzles', fail)
+    store = PuzzleStore(PUZZLES)
+    assert puzzle_validation.validate_store(store, database)['quarantined'] == report['quarantined']
+    assert store.quarantined == {report['quarantined'][0]['index']}
+
+    # A rewritten database has a new modification time, so it is validated again
+    stat = os.stat(database)
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with pytest.raises(AssertionError):
+        puzzle_validation.validate_store(PuzzleStore(PUZZLES), database)
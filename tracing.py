@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Request tracing for chess puzzle game.
+Every request gets a root span; store access, chess operations, JSON
+encoding and leaderboard file and network I/O open child spans under it.
+The current span is kept in a context variable, so nesting follows the
+call stack without passing anything around.
+
+Traces are tail-sampled: spans are buffered until the root span ends,
+and the trace is written only if it was slow (above the threshold),
+failed, or won the random draw for fast traces. Kept traces are appended
+to a JSONL file, one OTLP/JSON ExportTraceServiceRequest per line, which
+an OpenTelemetry collector can ingest.
+
+When tracing is off, span() returns a shared no-op object, so
+instrumented code costs one global check per span.
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+SERVICE_NAME = 'chess-puzzle'
+# Spans kept per trace; a runaway loop can't grow a trace without bound
+MAX_SPANS_PER_TRACE = 1000
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_enabled = False
+_path = None
+_threshold_ns = 0
+_sample_rate = 0.0
+_write_lock = threading.Lock()
+_current: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+def configure(path: Optional[str], threshold_ms: float = 500, sample_rate: float = 0.0):
+    """
+    Turn tracing on, writing kept traces to path (tracing stays off if path is empty).
+
+    Args:
+        path: JSONL file that kept traces are appended to
+        threshold_ms: Traces at least this slow are always kept
+        sample_rate: Fraction of faster traces kept as well
+    """
+    global _enabled, _path, _threshold_ns, _sample_rate
+    if not path:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    _path = path
+    _threshold_ns = int(threshold_ms * 1e6)
+    _sample_rate = sample_rate
+    _enabled = True
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _Trace:
+    """The spans of one trace, buffered until its root span ends."""
+
+    __slots__ = ('trace_id', 'spans', 'dropped', 'error')
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.dropped = 0
+        self.error = False
+
+
+class Span:
+    """A timed operation within a trace; use as a context manager, or start() and finish()."""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'message', '_started', '_token')
+
+    def __init__(self, trace: _Trace, parent: Optional['Span'], name: str, kind: int, attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.message = None
+        self._token = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status = STATUS_ERROR
+        self.message = message
+        self.trace.error = True
+
+    def start(self) -> 'Span':
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        self._token = _current.set(self)
+        return self
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._started)
+        if error is not None:
+            self.set_error(f"{type(error).__name__}: {error}")
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+        trace = self.trace
+        if len(trace.spans) < MAX_SPANS_PER_TRACE:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+        if self.parent_id is None:
+            _finish_trace(trace, self)
+
+    def __enter__(self) -> 'Span':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+        return False
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or there is no trace to join."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, root: bool = False, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Create a span under the current one.
+
+    Outside a trace this is a no-op unless root is True, in which case the
+    span starts a new trace (for requests and background jobs).
+    """
+    if not _enabled:
+        return NOOP_SPAN
+    parent = _current.get()
+    if parent is None:
+        if not root:
+            return NOOP_SPAN
+        return Span(_Trace(), None, name, kind, attributes)
+    return Span(parent.trace, parent, name, kind, attributes)
+
+
+def traced(name: str, **attributes):
+    """Decorator: run every call of a function in a span."""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if not _enabled or _current.get() is None:
+                return function(*args, **kwargs)
+            with span(name, **attributes):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def current_span():
+    """The active span, or a no-op span outside a trace."""
+    return _current.get() or NOOP_SPAN
+
+
+def _finish_trace(trace: _Trace, root: Span):
+    """Tail sampling: write the trace if it was slow, failed, or was sampled."""
+    if not (root.end_ns - root.start_ns >= _threshold_ns or trace.error or random.random() < _sample_rate):
+        return
+    if trace.dropped:
+        root.attributes['trace.dropped_spans'] = trace.dropped
+    line = json.dumps(_encode_trace(trace), separators=(',', ':')) + '\n'
+    try:
+        # One write per line on an O_APPEND descriptor, so workers sharing the file never interleave
+        with _write_lock:
+            fd = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+    except OSError as e:
+        print(f"Warning: Could not write trace to {_path}: {e}")
+
+
+def _encode_value(value) -> dict:
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _encode_attributes(attributes: dict) -> list:
+    return [{'key': key, 'value': _encode_value(value)} for key, value in attributes.items()]
+
+
+def _encode_trace(trace: _Trace) -> dict:
+    """Encode a trace as an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for item in trace.spans:
+        encoded = {
+            'traceId': trace.trace_id,
+            'spanId': item.span_id,
+            'name': item.name,
+            'kind': item.kind,
+            'startTimeUnixNano': str(item.start_ns),
+            'endTimeUnixNano': str(item.end_ns),
+            'attributes': _encode_attributes(item.attributes),
+            'status': {'code': item.status}
+        }
+        if item.parent_id:
+            encoded['parentSpanId'] = item.parent_id
+        if item.message:
+            encoded['status']['message'] = item.message
+        spans.append(encoded)
+
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': _encode_attributes({'service.name': SERVICE_NAME, 'process.pid': os.getpid()})},
+            'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': spans}]
+        }]
+    }